@@ -1,11 +1,14 @@
 import requests
 import re
 import json
-import random
 import logging
 
+from custom_exceptions import AuthPogoException
+from rpc import RequestIds
 from session import PogoSession
+from throttle import RateController
 from location import Location
+from transport import tuneSession
 
 from gpsoauth import perform_master_login, perform_oauth
 
@@ -19,20 +22,37 @@ SERVICE = 'audience:server:client_id:848232511240-7so421jotr2609rmqakceuu1luuq0p
 APP = 'com.nianticlabs.pokemongo'
 CLIENT_SIG = '321187995bc7cdc2b5fc91b11a96e2baa8602c62'
 
-RPC_ID = int(random.random() * 10 ** 12)
+# Shared ids for callers outside a session
+RPC_IDS = RequestIds()
 
 
 def getRPCId():
-    global RPC_ID
-    RPC_ID = RPC_ID + 1
-    return RPC_ID
+    return RPC_IDS.next()
 
 
 class PokeAuthSession(object):
-    def __init__(self, username, password, provider='google', geo_key=None):
+    def __init__(self, username, password, provider='google', geo_key=None, transport=None, compact=False, bus=None, ttls=None, store=None):
         self.session = self.createRequestsSession()
         self.provider = provider
 
+        # RPC transport handed to every PogoSession, None for the default
+        self.transport = transport
+
+        # Slotted inventory records, for processes holding many accounts
+        self.compact = compact
+
+        # Map observations shared between sessions
+        self.bus = bus
+
+        # Seconds cached state is served for, see state.py
+        self.ttls = ttls
+
+        # What pacing the server tolerates, kept across logins
+        self.throttle = RateController()
+
+        # Checkpoints to come back from, see store.py
+        self.store = store
+
         # User credentials
         self.username = username
         self.password = password
@@ -47,7 +67,7 @@ class PokeAuthSession(object):
             'User-Agent': 'Niantic App',
         }
         session.verify = False
-        return session
+        return tuneSession(session)
 
     def createPogoSession(self, provider=None, locationLookup='', session=None, noop=False):
         if self.provider:
@@ -64,12 +84,7 @@ class PokeAuthSession(object):
             logging.info(location)
 
         if self.access_token and location:
-            return PogoSession(
-                self.session,
-                self.provider,
-                self.access_token,
-                location
-            )
+            return self.newPogoSession(location)
 
         # else something has gone wrong
         elif location is None:
@@ -78,6 +93,21 @@ class PokeAuthSession(object):
             logging.critical('Access token not generated')
         return None
 
+    def newPogoSession(self, location):
+        return PogoSession(
+            self.session,
+            self.provider,
+            self.access_token,
+            location,
+            transport=self.transport,
+            compact=self.compact,
+            bus=self.bus,
+            ttls=self.ttls,
+            throttle=self.throttle,
+            store=self.store,
+            account=self.username
+        )
+
     def createGoogleSession(self, locationLookup='', session=None, noop=False):
 
         logging.info('Creating Google session for %s', self.username)
@@ -147,6 +177,28 @@ class PokeAuthSession(object):
             "ptc": self.createPTCSession
         }[self.provider](locationLookup=locationLookup, noop=noop)
 
+    def resume(self, locationLookup=None):
+        """Carry on from the last checkpoint, logging in only if its ticket ran out"""
+        saved = self.store.load(self.username) if self.store else {}
+        if not saved or self.store.ticket(saved) is None:
+            return self.authenticate(locationLookup=locationLookup)
+
+        logging.info('Resuming %s from checkpoint', self.username)
+        if locationLookup is None:
+            location = Location.Noop()
+        else:
+            location = Location(locationLookup, self.geo_key)
+            coordinates = self.store.location(saved)
+            if coordinates is not None:
+                location.setCoordinates(*coordinates)
+
+        # The server can still turn the ticket down, we have no token to fall back on
+        try:
+            return self.newPogoSession(location)
+        except AuthPogoException as e:
+            logging.info('Checkpoint for %s refused (%s), logging in', self.username, e)
+            return self.authenticate(locationLookup=locationLookup)
+
     def reauthenticate(self, session):
         """Reauthenticate from an old session"""
         return {
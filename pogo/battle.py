@@ -0,0 +1,260 @@
+import numpy as np
+
+# Used for anything the game master's battle settings leave out
+BATTLE_DEFAULTS = {
+    'enemy_attack_interval': 1.5,
+    'round_duration_seconds': 100.0,
+    'maximum_attackers_per_battle': 6,
+    'same_type_attack_bonus_multiplier': 1.25,
+    'maximum_energy': 100,
+    'energy_delta_per_health_lost': 0.5,
+}
+
+# Gym defenders fight with double their stamina
+DEFENDER_HP_MULTIPLIER = 2
+
+# Moves the game master doesn't know take this long, so time still passes
+UNKNOWN_MOVE_MS = 500
+
+# Fields read off each PokemonData
+COLUMNS = (
+    'pokemon_id',
+    'individual_attack',
+    'individual_defense',
+    'cp_multiplier',
+    'additional_cp_multiplier',
+    'stamina_max',
+    'move_1',
+    'move_2',
+)
+
+
+class Combatants(object):
+    """Arrays over pokemon going into battle, one slot per pokemon in input order"""
+
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+    def __len__(self):
+        return len(self.hp)
+
+    def take(self, index):
+        return Combatants(**dict((k, v[index]) for k, v in self.__dict__.items()))
+
+
+class BattleOutcome(object):
+    """Per battle arrays: who won, how long it took, what was left"""
+
+    def __init__(self, won, timeMs, attackerHp, defenderHp, attackerLost, defenderLost):
+        self.won = won
+        self.timeMs = timeMs
+        self.attackerHp = attackerHp
+        self.defenderHp = defenderHp
+
+        # Fractions of each side's starting hp
+        self.attackerLost = attackerLost
+        self.defenderLost = defenderLost
+
+    def __len__(self):
+        return len(self.won)
+
+
+class BattleSimulator(object):
+    """Offline attacker against defender timelines from game master move settings"""
+
+    def __init__(self, gameMaster):
+        self.baseAttack = np.array(gameMaster.baseAttack, dtype=np.float64)
+        self.baseDefense = np.array(gameMaster.baseDefense, dtype=np.float64)
+        self.types = np.array(gameMaster.types, dtype=np.int64).reshape(-1, 2)
+
+        self.movePower = np.array(gameMaster.movePower, dtype=np.float64)
+        self.moveType = np.array(gameMaster.moveType, dtype=np.int64)
+        self.moveEnergy = np.array(gameMaster.moveEnergy, dtype=np.float64)
+        duration = np.array(gameMaster.moveDuration, dtype=np.float64)
+        self.moveDuration = np.where(duration > 0, duration, UNKNOWN_MOVE_MS)
+        self.moveDamageStart = np.minimum(
+            np.array(gameMaster.moveDamageStart, dtype=np.float64),
+            self.moveDuration
+        )
+
+        # Attack type, then defending type
+        self.typeEffective = np.array(gameMaster.typeEffective, dtype=np.float64)
+
+        settings = dict(BATTLE_DEFAULTS)
+        settings.update(gameMaster.battle)
+        self.enemyInterval = settings['enemy_attack_interval'] * 1000
+        self.roundMs = settings['round_duration_seconds'] * 1000
+        self.maxAttackers = settings['maximum_attackers_per_battle']
+        self.stab = settings['same_type_attack_bonus_multiplier']
+        self.maxEnergy = settings['maximum_energy']
+        self.energyPerHp = settings['energy_delta_per_health_lost']
+
+    def combatants(self, party, defending=False):
+        """Battle stats from PokemonData messages"""
+        count = len(party)
+        columns = dict(
+            (name, np.fromiter((getattr(p, name) for p in party), dtype=np.float64, count=count))
+            for name in COLUMNS
+        )
+
+        pokemonIds = columns['pokemon_id'].astype(np.int64)
+        cpm = columns['cp_multiplier'] + columns['additional_cp_multiplier']
+        return Combatants(
+            pokemonId=pokemonIds,
+            attack=(self.baseAttack[pokemonIds] + columns['individual_attack']) * cpm,
+            defense=(self.baseDefense[pokemonIds] + columns['individual_defense']) * cpm,
+            hp=columns['stamina_max'] * (DEFENDER_HP_MULTIPLIER if defending else 1),
+            quick=columns['move_1'].astype(np.int64),
+            charge=columns['move_2'].astype(np.int64),
+        )
+
+    def damage(self, moves, attacker, defender):
+        """Damage per hit of each move, pairwise over attacker and defender"""
+        moveType = self.moveType[moves]
+        own = self.types[attacker.pokemonId]
+        stab = np.where((moveType == own[:, 0]) | (moveType == own[:, 1]), self.stab, 1.0)
+
+        other = self.types[defender.pokemonId]
+        effective = self.typeEffective[moveType, other[:, 0]]
+        effective *= np.where(other[:, 1] > 0, self.typeEffective[moveType, other[:, 1]], 1.0)
+
+        return np.floor(
+            0.5 * self.movePower[moves] * attacker.attack / defender.defense * stab * effective
+        ) + 1
+
+    def side(self, own, other, extraMs=0):
+        """Everything the timeline needs about one side's two moves"""
+        chargeCost = -self.moveEnergy[own.charge]
+        return dict(
+            quickDamage=self.damage(own.quick, own, other),
+            chargeDamage=self.damage(own.charge, own, other),
+            quickWindow=self.moveDamageStart[own.quick],
+            chargeWindow=self.moveDamageStart[own.charge],
+            quickDuration=self.moveDuration[own.quick] + extraMs,
+            chargeDuration=self.moveDuration[own.charge] + extraMs,
+            quickEnergy=self.moveEnergy[own.quick],
+            chargeEnergy=self.moveEnergy[own.charge],
+
+            # A charge move that costs nothing is one we don't know
+            chargeCost=np.where(chargeCost > 0, chargeCost, np.inf),
+        )
+
+    def simulate(self, attackers, defenders, attackerHp=None, defenderHp=None, limitMs=None):
+        """Battles of attackers[i] against defenders[i], all stepped together"""
+        limitMs = self.roundMs if limitMs is None else limitMs
+        a = self.side(attackers, defenders)
+        d = self.side(defenders, attackers, self.enemyInterval)
+        startA = attackers.hp if attackerHp is None else np.asarray(attackerHp, dtype=np.float64)
+        startD = defenders.hp if defenderHp is None else np.asarray(defenderHp, dtype=np.float64)
+        hpA = startA.copy()
+        hpD = startD.copy()
+
+        count = len(hpA)
+        energyA = np.zeros(count)
+        energyD = np.zeros(count)
+        chargingA = np.zeros(count, dtype=bool)
+        chargingD = np.zeros(count, dtype=bool)
+        moveStartA = np.zeros(count)
+        moveStartD = np.zeros(count)
+        elapsed = np.zeros(count)
+        live = (hpA > 0) & (hpD > 0)
+
+        # One damage window per step, whichever side lands first
+        while live.any():
+            landsA = moveStartA + np.where(chargingA, a['chargeWindow'], a['quickWindow'])
+            landsD = moveStartD + np.where(chargingD, d['chargeWindow'], d['quickWindow'])
+            now = np.minimum(landsA, landsD)
+            live &= now <= limitMs
+            elapsed = np.where(live, now, elapsed)
+
+            hitA = live & (landsA <= landsD)
+            hitD = live & ~hitA
+
+            damageA = np.where(hitA, np.where(chargingA, a['chargeDamage'], a['quickDamage']), 0)
+            damageD = np.where(hitD, np.where(chargingD, d['chargeDamage'], d['quickDamage']), 0)
+            hpD -= damageA
+            hpA -= damageD
+
+            # Energy from the move used and from the hp lost
+            energyA += np.where(hitA, np.where(chargingA, a['chargeEnergy'], a['quickEnergy']), 0)
+            energyD += np.where(hitD, np.where(chargingD, d['chargeEnergy'], d['quickEnergy']), 0)
+            energyA += damageD * self.energyPerHp
+            energyD += damageA * self.energyPerHp
+            np.clip(energyA, 0, self.maxEnergy, out=energyA)
+            np.clip(energyD, 0, self.maxEnergy, out=energyD)
+
+            # Whoever landed starts their next move once this one is over
+            moveStartA += np.where(hitA, np.where(chargingA, a['chargeDuration'], a['quickDuration']), 0)
+            moveStartD += np.where(hitD, np.where(chargingD, d['chargeDuration'], d['quickDuration']), 0)
+            chargingA = np.where(hitA, energyA >= a['chargeCost'], chargingA)
+            chargingD = np.where(hitD, energyD >= d['chargeCost'], chargingD)
+
+            live &= (hpA > 0) & (hpD > 0)
+
+        hpA = np.maximum(hpA, 0)
+        hpD = np.maximum(hpD, 0)
+        return BattleOutcome(
+            won=(hpD <= 0) & (hpA > 0),
+            timeMs=elapsed,
+            attackerHp=hpA,
+            defenderHp=hpD,
+            attackerLost=(startA - hpA) / np.maximum(startA, 1),
+            defenderLost=(startD - hpD) / np.maximum(startD, 1),
+        )
+
+    def matchups(self, attackers, defenders):
+        """Every attacker against every defender, outcome arrays shaped (attackers, defenders)"""
+        rows = np.repeat(np.arange(len(attackers)), len(defenders))
+        cols = np.tile(np.arange(len(defenders)), len(attackers))
+        outcome = self.simulate(attackers.take(rows), defenders.take(cols))
+
+        shape = (len(attackers), len(defenders))
+        for name, value in outcome.__dict__.items():
+            setattr(outcome, name, value.reshape(shape))
+        return outcome
+
+    def lineup(self, party, defenders, size=None):
+        """Indexes into party of the attackers to bring, best first"""
+        size = size or self.maxAttackers
+        attackers = self.combatants(party)
+        outcome = self.matchups(attackers, self.combatants(defenders, defending=True))
+
+        # Defender hp taken per own hp spent, across the whole gym
+        spent = np.maximum(outcome.attackerLost.sum(axis=1), 1e-3)
+        score = outcome.defenderLost.sum(axis=1) / spent
+        return [int(i) for i in np.argsort(-score, kind='mergesort')[:size]]
+
+    def fight(self, party, lineup, defenders):
+        """Play a lineup through the defenders in order, returns (cleared, beaten, ms)"""
+        attackers = self.combatants([party[i] for i in lineup])
+        opponents = self.combatants(defenders, defending=True)
+        hpA = attackers.hp.copy()
+        hpD = opponents.hp.copy()
+
+        # One round clock for the whole gym, energy starts over each matchup
+        a = d = 0
+        elapsed = 0.0
+        while a < len(attackers) and d < len(opponents):
+            outcome = self.simulate(
+                attackers.take([a]),
+                opponents.take([d]),
+                hpA[a:a + 1],
+                hpD[d:d + 1],
+                limitMs=self.roundMs - elapsed
+            )
+            hpA[a] = outcome.attackerHp[0]
+            hpD[d] = outcome.defenderHp[0]
+            elapsed += outcome.timeMs[0]
+            if hpA[a] > 0 and hpD[d] > 0:
+                break
+            if hpD[d] <= 0:
+                d += 1
+            if hpA[a] <= 0:
+                a += 1
+
+        return d == len(opponents), d, elapsed
+
+
+def defendersOf(gymState):
+    """Defending PokemonData from a GetGymDetailsResponse.gym_state"""
+    return [membership.pokemon_data for membership in gymState.memberships]
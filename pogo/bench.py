@@ -0,0 +1,500 @@
+#!/usr/bin/python
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+
+import POGOProtos
+from POGOProtos.Networking.Requests import Request_pb2
+from POGOProtos.Networking.Requests import RequestType_pb2
+from POGOProtos.Networking.Envelopes import RequestEnvelope_pb2
+from POGOProtos.Networking.Envelopes import ResponseEnvelope_pb2
+from POGOProtos.Networking.Responses import GetInventoryResponse_pb2
+from POGOProtos.Data import PokemonData_pb2
+from POGOProtos.Data.Battle import BattleState_pb2
+from POGOProtos.Map.Fort import FortData_pb2
+
+from battle import BattleSimulator, UNKNOWN_MOVE_MS, defendersOf
+from compact import memoryReport
+from gamemaster import GameMaster
+from gyms import ATTACK_SERVER_INTERVAL, BattleLoop, GymBattle, attackStream
+from inventory import Inventory, items
+from localserver import GymServer, LocalServer
+from location import Location
+from recorder import RecordingTransport, ReplayTransport
+from session import PogoSession
+from store import BACKENDS, CheckpointWriter
+from throttle import RateController
+import buffers
+from pokedex import pokedex
+from transport import RequestsTransport, tuneSession
+
+from google.protobuf.internal import api_implementation
+import requests
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, samples, extra=''):
+    logging.info(
+        '%-10s n=%d p50=%.3fms p99=%.3fms max=%.3fms %s',
+        name,
+        len(samples),
+        percentile(samples, 50) * 1000,
+        percentile(samples, 99) * 1000,
+        max(samples) * 1000,
+        extra
+    )
+
+
+def createEnvelope(size):
+    return RequestEnvelope_pb2.RequestEnvelope(
+        status_code=2,
+        request_id=1,
+        requests=[Request_pb2.Request(
+            request_type=RequestType_pb2.GET_MAP_OBJECTS,
+            request_message=b'\x00' * size
+        )]
+    ).SerializeToString()
+
+
+# Compare stock requests against the tuned transport, the difference
+# shows in connections opened and throughput once threads outnumber
+# the stock pool, latency on localhost is mostly the GIL
+def benchTransport(args):
+    data = createEnvelope(args.size)
+    sessions = {
+        'default': lambda: requests.session(),
+        'tuned': lambda: tuneSession(requests.session(), compress=args.gzip),
+    }
+
+    for name in ['default', 'tuned']:
+        server = LocalServer(compress=args.gzip).start()
+        transport = RequestsTransport(sessions[name]())
+        samples = []
+        lock = threading.Lock()
+
+        def worker():
+            local = []
+            for _ in range(args.number):
+                start = time.time()
+                transport.post(server.url, data).content
+                local.append(time.time() - start)
+            with lock:
+                samples.extend(local)
+
+        start = time.time()
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        report(name, samples, 'connections={0} rpcs/s={1:.0f}'.format(
+            server.connections,
+            len(samples) / elapsed
+        ))
+        transport.close()
+        server.stop()
+
+
+# Copying content versus reading into pooled buffers
+def benchBuffers(args):
+    data = createEnvelope(args.size)
+    server = LocalServer().start()
+    transport = RequestsTransport(tuneSession(requests.session()))
+
+    def copying():
+        res = ResponseEnvelope_pb2.ResponseEnvelope()
+        content = transport.post(server.url, data).content
+        res.ParseFromString(content)
+        returns = list(res.returns)
+        return len(content) + sum(len(r) for r in returns)
+
+    def pooled():
+        res = buffers.parseEnvelope(transport.postInto(server.url, data, buffers.pool).content)
+        return len(res.returns)
+
+    copied = 0
+    samples = []
+    for _ in range(args.number):
+        start = time.time()
+        copied += copying()
+        samples.append(time.time() - start)
+    report('copying', samples, 'bytesCopiedPerRpc={0}'.format(copied // args.number))
+
+    buffers.stats.reset()
+    samples = []
+    for _ in range(args.number):
+        start = time.time()
+        pooled()
+        samples.append(time.time() - start)
+    stats = buffers.stats.report()
+    report('pooled', samples, 'bytesCopiedPerRpc={0} peakBuffer={1} slices={2}'.format(
+        stats['bytesCopiedPerRpc'],
+        stats['peakBuffer'],
+        buffers.SLICES_SUPPORTED
+    ))
+
+    transport.close()
+    server.stop()
+
+
+# Record a session against the local server
+def benchRecord(args):
+    server = LocalServer().start()
+    transport = RecordingTransport(RequestsTransport(), args.recording)
+    session = createOfflineSession(transport, server.url)
+    for _ in range(args.iterations):
+        session.fetchProfile()
+    transport.close()
+    server.stop()
+    logging.info('Recorded %d exchanges to %s', args.iterations + 1, args.recording)
+
+
+def createOfflineSession(transport, url, throttle=None):
+    location = Location.Noop()
+    location.setCoordinates(0.0, 0.0)
+    location.altitude = 0.0
+    location.noop = False
+    return PogoSession(None, 'ptc', '', location, transport=transport, endpoint=url, throttle=throttle)
+
+
+# Many synthetic sessions sharing one recording
+def benchReplay(args):
+    replay = ReplayTransport(args.recording, speed=args.speed)
+
+    # Every call is a real send now, time the client rather than its pacing
+    sessions = [
+        createOfflineSession(
+            replay.fork(),
+            'http://replay/rpc',
+            throttle=RateController(start=float('inf'), maximum=float('inf'))
+        )
+        for _ in range(args.sessions)
+    ]
+
+    samples = []
+    lock = threading.Lock()
+
+    def worker(session):
+        local = []
+        for _ in range(args.iterations):
+            start = time.time()
+            session.fetchProfile()
+            local.append(time.time() - start)
+        with lock:
+            samples.extend(local)
+
+    start = time.time()
+    threads = [threading.Thread(target=worker, args=(s,)) for s in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    report('replay', samples, 'sessions={0} rpcs/s={1:.0f}'.format(
+        args.sessions,
+        len(samples) / elapsed
+    ))
+
+
+
+def createInventory(size=1000, seed=0):
+    """Serialized GetInventoryResponse shaped like a mid level account"""
+    rng = random.Random(seed)
+    res = GetInventoryResponse_pb2.GetInventoryResponse(success=True)
+    delta = res.inventory_delta
+
+    def add():
+        item = delta.inventory_items.add()
+        item.modified_timestamp_ms = rng.randint(1468000000000, 1470000000000)
+        return item.inventory_item_data
+
+    stats = add().player_stats
+    stats.level = 22
+    stats.experience = 300000
+    stats.km_walked = 120.5
+
+    incubator = add().egg_incubators.egg_incubator.add()
+    incubator.id = 'EggIncubatorProto4824214944684084552'
+    incubator.item_id = items.INCUBATOR_BASIC_UNLIMITED
+
+    applied = add().applied_items.item.add()
+    applied.item_id = items.LUCKY_EGG
+    applied.expire_ms = 1470000000000
+
+    for itemId in items:
+        if itemId == items.UNKNOWN:
+            continue
+        data = add().item
+        data.item_id = itemId
+        data.count = rng.randint(0, 100)
+
+    species = range(1, 152)
+    families = sorted(set(pokedex.familyTable[i] for i in species))
+    for pokemonId in species:
+        entry = add().pokedex_entry
+        entry.pokemon_id = pokemonId
+        entry.times_encountered = rng.randint(1, 100)
+        entry.times_captured = rng.randint(0, entry.times_encountered)
+    for familyId in families:
+        family = add().pokemon_family
+        family.family_id = familyId
+        family.candy = rng.randint(0, 300)
+
+    eggs = 9
+    for i in range(max(0, size - len(delta.inventory_items))):
+        pokemon = add().pokemon_data
+        pokemon.id = rng.getrandbits(64)
+        pokemon.creation_time_ms = rng.randint(1468000000000, 1470000000000)
+        if i < eggs:
+            pokemon.is_egg = True
+            pokemon.egg_km_walked_target = rng.choice((2.0, 5.0, 10.0))
+            continue
+        pokemon.pokemon_id = rng.choice(species)
+        pokemon.cp = rng.randint(10, 2500)
+        pokemon.stamina = pokemon.stamina_max = rng.randint(10, 200)
+        pokemon.move_1 = rng.randint(200, 240)
+        pokemon.move_2 = rng.randint(13, 110)
+        pokemon.height_m = rng.uniform(0.2, 3.0)
+        pokemon.weight_kg = rng.uniform(1.0, 400.0)
+        pokemon.individual_attack = rng.randint(0, 15)
+        pokemon.individual_defense = rng.randint(0, 15)
+        pokemon.individual_stamina = rng.randint(0, 15)
+        pokemon.cp_multiplier = rng.uniform(0.094, 0.7317)
+        pokemon.pokeball = items.POKE_BALL
+        pokemon.captured_cell_id = rng.getrandbits(64)
+        pokemon.num_upgrades = rng.randint(0, 10)
+        pokemon.favorite = int(rng.random() < 0.05)
+
+    return res.SerializeToString()
+
+
+def parseInventory(content, compact=False):
+    if compact:
+        return Inventory.fromBytes(content, compact=True)
+    res = GetInventoryResponse_pb2.GetInventoryResponse()
+    res.ParseFromString(content)
+    return Inventory(res.inventory_delta.inventory_items, compact=compact)
+
+
+# Memory held per account, protobuf messages against slotted records
+def benchMemory(args):
+    contents = [createInventory(args.size, seed) for seed in range(args.accounts)]
+    for name, compact in (('messages', False), ('compact', True)):
+        totals = {}
+        for content in contents:
+            inventory = parseInventory(content, compact)
+            for key, size in memoryReport(inventory).items():
+                totals[key] = totals.get(key, 0) + size
+        logging.info(
+            '%-10s per account: party=%dKB eggs=%dKB pokedex=%dKB total=%dKB',
+            name,
+            totals['party'] // args.accounts // 1024,
+            totals['eggs'] // args.accounts // 1024,
+            totals['pokedex'] // args.accounts // 1024,
+            sum(totals.values()) // args.accounts // 1024
+        )
+
+
+# Inventory build time, run with PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION
+# set to python or cpp to compare backends
+def benchDecode(args):
+    contents = [createInventory(args.size, seed) for seed in range(args.accounts)]
+
+    samples = []
+    for _ in range(args.number):
+        responses = []
+        for content in contents:
+            res = GetInventoryResponse_pb2.GetInventoryResponse()
+            start = time.time()
+            res.ParseFromString(content)
+            samples.append(time.time() - start)
+            responses.append(res)
+    report('parse', samples, 'backend={0}'.format(api_implementation.Type()))
+
+    samples = []
+    for _ in range(args.number):
+        for res in responses:
+            start = time.time()
+            Inventory(res.inventory_delta.inventory_items)
+            samples.append(time.time() - start)
+    report('messages', samples, 'backend={0} items={1}'.format(api_implementation.Type(), args.size))
+
+    # Compact records come straight from the bytes, so their time includes the parse
+    samples = []
+    for _ in range(args.number):
+        for content in contents:
+            start = time.time()
+            Inventory.fromBytes(content, compact=True)
+            samples.append(time.time() - start)
+    report('compact', samples, 'backend={0} items={1} parse included'.format(api_implementation.Type(), args.size))
+
+
+# Battles simulated per second, needs a cached game master
+def benchBattle(args):
+    simulator = BattleSimulator(GameMaster().load())
+    party = parseInventory(createInventory(args.size)).party
+    defenders = party[:args.defenders]
+
+    samples = []
+    for _ in range(args.number):
+        start = time.time()
+        simulator.lineup(party, defenders)
+        samples.append(time.time() - start)
+    report('lineup', samples, 'battles/s={0:.0f}'.format(
+        len(party) * len(defenders) * len(samples) / sum(samples)
+    ))
+
+
+# Concurrent battles against the local gym stand-in, all sent from one loop
+def benchGym(args):
+    gameMaster = GameMaster()
+    if not gameMaster.loadCached():
+        logging.info('No cached game master, every move takes %dms', UNKNOWN_MOVE_MS)
+
+    gym = GymServer([PokemonData_pb2.PokemonData(id=1, pokemon_id=pokedex.SNORLAX, stamina_max=args.hp)])
+    server = LocalServer(handler=gym).start()
+    fort = FortData_pb2.FortData(id='gym', latitude=0.0, longitude=0.0)
+    party = parseInventory(createInventory(args.size)).party
+
+    transport = RequestsTransport()
+    loop = BattleLoop()
+    for i in range(args.battles):
+        session = createOfflineSession(transport, server.url)
+        defender = defendersOf(session.getGymDetails(fort).gym_state)[0]
+        loop.add(GymBattle.start(
+            session,
+            fort,
+            [party[i % len(party)]],
+            defender.id,
+            actions=lambda battle: attackStream(gameMaster, battle),
+            interval=args.interval
+        ))
+
+    start = time.time()
+    finished = loop.run()
+    elapsed = time.time() - start
+    transport.close()
+    server.stop()
+
+    rpcs = sum(b.rpcs for b in finished)
+    sent = sum(b.sent for b in finished)
+    logging.info(
+        'gym       battles=%d won=%d rpcs=%d actions=%d actions/rpc=%.1f seconds=%.1f',
+        len(finished),
+        sum(1 for b in finished if b.state == BattleState_pb2.VICTORY),
+        rpcs,
+        sent,
+        float(sent) / rpcs if rpcs else 0,
+        elapsed
+    )
+
+
+# Checkpoint rounds for many accounts, a round being every field of every account
+def benchCheckpoint(args):
+    inventory = createInventory(args.size)
+    fields = {'profile': b'\x00' * 512, 'eggs': b'', 'badges': b'', 'settings': b'\x00' * 2048, 'inventory': inventory}
+
+    for name in args.backends.split(','):
+        path = '{0}.{1}'.format(args.path, name)
+        backend = BACKENDS[name](path)
+        writer = CheckpointWriter(backend, interval=3600)
+
+        samples = []
+        for _ in range(args.rounds):
+            for account in range(args.accounts):
+                for field, value in fields.items():
+                    writer.put(str(account), field, value)
+            start = time.time()
+            writer.flush()
+            samples.append(time.time() - start)
+
+        start = time.time()
+        backend.read('0')
+        readMs = (time.time() - start) * 1000
+        writer.close()
+        backend.close()
+        written = args.accounts * len(fields) * args.rounds
+        report(name, samples, 'records/s={0:.0f} MB/s={1:.1f} restore={2:.2f}ms'.format(
+            written / sum(samples),
+            args.accounts * sum(len(v) for v in fields.values()) * args.rounds / sum(samples) / 1e6,
+            readMs
+        ))
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.getLogger('requests').setLevel(logging.ERROR)
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers()
+
+    transport = sub.add_parser('transport', help='Connection reuse and tail latency')
+    transport.add_argument('-n', '--number', type=int, default=500, help='Requests per thread')
+    transport.add_argument('-t', '--threads', type=int, default=16, help='Concurrent callers')
+    transport.add_argument('-s', '--size', type=int, default=512, help='Payload bytes')
+    transport.add_argument('-z', '--gzip', action='store_true', help='Negotiate gzip')
+    transport.set_defaults(func=benchTransport)
+
+    buffered = sub.add_parser('buffers', help='Bytes copied per response')
+    buffered.add_argument('-n', '--number', type=int, default=200, help='Requests')
+    buffered.add_argument('-s', '--size', type=int, default=256 * 1024, help='Payload bytes')
+    buffered.set_defaults(func=benchBuffers)
+
+    record = sub.add_parser('record', help='Record traffic against the local server')
+    record.add_argument('-r', '--recording', default='session.rec', help='Output file')
+    record.add_argument('-i', '--iterations', type=int, default=50, help='Profile calls')
+    record.set_defaults(func=benchRecord)
+
+    replay = sub.add_parser('replay', help='Replay a recording with many sessions')
+    replay.add_argument('-r', '--recording', default='session.rec', help='Input file')
+    replay.add_argument('-n', '--sessions', type=int, default=100, help='Synthetic sessions')
+    replay.add_argument('-i', '--iterations', type=int, default=50, help='Profile calls per session')
+    replay.add_argument('-x', '--speed', type=float, default=0, help='Replay speed, 0 for no delay')
+    replay.set_defaults(func=benchReplay)
+
+    memory = sub.add_parser('memory', help='Inventory memory per account')
+    memory.add_argument('-a', '--accounts', type=int, default=20, help='Accounts to build')
+    memory.add_argument('-s', '--size', type=int, default=1000, help='Inventory items per account')
+    memory.set_defaults(func=benchMemory)
+
+    decode = sub.add_parser('decode', help='Inventory build time')
+    decode.add_argument('-a', '--accounts', type=int, default=5, help='Distinct inventories')
+    decode.add_argument('-n', '--number', type=int, default=20, help='Builds per inventory')
+    decode.add_argument('-s', '--size', type=int, default=1000, help='Inventory items per account')
+    decode.set_defaults(func=benchDecode)
+
+    battle = sub.add_parser('battle', help='Gym lineups from simulated battles')
+    battle.add_argument('-n', '--number', type=int, default=20, help='Lineups to pick')
+    battle.add_argument('-s', '--size', type=int, default=300, help='Inventory items, most become the party')
+    battle.add_argument('-d', '--defenders', type=int, default=6, help='Gym defenders')
+    battle.set_defaults(func=benchBattle)
+
+    gymParser = sub.add_parser('gym', help='Concurrent battles against the local gym server')
+    gymParser.add_argument('-n', '--battles', type=int, default=50, help='Battles at once')
+    gymParser.add_argument('-p', '--hp', type=int, default=100, help='Defender stamina, doubled in battle')
+    gymParser.add_argument('-i', '--interval', type=float, default=ATTACK_SERVER_INTERVAL, help='Seconds between sends')
+    gymParser.add_argument('-s', '--size', type=int, default=300, help='Inventory items, the party attacks')
+    gymParser.set_defaults(func=benchGym)
+
+    checkpoint = sub.add_parser('checkpoint', help='Batched session checkpoints')
+    checkpoint.add_argument('-a', '--accounts', type=int, default=1000, help='Accounts per round')
+    checkpoint.add_argument('-r', '--rounds', type=int, default=10, help='Checkpoint rounds')
+    checkpoint.add_argument('-s', '--size', type=int, default=300, help='Inventory items per account')
+    checkpoint.add_argument('-b', '--backends', default='sqlite,mmap', help='Backends to compare')
+    checkpoint.add_argument('-p', '--path', default='bench-checkpoints', help='Store file prefix')
+    checkpoint.set_defaults(func=benchCheckpoint)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,259 @@
+from POGOProtos.Networking.Envelopes import ResponseEnvelope_pb2
+
+import threading
+
+# Field number of ResponseEnvelope.returns
+RETURNS_FIELD = 100
+
+# Wire types we know how to skip
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH = 2
+WIRE_FIXED32 = 5
+
+
+def _probeSlices():
+    """Check if this protobuf backend parses straight from a memoryview"""
+    probe = ResponseEnvelope_pb2.ResponseEnvelope(status_code=2)
+    data = bytearray(probe.SerializeToString())
+    try:
+        parsed = ResponseEnvelope_pb2.ResponseEnvelope()
+        parsed.ParseFromString(memoryview(data))
+        return parsed.status_code == 2
+    except Exception:
+        return False
+
+SLICES_SUPPORTED = _probeSlices()
+
+
+class CopyStats(object):
+    """Counts what the response path costs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.rpcs = 0
+        self.bytesReceived = 0
+        self.bytesCopied = 0
+        self.peakBuffer = 0
+
+    def record(self, received, copied):
+        with self._lock:
+            self.rpcs += 1
+            self.bytesReceived += received
+            self.bytesCopied += copied
+
+    def buffered(self, size):
+        self.peakBuffer = max(self.peakBuffer, size)
+
+    def report(self):
+        rpcs = self.rpcs or 1
+        return {
+            'rpcs': self.rpcs,
+            'bytesReceived': self.bytesReceived,
+            'bytesCopied': self.bytesCopied,
+            'bytesCopiedPerRpc': self.bytesCopied / rpcs,
+            'copiesPerRpc': float(self.bytesCopied) / (self.bytesReceived or 1),
+            'peakBuffer': self.peakBuffer,
+            'poolBytes': pool.size(),
+        }
+
+stats = CopyStats()
+
+
+def _exported(buf):
+    """True while any memoryview still points into buf"""
+    try:
+        buf.append(0)
+    except BufferError:
+        return True
+    buf.pop()
+    return False
+
+
+class _PooledBuffer(bytearray):
+    leased = False
+
+
+class BufferPool(object):
+    """Reusable bytearrays, a buffer is free again once nothing views it"""
+
+    def __init__(self, initial=64 * 1024, limit=32):
+        self.initial = initial
+        self.limit = limit
+        self._buffers = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            for buf in self._buffers:
+                if not buf.leased and not _exported(buf):
+                    buf.leased = True
+                    return buf
+
+            buf = _PooledBuffer(self.initial)
+            buf.leased = True
+            if len(self._buffers) < self.limit:
+                self._buffers.append(buf)
+            return buf
+
+    def handOff(self, buf, length):
+        """Swap the lease for a view, the view now keeps buf busy"""
+        view = memoryview(buf)[:length]
+        buf.leased = False
+        stats.buffered(len(buf))
+        return view
+
+    def size(self):
+        return sum(len(buf) for buf in self._buffers)
+
+pool = BufferPool()
+
+
+def readInto(raw, buf):
+    """Stream a file-like body into a leased buf, growing it if needed"""
+    length = 0
+    while True:
+        if length == len(buf):
+            buf.extend(bytearray(len(buf)))
+        view = memoryview(buf)
+        read = raw.readinto(view[length:])
+        del view
+        if not read:
+            return length
+        length += read
+
+
+def _byteAt(data, pos):
+    value = data[pos]
+    return ord(value) if isinstance(value, str) else value
+
+
+def _varint(data, pos, length):
+    result = 0
+    shift = 0
+    while True:
+        # Pooled buffers run on past the body, never read beyond length
+        if pos >= length or shift > 63:
+            raise ValueError('Truncated varint at {0}'.format(pos))
+        b = _byteAt(data, pos)
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def scanEnvelope(data, length):
+    """Split a serialized envelope into header ranges and returns ranges"""
+    header = []
+    returns = []
+    pos = 0
+    while pos < length:
+        start = pos
+        tag, pos = _varint(data, pos, length)
+        field, wire = tag >> 3, tag & 7
+        if wire == WIRE_VARINT:
+            _, pos = _varint(data, pos, length)
+        elif wire == WIRE_FIXED64:
+            pos += 8
+        elif wire == WIRE_FIXED32:
+            pos += 4
+        elif wire == WIRE_LENGTH:
+            size, pos = _varint(data, pos, length)
+            if pos + size > length:
+                raise ValueError('Field {0} runs past the body'.format(field))
+            if field == RETURNS_FIELD:
+                returns.append((pos, pos + size))
+                pos += size
+                continue
+            pos += size
+        else:
+            return None
+        if pos > length:
+            raise ValueError('Field {0} runs past the body'.format(field))
+
+        # Coalesce neighbouring header fields
+        if header and header[-1][1] == start:
+            header[-1] = (header[-1][0], pos)
+        else:
+            header.append((start, pos))
+    return header, returns
+
+
+def iterFields(data, start, end):
+    """(field, start, end) of each length delimited field in data[start:end]"""
+    pos = start
+    while pos < end:
+        tag, pos = _varint(data, pos, end)
+        field, wire = tag >> 3, tag & 7
+        if wire == WIRE_VARINT:
+            _, pos = _varint(data, pos, end)
+        elif wire == WIRE_FIXED64:
+            pos += 8
+        elif wire == WIRE_FIXED32:
+            pos += 4
+        elif wire == WIRE_LENGTH:
+            size, pos = _varint(data, pos, end)
+            if pos + size > end:
+                raise ValueError('Field {0} runs past the message'.format(field))
+            yield field, pos, pos + size
+            pos += size
+            continue
+        else:
+            raise ValueError('Unknown wire type {0}'.format(wire))
+        if pos > end:
+            raise ValueError('Field {0} runs past the message'.format(field))
+
+
+class Response(object):
+    """ResponseEnvelope whose returns may be views into a pooled buffer"""
+    __slots__ = ('envelope', 'returns')
+
+    def __init__(self, envelope, returns):
+        self.envelope = envelope
+        self.returns = returns
+
+    def __getattr__(self, name):
+        return getattr(self.envelope, name)
+
+    def __str__(self):
+        return str(self.envelope)
+
+
+def parseEnvelope(content):
+    """Parse a response body without copying the returns where we can"""
+    if isinstance(content, memoryview):
+        data, length = content.obj if hasattr(content, 'obj') else content, len(content)
+    else:
+        data, length = content, len(content)
+
+    envelope = ResponseEnvelope_pb2.ResponseEnvelope()
+    scanned = scanEnvelope(data, length)
+
+    # Groups or garbage, let protobuf deal with it
+    if scanned is None:
+        envelope.ParseFromString(memoryview(content).tobytes())
+        stats.record(length, length)
+        return Response(envelope, list(envelope.returns))
+
+    header, ranges = scanned
+    view = memoryview(data)
+    copied = 0
+    for start, end in header:
+        if SLICES_SUPPORTED:
+            envelope.MergeFromString(view[start:end])
+        else:
+            envelope.MergeFromString(view[start:end].tobytes())
+            copied += end - start
+
+    if SLICES_SUPPORTED:
+        returns = [view[start:end] for start, end in ranges]
+    else:
+        returns = [view[start:end].tobytes() for start, end in ranges]
+        copied += sum(end - start for start, end in ranges)
+
+    stats.record(length, copied)
+    return Response(envelope, returns)
@@ -0,0 +1,105 @@
+import numpy as np
+
+# Fields read off each PokemonData
+COLUMNS = (
+    'pokemon_id',
+    'individual_attack',
+    'individual_defense',
+    'individual_stamina',
+    'cp_multiplier',
+    'additional_cp_multiplier',
+    'cp',
+)
+
+
+class PartyStats(object):
+    """Arrays over a party, one slot per pokemon in input order"""
+
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+    def __len__(self):
+        return len(self.iv)
+
+
+class Calculator(object):
+    """Vectorised IV, level, CP and power up costs from game master tables"""
+
+    def __init__(self, gameMaster):
+        # Whole levels come from the game master, half levels sit between
+        cpm = np.array(gameMaster.cpMultiplier, dtype=np.float64)
+        self.levelCpm = np.empty(len(cpm) * 2 - 1)
+        self.levelCpm[0::2] = cpm
+        self.levelCpm[1::2] = np.sqrt((cpm[:-1] ** 2 + cpm[1:] ** 2) / 2)
+        self.levels = 1 + np.arange(len(self.levelCpm)) / 2.0
+
+        self.baseAttack = np.array(gameMaster.baseAttack, dtype=np.float64)
+        self.baseDefense = np.array(gameMaster.baseDefense, dtype=np.float64)
+        self.baseStamina = np.array(gameMaster.baseStamina, dtype=np.float64)
+        self.family = np.array(gameMaster.family, dtype=np.int64)
+
+        # Every half level step costs the price of the level it starts on
+        self.levelsAbovePlayer = gameMaster.levelsAbovePlayer
+        steps = np.arange(len(self.levelCpm) - 1) // 2
+        candy = np.array(gameMaster.candyCost or (0,), dtype=np.int64)
+        dust = np.array(gameMaster.stardustCost or (0,), dtype=np.int64)
+        self.cumCandy = np.concatenate(([0], np.cumsum(candy[np.minimum(steps, len(candy) - 1)])))
+        self.cumStardust = np.concatenate(([0], np.cumsum(dust[np.minimum(steps, len(dust) - 1)])))
+
+    @staticmethod
+    def columns(party):
+        """Struct of arrays from PokemonData messages"""
+        count = len(party)
+        return dict(
+            (name, np.fromiter((getattr(p, name) for p in party), dtype=np.float64, count=count))
+            for name in COLUMNS
+        )
+
+    def levelIndex(self, cpm):
+        """Nearest half level for each total cp multiplier"""
+        index = np.searchsorted(self.levelCpm, cpm)
+        index = np.clip(index, 1, len(self.levelCpm) - 1)
+        lower = self.levelCpm[index - 1]
+        upper = self.levelCpm[index]
+        return np.where(cpm - lower < upper - cpm, index - 1, index)
+
+    def cp(self, pokemonIds, attack, defense, stamina, cpm):
+        value = (
+            (self.baseAttack[pokemonIds] + attack) *
+            np.sqrt(self.baseDefense[pokemonIds] + defense) *
+            np.sqrt(self.baseStamina[pokemonIds] + stamina) *
+            cpm ** 2 / 10
+        )
+        return np.maximum(10, np.floor(value)).astype(np.int64)
+
+    def capIndex(self, trainerLevel):
+        """Highest half level a trainer may power up to"""
+        cap = 2 * (trainerLevel - 1) + 2 * self.levelsAbovePlayer - 1
+        return max(0, min(cap, len(self.levelCpm) - 1))
+
+    def calculate(self, party, trainerLevel, columns=None):
+        """Stats for a whole party (or several, concatenated) at once"""
+        if columns is None:
+            columns = self.columns(party)
+
+        pokemonIds = columns['pokemon_id'].astype(np.int64)
+        attack = columns['individual_attack']
+        defense = columns['individual_defense']
+        stamina = columns['individual_stamina']
+        cpm = columns['cp_multiplier'] + columns['additional_cp_multiplier']
+
+        index = self.levelIndex(cpm)
+        cap = self.capIndex(trainerLevel)
+        target = np.maximum(index, cap)
+
+        return PartyStats(
+            pokemonId=pokemonIds,
+            family=self.family[pokemonIds],
+            iv=(attack + defense + stamina) / 45.0 * 100,
+            level=self.levels[index],
+            cp=columns['cp'].astype(np.int64),
+            maxCp=self.cp(pokemonIds, attack, defense, stamina, self.levelCpm[target]),
+            perfectCp=self.cp(pokemonIds, 15, 15, 15, self.levelCpm[target]),
+            candyToMax=self.cumCandy[target] - self.cumCandy[index],
+            stardustToMax=self.cumStardust[target] - self.cumStardust[index],
+        )
@@ -0,0 +1,246 @@
+from custom_exceptions import GeneralPogoException
+from inventory import items
+from pokedex import pokedex, Rarity
+
+import logging
+import time
+
+# Catch statuses
+CATCH_SUCCESS = 1
+CATCH_ESCAPE = 2
+CATCH_FLEE = 3
+CATCH_MISSED = 4
+
+# Anything we can throw
+BALLS = (items.POKE_BALL, items.GREAT_BALL, items.ULTRA_BALL, items.MASTER_BALL)
+
+# What one of each costs, in poke balls
+ITEM_COST = {
+    items.POKE_BALL: 1.0,
+    items.GREAT_BALL: 2.0,
+    items.ULTRA_BALL: 4.0,
+    items.MASTER_BALL: 100.0,
+    items.RAZZ_BERRY: 2.0,
+}
+
+# Worth of a catch, in poke balls, XP and candy make even critters pay
+RARITY_VALUE = {
+    Rarity.CRITTER: 8.0,
+    Rarity.COMMON: 10.0,
+    Rarity.UNCOMMON: 14.0,
+    Rarity.RARE: 25.0,
+    Rarity.VERY_RARE: 40.0,
+    Rarity.EPIC: 80.0,
+    Rarity.LEGENDARY: 1000.0,
+    Rarity.MYTHIC: 1000.0,
+}
+
+RAZZ_MULTIPLIER = 1.5
+
+
+def rarityValue(pokemonId):
+    return RARITY_VALUE.get(pokedex.getRarityById(pokemonId), RARITY_VALUE[Rarity.COMMON])
+
+
+class CatchPlan(object):
+    """Throws in order, each (berry, ball, chance, flee), with what they should earn"""
+
+    def __init__(self, throws, value):
+        self.throws = throws
+        self.value = value
+
+        # Walk the plan once for the expectations
+        alive = 1.0
+        self.balls = 0.0
+        self.berries = 0.0
+        self.catchChance = 0.0
+        for berry, ball, chance, flee in throws:
+            self.balls += alive
+            self.berries += alive if berry else 0.0
+            self.catchChance += alive * chance
+            alive *= (1 - chance) * (1 - flee)
+
+    def __len__(self):
+        return len(self.throws)
+
+    def ballsPerCatch(self):
+        return self.balls / self.catchChance if self.catchChance else float('inf')
+
+    def __str__(self):
+        return 'CatchPlan: {0} throws, {1:.0%} catch, {2:.2f} balls per catch'.format(
+            len(self.throws),
+            self.catchChance,
+            self.ballsPerCatch()
+        )
+
+
+class CatchStrategy(object):
+    """Expected cost optimal berries and balls, planned once per encounter"""
+
+    def __init__(self, value=rarityValue, fleeRate=0.1, limit=5, bucket=0.05, costs=None):
+        # value: pokemonId to worth of a catch, in poke balls
+        # fleeRate: chance it runs after each miss
+        # bucket: probabilities are rounded to this, so plans can be cached
+        self.value = value
+        self.fleeRate = fleeRate
+        self.limit = limit
+        self.bucket = bucket
+        self.costs = dict(costs or ITEM_COST)
+        self._plans = {}
+
+        # Running totals, for tuning
+        self.encounters = 0
+        self.catches = 0
+        self.ballsThrown = 0
+        self.berriesUsed = 0
+        self.expectedBalls = 0.0
+        self.expectedCatches = 0.0
+
+    def round(self, chance):
+        return min(1.0, round(chance / self.bucket) * self.bucket)
+
+    def plan(self, pokemonId, probability, bag):
+        """Plan for an EncounterResponse.capture_probability and a bag"""
+        chances = tuple(sorted(
+            (ball, self.round(chance))
+            for ball, chance in zip(probability.pokeball_type, probability.capture_probability)
+        ))
+
+        # Counts past the throw limit never change the plan
+        counts = tuple(min(bag.get(ball, 0), self.limit) for ball, _ in chances)
+        berries = min(bag.get(items.RAZZ_BERRY, 0), self.limit)
+
+        key = (pokemonId, chances, counts, berries)
+        if key not in self._plans:
+            self._plans[key] = self.search(self.value(pokemonId), chances, counts, berries)
+        return self._plans[key]
+
+    def search(self, value, chances, counts, berries):
+        flee = self.fleeRate
+        memo = {}
+
+        # Best expected profit with t throws left, and the throw that gets it
+        def best(t, counts, berries):
+            if t == 0:
+                return 0.0, None
+            key = (t, counts, berries)
+            if key in memo:
+                return memo[key]
+
+            result = (0.0, None)
+            for index, (ball, chance) in enumerate(chances):
+                if not counts[index]:
+                    continue
+                left = counts[:index] + (counts[index] - 1,) + counts[index + 1:]
+                for berry in (False, True) if berries else (False,):
+                    hit = min(1.0, chance * RAZZ_MULTIPLIER) if berry else chance
+                    cost = self.costs.get(ball, 1.0)
+                    if berry:
+                        cost += self.costs.get(items.RAZZ_BERRY, 0.0)
+                    later, _ = best(t - 1, left, berries - berry)
+                    profit = hit * value + (1 - hit) * (1 - flee) * later - cost
+                    if profit > result[0]:
+                        result = (profit, (berry, ball, hit, flee, left, berries - berry))
+            memo[key] = result
+            return result
+
+        # Follow the best throws while they still pay
+        throws = []
+        profit, step = best(self.limit, counts, berries)
+        t = self.limit
+        while step:
+            berry, ball, hit, _, counts, berries = step
+            throws.append((berry, ball, hit, flee))
+            t -= 1
+            _, step = best(t, counts, berries)
+        return CatchPlan(throws, profit)
+
+    def record(self, plan, throws, berries, caught):
+        self.encounters += 1
+        self.catches += caught
+        self.ballsThrown += throws
+        self.berriesUsed += berries
+        self.expectedBalls += plan.balls
+        self.expectedCatches += plan.catchChance
+
+    def report(self):
+        """Observed against expected, drift means costs or flee rates need tuning"""
+        return {
+            'encounters': self.encounters,
+            'catches': self.catches,
+            'ballsPerCatch': self.ballsThrown / float(self.catches) if self.catches else None,
+            'expectedBallsPerCatch': (
+                self.expectedBalls / self.expectedCatches if self.expectedCatches else None
+            ),
+            'berriesUsed': self.berriesUsed,
+            'cachedPlans': len(self._plans),
+        }
+
+
+class CatchAttempt(object):
+    """One encounter's plan, thrown a ball at a time so callers can pace it"""
+
+    def __init__(self, session, pokemon, pokemonId, strategy, encounter):
+        # pokemon: anything with encounter_id and spawn_point_id
+        self.session = session
+        self.pokemon = pokemon
+        self.strategy = strategy
+        self.bag = session.checkInventory().bag
+        self.plan = strategy.plan(pokemonId, encounter.capture_probability, self.bag)
+        self.balls = encounter.capture_probability.pokeball_type
+        self.remaining = list(self.plan.throws)
+        self.last = None
+        self.throws = 0
+        self.berries = 0
+        logging.info("(ENCOUNTER)\t-\t%s", self.plan)
+
+    @property
+    def done(self):
+        return not self.remaining
+
+    def outOfBalls(self):
+        return not any(self.bag.get(ball, 0) for ball in self.balls)
+
+    def nextCost(self):
+        """RPCs the next throw sends, a berry is one more"""
+        return 2 if self.remaining and self.remaining[0][0] else 1
+
+    def throw(self):
+        """Next throw of the plan, returns whether there are more to make"""
+        berry, ball, _, _ = self.remaining.pop(0)
+        if berry:
+            logging.info("(ENCOUNTER)\t-\tUsing a RAZZ_BERRY")
+            self.session.useItemCapture(items.RAZZ_BERRY, self.pokemon)
+            self.berries += 1
+        logging.info("(ENCOUNTER)\t-\tUsing a %s", items[ball])
+        self.last = self.session.catchPokemon(self.pokemon, ball)
+        self.throws += 1
+        if self.last.status in (CATCH_SUCCESS, CATCH_FLEE):
+            self.remaining = []
+
+        if not self.remaining:
+            self.strategy.record(self.plan, self.throws, self.berries, self.caught)
+        return not self.done
+
+    @property
+    def caught(self):
+        return self.last is not None and self.last.status == CATCH_SUCCESS
+
+
+def hasBalls(bag):
+    return any(bag.get(ball, 0) > 0 for ball in BALLS)
+
+
+def catchPokemon(session, pokemon, strategy, delay=0):
+    """Encounter and follow the strategy's plan, returns the last catch response"""
+    encounter = session.encounterPokemon(pokemon)
+    attempt = CatchAttempt(session, pokemon, pokemon.pokemon_data.pokemon_id, strategy, encounter)
+    if attempt.done:
+        if attempt.outOfBalls():
+            raise GeneralPogoException("(ENCOUNTER)\t-\tOut of usable balls")
+        return None
+
+    while attempt.throw():
+        if delay:
+            time.sleep(delay)
+    return attempt.last
@@ -0,0 +1,157 @@
+from POGOProtos.Data import PokedexEntry_pb2
+from POGOProtos.Data import PokemonData_pb2
+
+import sys
+import types
+import weakref
+
+# Held by reference everywhere, not per account
+SHARED = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    weakref.ReferenceType,
+    weakref.ProxyType,
+    weakref.CallableProxyType,
+)
+
+# Messages parsed back out for fields not kept unpacked, shared by every record
+PARSED_CACHE = 256
+_parsed = {}
+
+
+class Record(object):
+    """Plain fields off a message, the rest parsed back out on demand"""
+
+    __slots__ = ('_raw',)
+
+    # Protobuf class and the fields worth keeping unpacked
+    MESSAGE = None
+    FIELDS = ()
+
+    def __init__(self, message, raw=None):
+        # raw: the message's own bytes if we have them, saves serializing it back
+        for name in self.FIELDS:
+            setattr(self, name, getattr(message, name))
+        self._raw = message.SerializeToString() if raw is None else raw
+
+    def toProto(self):
+        """Full message, parsed fresh on every call"""
+        message = self.MESSAGE()
+        message.ParseFromString(self._raw)
+        return message
+
+    def __getattr__(self, name):
+        # Only reached for fields not kept unpacked
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        # Read only, anything that changes the message wants toProto()
+        key = (self.MESSAGE, self._raw)
+        message = _parsed.get(key)
+        if message is None:
+            if len(_parsed) >= PARSED_CACHE:
+                _parsed.clear()
+            message = _parsed[key] = self.toProto()
+        return getattr(message, name)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in ('_raw',) + self.FIELDS)
+
+    def __setstate__(self, state):
+        for name in state:
+            setattr(self, name, state[name])
+
+    def __str__(self):
+        return str(self.toProto())
+
+
+class PokemonRecord(Record):
+    FIELDS = (
+        'id',
+        'pokemon_id',
+        'cp',
+        'individual_attack',
+        'individual_defense',
+        'individual_stamina',
+        'cp_multiplier',
+        'additional_cp_multiplier',
+        'move_1',
+        'move_2',
+        'favorite',
+        'nickname',
+        'deployed_fort_id',
+    )
+    __slots__ = FIELDS
+    MESSAGE = PokemonData_pb2.PokemonData
+    is_egg = False
+
+
+class EggRecord(Record):
+    FIELDS = (
+        'id',
+        'egg_km_walked_target',
+        'egg_km_walked_start',
+        'egg_incubator_id',
+    )
+    __slots__ = FIELDS
+    MESSAGE = PokemonData_pb2.PokemonData
+    is_egg = True
+
+
+class PokedexRecord(Record):
+    FIELDS = (
+        'pokemon_id',
+        'times_encountered',
+        'times_captured',
+    )
+    __slots__ = FIELDS
+    MESSAGE = PokedexEntry_pb2.PokedexEntry
+
+
+def toProto(obj):
+    """Message for either model, for requests that need the whole thing"""
+    return obj.toProto() if isinstance(obj, Record) else obj
+
+
+def sizeOf(obj, seen=None):
+    """Deep size in bytes, meaningful with the pure python protobuf backend"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, SHARED):
+        return 0
+
+    # Descriptors belong to the message classes
+    if type(obj).__module__.startswith('google.protobuf.descriptor'):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        for key in obj:
+            size += sizeOf(key, seen) + sizeOf(obj[key], seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            size += sizeOf(value, seen)
+    elif hasattr(obj, '_values'):
+        # Repeated fields keep their list here
+        size += sizeOf(obj._values, seen)
+
+    if hasattr(obj, '__dict__'):
+        size += sizeOf(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            try:
+                size += sizeOf(object.__getattribute__(obj, name), seen)
+            except AttributeError:
+                pass
+    return size
+
+
+def memoryReport(inventory):
+    """Bytes held by the pokemon, eggs and pokedex of an inventory"""
+    return {
+        'party': sizeOf(inventory.party),
+        'eggs': sizeOf(inventory.eggs),
+        'pokedex': sizeOf(inventory.pokedex),
+    }
@@ -1,2 +1,30 @@
 class GeneralPogoException(Exception):
     """Throw an exception that moves up to the start, and reboots"""
+
+
+class TransportPogoException(GeneralPogoException):
+    """Could not talk to the servers at all"""
+
+
+class ThrottledPogoException(GeneralPogoException):
+    """Servers asked us to back off"""
+
+
+class EmptyResponsePogoException(GeneralPogoException):
+    """Servers answered, but without any returns"""
+
+
+class AuthPogoException(GeneralPogoException):
+    """Auth ticket or access token is no longer accepted"""
+
+
+class RedirectPogoException(GeneralPogoException):
+    """Servers moved us to another endpoint"""
+    def __init__(self, message, url, response=None):
+        super(RedirectPogoException, self).__init__(message)
+        self.url = url
+        self.response = response
+
+
+class CircuitOpenPogoException(GeneralPogoException):
+    """Endpoint has failed too often, requests are short circuited"""
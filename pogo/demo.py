@@ -5,6 +5,8 @@ import time
 import sys
 import traceback
 import pdb
+from POGOProtos.Networking.Requests import RequestType_pb2
+from custom_exceptions import AuthPogoException
 from custom_exceptions import GeneralPogoException
 
 from api import PokeAuthSession
@@ -12,6 +14,22 @@ from location import Location
 
 from pokedex import pokedex
 from inventory import items
+from evolution import EvolvePlanner, executePlan
+from policy import Policy, PolicyEngine, Operations, executeOperations
+from incubation import IncubationScheduler
+from catching import CatchStrategy, catchPokemon, CATCH_SUCCESS, CATCH_FLEE
+from encounters import EncounterPipeline
+from runtime import Bot, Runtime, createTasks
+from store import openStore
+
+# Never release these
+KEEPERS = [pokedex.VAPOREON, pokedex.ARCANINE, pokedex.SNORLAX, pokedex.LAPRAS]
+
+# Tracks walked distance between loops
+INCUBATION = IncubationScheduler()
+
+# Caches catch plans between encounters
+CATCHING = CatchStrategy()
 
 
 def setupLogger():
@@ -73,82 +91,25 @@ def showNearPokemon(session):
 
 
 # Wrap both for ease
-def encounterAndCatch(session, pokemon, thresholdP=0.5, limit=5, delay=2):
-    # Start encounter
-    encounter = session.encounterPokemon(pokemon)
-
-    # Grab needed data from proto
-    chances = encounter.capture_probability.capture_probability
-    logging.debug("chances: {}".format(repr(chances)))
-    balls = encounter.capture_probability.pokeball_type
-    logging.debug("balls: {}".format(repr(balls)))
-    bag = session.checkInventory().bag
-    logging.debug("bag: {}".format(repr(bag)))
-
-    # Have we used a razz berry yet?
-    berried = False
-
-    # Make sure we aren't oer limit
-    count = 0
-
-    # Attempt catch
-    while True:
-        bestBall = items.UNKNOWN
-        altBall = items.UNKNOWN
-
-        # Check for balls and see if we pass
-        # wanted threshold
-        for ball in balls:
-            try:
-                if bag[ball] > 0:
-                    altBall = ball
-                    if chances[ball -1] > thresholdP:
-                        bestBall = ball
-            except KeyError:
-                logging.debug("No Balls: {}".format(ball))
-                pass
-        # for i in range(len(balls)):
-        #     if balls[i] in bag and bag[balls[i]] > 0:
-        #         altBall = balls[i]
-        #         if chances[i] > thresholdP:
-        #             bestBall = balls[i]
-        #             break
-
-        # If we can't determine a ball, try a berry
-        # or use a lower class ball
-        if bestBall == items.UNKNOWN:
-            if not berried and items.RAZZ_BERRY in bag and bag[items.RAZZ_BERRY]:
-                logging.info("(ENCOUNTER)\t-\tUsing a RAZZ_BERRY")
-                session.useItemCapture(items.RAZZ_BERRY, pokemon)
-                berried = True
-                time.sleep(delay)
-                continue
-
-            # if no alt ball, there are no balls
-            elif altBall == items.UNKNOWN:
-                raise GeneralPogoException("(ENCOUNTER)\t-\tOut of usable balls")
-            else:
-                bestBall = altBall
-
-        # Try to catch it!!
-        logging.info("(ENCOUNTER)\t-\tUsing a %s" % items[bestBall])
-        attempt = session.catchPokemon(pokemon, bestBall)
-        time.sleep(delay)
-
-        # Success or run away
-        if attempt.status == 1:
-            return attempt
+# The session's throttle paces throws, and slows them down on flees
+def encounterAndCatch(session, pokemon, delay=0):
+    attempt = catchPokemon(session, pokemon, CATCHING, delay=delay)
+
+    # CATCH_FLEE is bad news
+    if attempt is not None and attempt.status == CATCH_FLEE:
+        logging.info(
+            "(ENCOUNTER)\t-\tPossible soft ban, catching at %.2f/s",
+            session.throttle.rate(RequestType_pb2.CATCH_POKEMON)
+        )
+    return attempt
 
-        # CATCH_FLEE is bad news
-        if attempt.status == 3:
-            logging.info("(ENCOUNTER)\t-\tPossible soft ban.")
-            return attempt
 
-        # Only try up to x attempts
-        count += 1
-        if count >= limit:
-            logging.info("(ENCOUNTER)\t-\tOver catch limit")
-            return None
+# Wild, incense and lure spawns together, walking on between throws
+def catchAround(session, seconds=600, speed=4.0):
+    pipeline = EncounterPipeline(session, CATCHING, speed=speed)
+    report = pipeline.run(seconds)
+    logging.info("(ENCOUNTER)\t-\t%.1f catches per hour", report['catchesPerHour'])
+    return report
 
 
 # Catch a pokemon at a given point
@@ -157,7 +118,7 @@ def walkAndCatch(session, pokemon, speed):
         logging.info("(ENCOUNTER)\t-\tCatching %s:" % pokedex[pokemon.pokemon_data.pokemon_id])
         session.walkTo(pokemon.latitude, pokemon.longitude, speed)
         r = encounterAndCatch(session, pokemon)
-        if r.status == 1:
+        if r is not None and r.status == CATCH_SUCCESS:
             pokes = session.checkInventory().party
             caughtpoke = {}
             for poke in pokes:
@@ -232,14 +193,13 @@ def walkAndSpinMany(session, forts):
         walkAndSpin(session, fort, speed)
 
 
-# A very brute force approach to evolving
+# Evolve whatever the candy pays for, lucky egg included
 def evolveAllPokemon(session):
     inventory = session.checkInventory()
-    logging.info("Evolving all your pokes... hope you don't mind")
-    for pokemon in inventory.party[::-1]:
-        poke_status = session.evolvePokemon(pokemon)
-        logging.debug("EVOLVED SOME ASSHOLE: {}".format(poke_status))
-        time.sleep(0.02)
+    planner = EvolvePlanner(keepers=KEEPERS)
+    plan = planner.plan(inventory)
+    logging.info("(EVOLVE)\t-\t%s" % plan)
+    executePlan(session, plan, delay=planner.evolveSeconds)
 
 
 # You probably don't want to run this
@@ -247,7 +207,6 @@ def releaseAllPokemon(session):
     inventory = session.checkInventory()
     for pokemon in inventory.party:
         session.releasePokemon(pokemon)
-        time.sleep(1)
 
 
 # Just incase you didn't want any revives
@@ -256,31 +215,16 @@ def tossRevives(session):
     return session.recycleItem(items.REVIVE, bag[items.REVIVE])
 
 
-# Set an egg to an incubator
+# Fill free incubators, only calls out when a slot has freed up
 def setEgg(session):
-    inventory = session.checkInventory()
-
-    # If no eggs, nothing we can do
-    if len(inventory.eggs) == 0:
-        return None
-
-    egg = inventory.eggs[0]
-    incubator = inventory.incubators[0]
-    return session.setEgg(incubator, egg)
-
-def cleanInventory(session):
-    recycled = 0
-    bag = session.checkInventory().bag
-
-    # Clear out all of a crtain type
-    tossable = [items.POTION, items.SUPER_POTION, items.REVIVE]
-    for toss in tossable:
-        if toss in bag and bag[toss]:
-            session.recycleItem(toss, bag[toss])
-            recycled+=1
+    return INCUBATION.update(session)
 
+# What the clean up functions keep
+ITEM_POLICY = Policy(
+    # Clear out all of a certain type
+    tossAll=[items.POTION, items.SUPER_POTION, items.REVIVE],
     # Limit a certain type
-    limited = {
+    caps={
         items.POKE_BALL: 30,
         items.GREAT_BALL: 40,
         items.ULTRA_BALL: 100,
@@ -290,11 +234,27 @@ def cleanInventory(session):
         items.MAX_REVIVE: 0,
         items.MASTER_BALL: 300
     }
-    for limit in limited:
-        if limit in bag and bag[limit] > limited[limit]:
-            session.recycleItem(limit, bag[limit] - limited[limit])
-            recycled+=1
-    logging.info("(ITEM MANAGE)\t-\tCleaned out Inventory, "+str(recycled)+" items recycled.")
+)
+
+# Best CP of each species, plus anything strong
+PARTY_POLICY = Policy(keepSpecies=KEEPERS, keepAboveCp=2000)
+SPECIES_POLICY = Policy(
+    keepSpecies=KEEPERS,
+    keepAboveCp=1500,
+    speciesKeepAboveCp={
+        pokedex.EEVEE: 600,
+        pokedex.DRATINI: 700,
+        pokedex.DRAGONAIR: 1100
+    }
+)
+
+
+def cleanInventory(session):
+    bag = session.checkInventory().bag
+    ops = Operations()
+    PolicyEngine(ITEM_POLICY).evaluateBag(bag, ops)
+    executeOperations(session, ops)
+    logging.info("(ITEM MANAGE)\t-\tCleaned out Inventory, "+str(len(ops.recycle))+" items recycled.")
 
 def getPokesByID(party, id):
     ret = []
@@ -306,46 +266,15 @@ def getPokesByID(party, id):
 def cleanAllPokes(session):
     logging.info("(POKEMANAGE)\t-\tCleaning out Pokes...")
     party = session.checkInventory().party
-    keepers = [pokedex.VAPOREON, pokedex.ARCANINE, pokedex.SNORLAX, pokedex.LAPRAS]
-    # group
-    for poke in range(0,151):
-        if poke in keepers:
-            continue
-        pokz = getPokesByID(party, poke)
-        if len(pokz) == 0:
-            continue
-        # order by cp
-        ordered_pokz= sorted(pokz, key=lambda k: k.cp)
-        #remove all but best CP and best IV
-        for x in range(len(ordered_pokz)-1):
-            pok = ordered_pokz[x]
-            if pok.cp > 2000:
-                continue
-            logging.info("(POKEMANAGE)\t-\tReleasing: "+pokedex[pok.pokemon_id]+" "+str(pok.cp)+" CP")
-            session.releasePokemon(pok)
+    ops = Operations()
+    PolicyEngine(PARTY_POLICY).evaluateParty(party, ops)
+    executeOperations(session, ops)
 
 def cleanPokes(session, pokemon_id):
     party = session.checkInventory().party
-    keepers = [pokedex.VAPOREON, pokedex.ARCANINE, pokedex.SNORLAX, pokedex.LAPRAS]
-    # group
-    poke = pokemon_id
-    if poke in keepers:
-        return
-    pokz = getPokesByID(party, poke)
-    if len(pokz) == 0:
-        return
-    # order by cp
-    ordered_pokz= sorted(pokz, key=lambda k: k.cp)
-    #remove all but best CP and best IV
-    for x in range(len(ordered_pokz)-1):
-        pok = ordered_pokz[x]
-        if pok.cp > 1500 or \
-                (pok.pokemon_id == pokedex.EEVEE and pok.cp > 600) or \
-                (pok.pokemon_id == pokedex.DRATINI and pok.cp > 700) or \
-                (pok.pokemon_id == pokedex.DRAGONAIR and pok.cp > 1100):
-            continue
-        logging.info("(POKEMANAGE)\t-\tReleasing: "+pokedex[pok.pokemon_id]+" "+str(pok.cp)+" CP")
-        session.releasePokemon(pok)
+    ops = Operations()
+    PolicyEngine(SPECIES_POLICY).evaluateParty(getPokesByID(party, pokemon_id), ops)
+    executeOperations(session, ops)
 
 def catch_demPokez(pokez, sess, whatup_cunt):
     if walkAndCatch(sess, pokez, whatup_cunt):
@@ -421,6 +350,7 @@ def camBot(session):
                 print "(TRAVEL)\t-\tWalking back to start to stay in area"
                 session.walkTo(startlat, startlon, speed)
             displayProfile(session)
+            setEgg(session)
             cleanAllPokes(session)
             # check for pokeballs (don't try to catch if we have none)
             bag = session.getInventory().bag
@@ -439,10 +369,15 @@ def camBot(session):
             evolveAllPokemon(session)
             cleanAllPokes(session)
             # check distance from start
-        # Catch problems and reauthenticate
+        # Only a dead login needs a new session
+        except AuthPogoException as e:
+            logging.critical('AuthPogoException raised: %s', e)
+            session = poko_session.reauthenticate(session)
+            time.sleep(cooldown)
+
+        # Session already retried, just cool off
         except GeneralPogoException as e:
             logging.critical('GeneralPogoException raised: %s', e)
-            session = poko_session.reauthenticate(session)
             time.sleep(cooldown)
 
         except Exception as e:
@@ -451,6 +386,18 @@ def camBot(session):
             session = poko_session.reauthenticate(session)
             time.sleep(cooldown)
 
+# camBot as independent tasks, sharing one request budget
+def runBot(session, poko_session):
+    engine = PolicyEngine(Policy(
+        tossAll=ITEM_POLICY.tossAll,
+        caps=ITEM_POLICY.caps,
+        keepSpecies=KEEPERS,
+        keepAboveCp=2000
+    ))
+    tasks = createTasks(CATCHING, engine, INCUBATION, EvolvePlanner(keepers=KEEPERS))
+    bot = Bot(session, auth=poko_session, tasks=tasks)
+    Runtime([bot], workers=1).run()
+
 # Entry point
 # Start off authentication and demo
 if __name__ == '__main__':
@@ -467,7 +414,9 @@ if __name__ == '__main__':
         parser.add_argument("-p", "--password", help="Password", required=True)
         parser.add_argument("-l", "--location", help="Location")
         parser.add_argument("-g", "--geo_key", help="GEO API Secret")
+        parser.add_argument("-s", "--store", help="Checkpoint file, resumed from on restart")
         args = parser.parse_args()
+        store = openStore(args.store) if args.store else None
 
         # Check service
         if args.auth not in ['ptc', 'google']:
@@ -479,20 +428,22 @@ if __name__ == '__main__':
             args.username,
             args.password,
             args.auth,
-            geo_key=args.geo_key
+            geo_key=args.geo_key,
+            store=store
         )
 
         # Authenticate with a given location
         # Location is not inherent in authentication
         # But is important to session
+        # Picks up from the last checkpoint if there is a usable one
         if args.location:
-            session = poko_session.authenticate(locationLookup=args.location)
+            session = poko_session.resume(locationLookup=args.location)
         else:
-            session = poko_session.authenticate()
+            session = poko_session.resume()
 
         # Time to show off what we can do
         if session:
-            camBot(session)
+            runBot(session, poko_session)
             # General
     #        getProfile(session)
     #        getInventory(session)
@@ -510,3 +461,6 @@ if __name__ == '__main__':
 
         else:
             logging.critical('Session not created successfully')
+
+        if store is not None:
+            store.close()
@@ -0,0 +1,325 @@
+from catching import CatchAttempt, hasBalls, rarityValue
+from custom_exceptions import GeneralPogoException
+from inventory import items
+from location import Location
+from util import getMs
+
+import heapq
+import itertools
+import logging
+import time
+
+# Sources
+WILD = 'wild'
+INCENSE = 'incense'
+LURE = 'lure'
+
+# Server rules as far as we know them: one encounter at a time, started
+# from close by, and the catch itself doesn't care where we walk meanwhile
+ENCOUNTER_RANGE = 40
+LURE_RANGE = 38
+
+# Only worth asking for incense spawns while one of these is burning
+INCENSE_ITEMS = (
+    items.INCENSE_ORDINARY,
+    items.INCENSE_SPICY,
+    items.INCENSE_COOL,
+    items.INCENSE_FLORAL,
+)
+
+# Successful encounter results, per source
+ENCOUNTER_SUCCESS = {WILD: 1, INCENSE: 1, LURE: 1}
+
+# Pacing
+THROW_SECONDS = 2.0
+WALK_SECONDS = 1.0
+SCAN_SECONDS = 10.0
+
+# Roughly how long an encounter and its throws take, for scoring
+ENCOUNTER_SECONDS = 10.0
+
+
+class Target(object):
+    """Something to encounter, whatever it came from"""
+
+    def __init__(self, source, message, encounterId, spawnPointId, pokemonId, latitude, longitude, expiresMs):
+        self.source = source
+        self.message = message
+        self.pokemonId = pokemonId
+        self.latitude = latitude
+        self.longitude = longitude
+        self.expiresMs = expiresMs
+
+        # What catchPokemon and useItemCapture read
+        self.encounter_id = encounterId
+        self.spawn_point_id = spawnPointId
+
+    @classmethod
+    def fromWild(cls, wild, nowMs):
+        # Despawn times outside (0, 1h] are unknown rather than real
+        hidden = wild.time_till_hidden_ms
+        return cls(
+            WILD, wild,
+            wild.encounter_id,
+            wild.spawn_point_id,
+            wild.pokemon_data.pokemon_id,
+            wild.latitude,
+            wild.longitude,
+            nowMs + (hidden if 0 < hidden <= 3600000 else 60000)
+        )
+
+    @classmethod
+    def fromIncense(cls, incense):
+        return cls(
+            INCENSE, incense,
+            incense.encounter_id,
+            incense.encounter_location,
+            incense.pokemon_type_id,
+            incense.latitude,
+            incense.longitude,
+            incense.disappear_timestamp_ms
+        )
+
+    @classmethod
+    def fromLure(cls, fort):
+        lure = fort.lure_info
+        return cls(
+            LURE, lure,
+            lure.encounter_id,
+            lure.fort_id,
+            lure.active_pokemon_id,
+            fort.latitude,
+            fort.longitude,
+            lure.lure_expires_timestamp_ms
+        )
+
+    @property
+    def range(self):
+        return LURE_RANGE if self.source == LURE else ENCOUNTER_RANGE
+
+    def encounter(self, session):
+        if self.source == WILD:
+            res = session.encounterPokemon(self.message)
+            return res.status == ENCOUNTER_SUCCESS[WILD], res
+        if self.source == INCENSE:
+            res = session.incenseEncounter(self.message)
+        else:
+            res = session.diskEncounter(self.message)
+        return res.result == ENCOUNTER_SUCCESS[self.source], res
+
+    def __str__(self):
+        return 'Target({0} {1})'.format(self.source, self.encounter_id)
+
+
+class EncounterPipeline(object):
+    """Wild, incense and lure targets in one queue, walking to the next while catching"""
+
+    def __init__(self, session, strategy, speed=4.0, value=rarityValue, throwDelay=THROW_SECONDS):
+        # speed: walking, meters per second
+        # value: pokemonId to worth of a catch, for ordering targets
+        self.session = session
+        self.strategy = strategy
+        self.speed = speed
+        self.value = value
+        self.throwDelay = throwDelay
+
+        self.targets = {}
+        self.finished = set()
+        self.active = None
+        self.activeTarget = None
+        self.nextThrow = 0
+        self.nextWalk = 0
+        self.nextScan = 0
+        self.nextEncounter = 0
+        self.emptyBag = False
+
+        # Throughput
+        self.started = time.time()
+        self.encounters = 0
+        self.catches = 0
+        self.failed = 0
+        self.expired = 0
+        self.noBalls = 0
+
+    # Sources
+    def offer(self, targets):
+        """Queue targets, ones we already have or finished are ignored"""
+        added = 0
+        for target in targets:
+            if target.encounter_id in self.targets or target.encounter_id in self.finished:
+                continue
+            self.targets[target.encounter_id] = target
+            added += 1
+        return added
+
+    def collect(self):
+        """Map spawns, lured forts and incense, in one go"""
+        nowMs = getMs()
+        found = []
+        for cell in self.session.getMapObjects().map_cells:
+            for wild in cell.wild_pokemons:
+                found.append(Target.fromWild(wild, nowMs))
+            for fort in cell.forts:
+                if fort.lure_info.encounter_id and fort.lure_info.lure_expires_timestamp_ms > nowMs:
+                    found.append(Target.fromLure(fort))
+
+        if self.incenseActive(nowMs):
+            incense = self.session.getIncensePokemon()
+            if incense.result == 1 and incense.encounter_id:
+                found.append(Target.fromIncense(incense))
+        return self.offer(found)
+
+    def incenseActive(self, nowMs):
+        applied = self.session.checkInventory().applied
+        return any(applied.get(item, 0) > nowMs for item in INCENSE_ITEMS)
+
+    # Ordering
+    def distance(self, target):
+        latitude, longitude, _ = self.session.getCoordinates()
+        return Location.getDistance(latitude, longitude, target.latitude, target.longitude)
+
+    def ranked(self, nowMs):
+        """Reachable targets, most value per second of walking and catching first"""
+        heap = []
+        order = itertools.count()
+        for target in self.targets.values():
+            if target is self.activeTarget:
+                continue
+            walk = max(0.0, self.distance(target) - target.range) / self.speed
+            if nowMs + walk * 1000 >= target.expiresMs:
+                continue
+            score = self.value(target.pokemonId) / (walk + ENCOUNTER_SECONDS)
+            heapq.heappush(heap, (-score, next(order), walk, target))
+        while heap:
+            _, _, walk, target = heapq.heappop(heap)
+            yield walk, target
+
+    def expire(self, nowMs):
+        for key in [k for k, t in self.targets.items() if t.expiresMs <= nowMs]:
+            if self.targets[key] is not self.activeTarget:
+                del self.targets[key]
+                self.finished.add(key)
+                self.expired += 1
+
+    def finish(self, target):
+        self.targets.pop(target.encounter_id, None)
+        self.finished.add(target.encounter_id)
+
+    # Stages
+    def canThrow(self):
+        """Whether there's a ball to throw, logs when the bag runs dry or refills"""
+        empty = not hasBalls(self.session.checkInventory().bag)
+        if empty != self.emptyBag:
+            if empty:
+                logging.warning('(ENCOUNTER)\t-\tOut of usable balls, not encountering until the bag refills')
+            else:
+                logging.info('(ENCOUNTER)\t-\tBalls again, encountering')
+            self.emptyBag = empty
+        return not empty
+
+    def startEncounter(self, target, now):
+        # One a tick, and failures are paced like throws
+        self.nextEncounter = now + self.throwDelay
+        try:
+            ok, res = target.encounter(self.session)
+        except GeneralPogoException as e:
+            logging.warning('(ENCOUNTER)\t-\t%s: %s', target, e)
+            ok = False
+        self.encounters += 1
+        if not ok:
+            self.failed += 1
+            self.finish(target)
+            return
+
+        pokemonId = res.wild_pokemon.pokemon_data.pokemon_id if target.source == WILD else res.pokemon_data.pokemon_id
+        attempt = CatchAttempt(self.session, target, pokemonId or target.pokemonId, self.strategy, res)
+        if attempt.done:
+            # The target stays queued, it's the bag that let us down
+            if attempt.outOfBalls() and not self.canThrow():
+                self.noBalls += 1
+            else:
+                self.finish(target)
+            return
+        self.active = attempt
+        self.activeTarget = target
+        self.nextThrow = now
+
+    def throw(self, now):
+        try:
+            if self.active.throw():
+                self.nextThrow = now + self.throwDelay
+                return
+        except GeneralPogoException as e:
+            logging.warning('(ENCOUNTER)\t-\t%s: %s', self.activeTarget, e)
+
+        if self.active.caught:
+            self.catches += 1
+        self.finish(self.activeTarget)
+        self.active = None
+        self.activeTarget = None
+
+    def walk(self, target, now):
+        """One tick toward a target, without waiting on the map refresh"""
+        latitude, longitude, _ = self.session.getCoordinates()
+        distance = self.distance(target)
+        step = min(1.0, self.speed * WALK_SECONDS / distance) if distance else 1.0
+        self.session.location.setCoordinates(
+            latitude + (target.latitude - latitude) * step,
+            longitude + (target.longitude - longitude) * step
+        )
+        self.nextWalk = now + WALK_SECONDS
+
+    def step(self, now=None):
+        """Advance every stage that's due, returns seconds until the next one is"""
+        now = now or time.time()
+        nowMs = now * 1000
+        self.expire(nowMs)
+
+        if now >= self.nextScan:
+            self.collect()
+            self.nextScan = now + SCAN_SECONDS
+
+        # Throws go on while we walk towards whatever is next
+        if self.active is not None and now >= self.nextThrow:
+            self.throw(now)
+
+        encounter = self.active is None and now >= self.nextEncounter and self.canThrow()
+        walkTo = None
+        for walk, target in self.ranked(nowMs):
+            if walk:
+                walkTo = walkTo or target
+            elif encounter:
+                self.startEncounter(target, now)
+                encounter = False
+            if walkTo is not None and not encounter:
+                break
+
+        if walkTo is not None and now >= self.nextWalk:
+            self.walk(walkTo, now)
+
+        due = [self.nextScan]
+        if self.active is not None:
+            due.append(self.nextThrow)
+        elif self.targets and not self.emptyBag:
+            due.append(self.nextEncounter)
+        if walkTo is not None:
+            due.append(self.nextWalk)
+        return max(0, min(due) - time.time())
+
+    def run(self, seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            time.sleep(min(self.step(), max(0, end - time.time())))
+        return self.report()
+
+    def report(self):
+        hours = (time.time() - self.started) / 3600.0
+        return {
+            'queued': len(self.targets),
+            'encounters': self.encounters,
+            'catches': self.catches,
+            'failed': self.failed,
+            'expired': self.expired,
+            'noBalls': self.noBalls,
+            'catchesPerHour': self.catches / hours if hours else 0.0,
+        }
@@ -0,0 +1,26 @@
+class Constant(int):
+    """An int that remembers its enum name, like an IntEnum member"""
+
+    def __new__(cls, value, name, enum=''):
+        self = int.__new__(cls, value)
+        self.name = name
+        self.enum = enum
+        return self
+
+    def __getnewargs__(self):
+        return int(self), self.name, self.enum
+
+    def __repr__(self):
+        return '<{0}.{1}: {2}>'.format(self.enum, self.name, int(self))
+
+
+def createConstants(cls, enumType, prefix=''):
+    """Set every value of a proto enum on cls, returns a name tuple indexed by value"""
+    values = enumType.values()
+    names = [None] * (max(values) + 1)
+    for name, value in enumType.items():
+        if prefix and name.startswith(prefix):
+            name = name[len(prefix):]
+        setattr(cls, name, Constant(value, name, enumType.DESCRIPTOR.name))
+        names[value] = name
+    return tuple(names)
@@ -0,0 +1,173 @@
+from inventory import items
+from pokedex import pokedex
+from util import getMs
+
+import logging
+import time
+
+# Game rules at time of writing
+EVOLVE_XP = 500
+NEW_SPECIES_XP = 1000
+EVOLVE_CANDY_REFUND = 1
+TRANSFER_CANDY = 1
+LUCKY_EGG_MS = 30 * 60 * 1000
+
+# Steps of a plan
+RELEASE = 'release'
+LUCKY_EGG = 'luckyEgg'
+EVOLVE = 'evolve'
+
+
+class EvolvePlan(object):
+    """Ordered steps, each one RPC, each one expected to succeed"""
+
+    def __init__(self):
+        self.steps = []
+        self.xp = 0
+        self.evolutions = 0
+        self.releases = 0
+        self.luckyEggs = 0
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __str__(self):
+        return 'EvolvePlan: {0} evolutions, {1} releases, {2} lucky eggs, {3} XP'.format(
+            self.evolutions,
+            self.releases,
+            self.luckyEggs,
+            self.xp
+        )
+
+
+class EvolvePlanner(object):
+    """Pick the evolutions that earn the most XP from the candy we have"""
+
+    def __init__(self, transfer=True, keepers=(), evolveSeconds=1.0, minForEgg=30):
+        # transfer: release spare family members for candy
+        # evolveSeconds: pacing between evolve calls once executing
+        # minForEgg: don't spend an egg on fewer evolutions than this
+        self.transfer = transfer
+        self.keepers = set(keepers)
+        self.evolveSeconds = evolveSeconds
+        self.minForEgg = minForEgg
+
+    def protected(self, pokemon):
+        return pokemon.favorite or pokemon.pokemon_id in self.keepers or pokemon.deployed_fort_id
+
+    def planFamily(self, members, candy):
+        """Most evolutions a family can afford, and the releases to pay for it"""
+        costs = pokedex.candyTable
+        # Keepers may still evolve, favorites and gym defenders may not
+        evolvable = sorted(
+            (p for p in members if costs[p.pokemon_id] and not p.favorite and not p.deployed_fort_id),
+            key=lambda p: (costs[p.pokemon_id], -p.cp)
+        )
+        spare = sorted(
+            (p for p in members if not self.protected(p)),
+            key=lambda p: p.cp
+        )
+
+        # k-th evolution needs its cost before its own refund comes back
+        chosen = []
+        spent = 0
+        spareLeft = len(spare) if self.transfer else 0
+        spareIds = set(id(p) for p in spare)
+        for pokemon in evolvable:
+            cost = spent + costs[pokemon.pokemon_id]
+            left = spareLeft - (id(pokemon) in spareIds) if self.transfer else 0
+            available = candy + len(chosen) * EVOLVE_CANDY_REFUND + left * TRANSFER_CANDY
+
+            # Cheapest first, so once one doesn't fit, nothing after does
+            if available < cost:
+                break
+            chosen.append(pokemon)
+            spent = cost
+            spareLeft = left
+
+        # Release only as many as the candy maths needs
+        chosenIds = set(id(p) for p in chosen)
+        refunds = max(0, len(chosen) - 1) * EVOLVE_CANDY_REFUND
+        needed = -(-max(0, spent - candy - refunds) // TRANSFER_CANDY)
+        releases = [p for p in spare if id(p) not in chosenIds][:needed]
+        return chosen, releases
+
+    def plan(self, inventory, now=None):
+        now = now or getMs()
+        byFamily = {}
+        for pokemon in inventory.party:
+            byFamily.setdefault(pokedex.familyTable[pokemon.pokemon_id], []).append(pokemon)
+
+        evolutions = []
+        releases = []
+        for family in byFamily:
+            chosen, released = self.planFamily(byFamily[family], inventory.candies.get(family, 0))
+            evolutions += chosen
+            releases += released
+
+        # Registering a new species is worth double
+        caught = set(p for p in inventory.pokedex if inventory.pokedex[p].times_captured)
+        xp = []
+        for pokemon in evolutions:
+            targets = pokedex.evolutionTable[pokemon.pokemon_id]
+            if len(targets) == 1 and targets[0] not in caught:
+                caught.add(targets[0])
+                xp.append(NEW_SPECIES_XP)
+            else:
+                xp.append(EVOLVE_XP)
+
+        # Big payouts first, so they land inside the egg window
+        order = sorted(range(len(evolutions)), key=lambda i: -xp[i])
+        evolutions = [evolutions[i] for i in order]
+        xp = [xp[i] for i in order]
+
+        plan = EvolvePlan()
+        for pokemon in releases:
+            plan.steps.append((RELEASE, pokemon))
+            plan.releases += 1
+
+        # Eggs already running count as a free window
+        eggs = inventory[items.LUCKY_EGG]
+        running = max(0, inventory.applied.get(items.LUCKY_EGG, 0) - now)
+        perWindow = int(LUCKY_EGG_MS / 1000.0 / self.evolveSeconds) if self.evolveSeconds else len(evolutions)
+        left = int(running / 1000.0 / self.evolveSeconds) if self.evolveSeconds else (len(evolutions) if running else 0)
+
+        for pokemon, reward in zip(evolutions, xp):
+            if not left and eggs and len(evolutions) - plan.evolutions >= self.minForEgg:
+                plan.steps.append((LUCKY_EGG, items.LUCKY_EGG))
+                plan.luckyEggs += 1
+                eggs -= 1
+                left = perWindow
+
+            boosted = left > 0
+            if boosted:
+                left -= 1
+            plan.steps.append((EVOLVE, pokemon))
+            plan.evolutions += 1
+            plan.xp += reward * 2 if boosted else reward
+
+        return plan
+
+
+def planSteps(plan, delay=1.0):
+    """(call, wait) per step, call sends its one RPC, wait is the pause after it"""
+    def step(action, target):
+        if action == RELEASE:
+            return (lambda session: session.releasePokemon(target)), 0
+        if action == LUCKY_EGG:
+            return (lambda session: session.useItemXpBoost(target)), 0
+        return (lambda session: session.evolvePokemon(target)), delay
+    return [step(action, target) for action, target in plan.steps]
+
+
+def executePlan(session, plan, delay=1.0):
+    """Run a plan step by step, returns the XP the server awarded"""
+    awarded = 0
+    for (action, _), (call, wait) in zip(plan.steps, planSteps(plan, delay)):
+        result = call(session)
+        if action == EVOLVE:
+            awarded += result.experience_awarded
+        if wait:
+            time.sleep(wait)
+    logging.info("(EVOLVE)\t-\t%s, %d XP awarded", plan, awarded)
+    return awarded
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+import argparse
+import csv
+import heapq
+import itertools
+import logging
+import multiprocessing
+import numbers
+import os
+import random
+import threading
+import time
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from api import PokeAuthSession
+from catching import CatchStrategy
+from evolution import EvolvePlanner
+from gamemaster import GameMaster, CACHE_DIR
+from incubation import IncubationScheduler
+from location import Location
+from observations import ObservationBus, createSharedStore
+from pokedex import pokedex
+from policy import Policy, PolicyEngine
+from runtime import Bot, Runtime, RequestBudget, createTasks
+from store import openStore
+
+# How often workers report, and the supervisor logs
+REPORT_SECONDS = 30
+
+# Longest wait before restarting a crashing worker
+MAX_RESTART_DELAY = 300
+
+# Logins in flight per worker, and the back-off for accounts that fail one
+LOGIN_THREADS = 8
+LOGIN_RETRY_BASE = 30
+MAX_LOGIN_DELAY = 1800
+
+
+class Account(object):
+    def __init__(self, auth, username, password, location):
+        self.auth = auth
+        self.username = username
+        self.password = password
+        self.location = location
+
+
+def loadAccounts(path):
+    """CSV of auth,username,password,location, quote locations with commas"""
+    accounts = []
+    with open(path) as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#'):
+                continue
+            accounts.append(Account(*[field.strip() for field in row[:4]]))
+    return accounts
+
+
+def shard(accounts, count):
+    """Round robin, so shards stay even as the list grows"""
+    return [accounts[i::count] for i in range(count)]
+
+
+def prepareShared(accounts, cacheDir=CACHE_DIR, geo_key=None):
+    """Load read only tables before forking, children share the pages"""
+    try:
+        pokedex.applyGameMaster(GameMaster(cacheDir).load())
+    except ValueError:
+        logging.warning('(FLEET)\t-\tNo cached game master, using built in tables')
+
+    # Geocode every distinct location once
+    for search in set(a.location for a in accounts if a.location):
+        Location(search, geo_key)
+
+
+class Worker(object):
+    """One process: a runtime, its bots and the tables inherited from the parent"""
+
+    def __init__(self, index, accounts, metrics, threads=32, rate=0.5, geo_key=None, shared=None, storeDir=None, storeBackend='sqlite', logins=LOGIN_THREADS):
+        self.index = index
+        self.accounts = accounts
+        self.metrics = metrics
+        self.threads = threads
+        self.rate = rate
+        self.geo_key = geo_key
+
+        # Shared by every bot in the process, they hold no per-account state
+        self.strategy = CatchStrategy()
+        self.planner = EvolvePlanner()
+        self.engine = PolicyEngine(Policy(keepAboveCp=2000))
+
+        # Map cells any bot here scanned, and other workers too if shared
+        self.bus = ObservationBus(shared=shared)
+
+        # One checkpoint file per worker, accounts stay with the same worker
+        # as long as the account list and process count do
+        self.store = None
+        if storeDir:
+            path = os.path.join(storeDir, 'worker-{0}.{1}'.format(index, storeBackend))
+            self.store = openStore(path, storeBackend)
+
+        self.runtime = Runtime(workers=threads)
+        self.failed = 0
+
+        # (retry at, order, account, failures so far), earliest first, and
+        # how many accounts have yet to log in, whether queued or being tried
+        self.logins = logins
+        self._pending = [(0, i, account, 0) for i, account in enumerate(accounts)]
+        self._order = itertools.count(len(accounts))
+        self._outstanding = len(accounts)
+        self._pendingReady = threading.Condition()
+
+    def createBot(self, account):
+        auth = PokeAuthSession(
+            account.username,
+            account.password,
+            account.auth,
+            geo_key=self.geo_key,
+            bus=self.bus,
+            store=self.store
+        )
+        session = auth.resume(locationLookup=account.location or None)
+        if session is None:
+            raise ValueError('No session for {0}'.format(account.username))
+        tasks = createTasks(self.strategy, self.engine, IncubationScheduler(), self.planner)
+        return Bot(session, auth=auth, tasks=tasks, budget=RequestBudget(rate=self.rate))
+
+    def nextLogin(self):
+        """Wait for the earliest account to come due, None once all are in"""
+        with self._pendingReady:
+            while self._outstanding:
+                # Only taken once due, a retry pushed meanwhile may come first
+                wait = None
+                if self._pending:
+                    wait = self._pending[0][0] - time.time()
+                    if wait <= 0:
+                        return heapq.heappop(self._pending)
+                self._pendingReady.wait(wait)
+            return None
+
+    def login(self):
+        """One login thread, taking whichever account is due next"""
+        # Bots join the runtime as they come up, nobody waits on the slowest login
+        while True:
+            due = self.nextLogin()
+            if due is None:
+                return
+            _, _, account, failures = due
+
+            try:
+                self.runtime.add(self.createBot(account))
+            except Exception as e:
+                self.failed += 1
+                delay = min(MAX_LOGIN_DELAY, LOGIN_RETRY_BASE * 2 ** failures) * random.uniform(0.5, 1.0)
+                logging.error('(FLEET)\t-\tLogin failed for %s, retrying in %ds: %s', account.username, delay, e)
+                with self._pendingReady:
+                    heapq.heappush(self._pending, (time.time() + delay, next(self._order), account, failures + 1))
+                    self._pendingReady.notify()
+                continue
+
+            # The last one in lets every idle thread go
+            with self._pendingReady:
+                self._outstanding -= 1
+                if not self._outstanding:
+                    self._pendingReady.notify_all()
+
+    def report(self):
+        totals = self.runtime.metrics()
+        totals['loginFailures'] = self.failed
+        totals['loginPending'] = len(self._pending)
+        totals['catch'] = self.strategy.report()
+        totals.update(self.bus.report())
+        if self.store is not None:
+            totals['checkpoints'] = self.store.report()['written']
+        totals['throttled'] = sum(
+            sum(bot.session.throttle.throttles.values()) for bot in self.runtime.bots
+        )
+        self.metrics.put((self.index, os.getpid(), time.time(), totals))
+
+    def run(self):
+        self.runtime.start()
+        for _ in range(min(self.logins, len(self.accounts))):
+            login = threading.Thread(target=self.login)
+            login.daemon = True
+            login.start()
+        while True:
+            time.sleep(REPORT_SECONDS)
+            self.bus.expire()
+            self.report()
+
+
+def runWorker(index, accounts, metrics, options):
+    logging.basicConfig(level=logging.INFO, format='%(process)d %(message)s')
+    Worker(index, accounts, metrics, **options).run()
+
+
+class Fleet(object):
+    """Supervises worker processes, restarting any that die"""
+
+    def __init__(self, accounts, processes=None, **options):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.shards = [s for s in shard(accounts, self.processes) if s]
+        self.options = options
+        self.metrics = multiprocessing.Queue()
+        self.workers = [None] * len(self.shards)
+        self.restarts = [0] * len(self.shards)
+        self.restartAt = [0] * len(self.shards)
+        self.started = [0] * len(self.shards)
+        self.latest = {}
+
+    def spawn(self, index):
+        process = multiprocessing.Process(
+            target=runWorker,
+            args=(index, self.shards[index], self.metrics, self.options)
+        )
+        process.daemon = True
+        process.start()
+        self.workers[index] = process
+        self.started[index] = time.time()
+        logging.info('(FLEET)\t-\tWorker %d up as %d, %d accounts', index, process.pid, len(self.shards[index]))
+
+    def check(self, now):
+        for index, process in enumerate(self.workers):
+            if process is not None and process.is_alive():
+                # A worker that stayed up a while has earned a clean slate
+                if now - self.started[index] > MAX_RESTART_DELAY:
+                    self.restarts[index] = 0
+                continue
+
+            if process is not None:
+                logging.error('(FLEET)\t-\tWorker %d exited with %s', index, process.exitcode)
+                self.workers[index] = None
+                self.restartAt[index] = now + min(MAX_RESTART_DELAY, 2 ** self.restarts[index])
+                self.restarts[index] += 1
+            if now >= self.restartAt[index]:
+                self.spawn(index)
+
+    def drain(self, timeout):
+        try:
+            index, pid, sent, totals = self.metrics.get(timeout=timeout)
+            self.latest[index] = totals
+        except Empty:
+            pass
+        while True:
+            try:
+                index, pid, sent, totals = self.metrics.get_nowait()
+                self.latest[index] = totals
+            except Empty:
+                return
+
+    def summary(self):
+        totals = {}
+        for index in self.latest:
+            for key, value in self.latest[index].items():
+                if isinstance(value, numbers.Number):
+                    totals[key] = totals.get(key, 0) + value
+        totals['workers'] = sum(1 for w in self.workers if w is not None and w.is_alive())
+        totals['restarts'] = sum(self.restarts)
+        return totals
+
+    def run(self):
+        for index in range(len(self.shards)):
+            self.spawn(index)
+
+        lastReport = time.time()
+        try:
+            while True:
+                self.drain(1)
+                now = time.time()
+                self.check(now)
+                if now - lastReport >= REPORT_SECONDS:
+                    logging.info('(FLEET)\t-\t%s', self.summary())
+                    lastReport = now
+        finally:
+            for process in self.workers:
+                if process is not None and process.is_alive():
+                    process.terminate()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(process)d %(message)s')
+    logging.getLogger('requests').setLevel(logging.ERROR)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--accounts', required=True, help='CSV of auth,username,password,location')
+    parser.add_argument('-p', '--processes', type=int, default=multiprocessing.cpu_count(), help='Worker processes')
+    parser.add_argument('-t', '--threads', type=int, default=32, help='Runtime threads per worker')
+    parser.add_argument('-l', '--logins', type=int, default=LOGIN_THREADS, help='Concurrent logins per worker')
+    parser.add_argument('-r', '--rate', type=float, default=0.5, help='Requests per second per account')
+    parser.add_argument('-g', '--geo_key', help='GEO API Secret')
+    parser.add_argument('-s', '--share-cells', action='store_true', help='Share map scans between workers')
+    parser.add_argument('-c', '--checkpoints', help='Directory for session checkpoints, resumed on restart')
+    parser.add_argument('-b', '--backend', choices=('sqlite', 'mmap'), default='sqlite', help='Checkpoint store')
+    args = parser.parse_args()
+
+    accounts = loadAccounts(args.accounts)
+    if args.checkpoints and not os.path.isdir(args.checkpoints):
+        os.makedirs(args.checkpoints)
+    prepareShared(accounts, geo_key=args.geo_key)
+    Fleet(
+        accounts,
+        processes=args.processes,
+        threads=args.threads,
+        rate=args.rate,
+        logins=args.logins,
+        geo_key=args.geo_key,
+        shared=createSharedStore() if args.share_cells else None,
+        storeDir=args.checkpoints,
+        storeBackend=args.backend
+    ).run()
@@ -0,0 +1,246 @@
+from POGOProtos.Enums import PokemonId_pb2
+from POGOProtos.Enums import PokemonMove_pb2
+from POGOProtos.Enums import PokemonType_pb2
+from POGOProtos.Networking.Responses import DownloadItemTemplatesResponse_pb2
+
+import glob
+import logging
+import os
+import re
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.pogo')
+CACHE_PREFIX = 'game_master_'
+
+# Table layout version, bump when the tables change shape
+TABLES_VERSION = 1
+
+POKEMON_SIZE = max(PokemonId_pb2.PokemonId.values()) + 1
+MOVE_SIZE = max(PokemonMove_pb2.PokemonMove.values()) + 1
+TYPE_SIZE = max(PokemonType_pb2.PokemonType.values()) + 1
+
+# Templates carry their move id in the name, V0013_MOVE_WRAP
+MOVE_TEMPLATE = re.compile(r'^V(\d+)_MOVE_')
+
+
+class GameMaster(object):
+    """Indexed tables built from DownloadItemTemplates, cached on disk"""
+
+    def __init__(self, cacheDir=CACHE_DIR):
+        self.cacheDir = cacheDir
+        self.timestamp = 0
+
+        # Pokemon tables, indexed by PokemonId
+        self.baseAttack = ()
+        self.baseDefense = ()
+        self.baseStamina = ()
+        self.types = ()
+        self.quickMoves = ()
+        self.chargeMoves = ()
+        self.candyToEvolve = ()
+        self.family = ()
+        self.evolutions = ()
+        self.parent = ()
+        self.kmToHatch = ()
+
+        # Move tables, indexed by PokemonMove
+        self.movePower = ()
+        self.moveType = ()
+        self.moveDuration = ()
+        self.moveDamageStart = ()
+        self.moveDamageEnd = ()
+        self.moveEnergy = ()
+
+        # Attack type, then defending type
+        self.typeEffective = ()
+
+        # Per level and per upgrade step
+        self.cpMultiplier = ()
+        self.requiredExperience = ()
+        self.candyCost = ()
+        self.stardustCost = ()
+        self.upgradesPerLevel = 2
+        self.levelsAbovePlayer = 0
+
+        self.battle = {}
+
+    # Loading
+    def load(self, session=None, refresh=False):
+        """Newest cached tables, downloading only when there's nothing usable"""
+        if not refresh and self.loadCached():
+            return self
+
+        if session is None:
+            raise ValueError('No cached game master and no session to fetch one')
+
+        templates = session.downloadItemTemplates()
+        self.build(templates)
+        self.save(templates)
+        return self
+
+    def cachePath(self, timestamp, extension):
+        name = '{0}{1}.{2}'.format(CACHE_PREFIX, timestamp, extension)
+        return os.path.join(self.cacheDir, name)
+
+    def cachedTimestamps(self):
+        pattern = os.path.join(self.cacheDir, CACHE_PREFIX + '*.bin')
+        stamps = []
+        for path in glob.glob(pattern):
+            stamp = os.path.basename(path)[len(CACHE_PREFIX):-len('.bin')]
+            if stamp.isdigit():
+                stamps.append(int(stamp))
+        return sorted(stamps, reverse=True)
+
+    def loadCached(self):
+        for timestamp in self.cachedTimestamps():
+            # Pickled tables are the fast path
+            try:
+                with open(self.cachePath(timestamp, 'tables'), 'rb') as f:
+                    version, tables = pickle.load(f)
+                if version == TABLES_VERSION:
+                    self.__dict__.update(tables)
+                    return True
+            except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+                pass
+
+            # Otherwise rebuild from the raw response
+            try:
+                templates = DownloadItemTemplatesResponse_pb2.DownloadItemTemplatesResponse()
+                with open(self.cachePath(timestamp, 'bin'), 'rb') as f:
+                    templates.ParseFromString(f.read())
+                self.build(templates)
+                self.saveTables()
+                return True
+            except Exception as e:
+                logging.warning('Ignoring bad game master cache %s: %s', timestamp, e)
+        return False
+
+    def save(self, templates):
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        with open(self.cachePath(self.timestamp, 'bin'), 'wb') as f:
+            f.write(templates.SerializeToString())
+        self.saveTables()
+
+    def saveTables(self):
+        tables = dict(self.__dict__)
+        del tables['cacheDir']
+
+        # Write then rename, readers never see half a file
+        path = self.cachePath(self.timestamp, 'tables')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((TABLES_VERSION, tables), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+
+    # Building
+    def build(self, templates):
+        self.timestamp = templates.timestamp_ms
+
+        attack = [0] * POKEMON_SIZE
+        defense = [0] * POKEMON_SIZE
+        stamina = [0] * POKEMON_SIZE
+        types = [(0, 0)] * POKEMON_SIZE
+        quick = [()] * POKEMON_SIZE
+        charge = [()] * POKEMON_SIZE
+        candy = [0] * POKEMON_SIZE
+        family = [0] * POKEMON_SIZE
+        evolutions = [()] * POKEMON_SIZE
+        parent = [0] * POKEMON_SIZE
+        hatch = [0.0] * POKEMON_SIZE
+
+        power = [0.0] * MOVE_SIZE
+        moveType = [0] * MOVE_SIZE
+        duration = [0] * MOVE_SIZE
+        damageStart = [0] * MOVE_SIZE
+        damageEnd = [0] * MOVE_SIZE
+        energy = [0] * MOVE_SIZE
+
+        effective = [(1.0,) * TYPE_SIZE] * TYPE_SIZE
+
+        for template in templates.item_templates:
+            if template.HasField('pokemon_settings'):
+                settings = template.pokemon_settings
+                pokemonId = settings.pokemon_id
+                attack[pokemonId] = settings.stats.base_attack
+                defense[pokemonId] = settings.stats.base_defense
+                stamina[pokemonId] = settings.stats.base_stamina
+                types[pokemonId] = (settings.type, settings.type_2)
+                quick[pokemonId] = tuple(settings.quick_moves)
+                charge[pokemonId] = tuple(settings.cinematic_moves)
+                candy[pokemonId] = settings.candy_to_evolve
+                family[pokemonId] = settings.family_id
+                evolutions[pokemonId] = tuple(settings.evolution_ids)
+                parent[pokemonId] = settings.parent_pokemon_id
+                hatch[pokemonId] = settings.km_distance_to_hatch
+
+            elif template.HasField('move_settings'):
+                match = MOVE_TEMPLATE.match(template.template_id)
+                if not match or int(match.group(1)) >= MOVE_SIZE:
+                    continue
+                moveId = int(match.group(1))
+                settings = template.move_settings
+                power[moveId] = settings.power
+                moveType[moveId] = settings.pokemon_type
+                duration[moveId] = settings.duration_ms
+                damageStart[moveId] = settings.damage_window_start_ms
+                damageEnd[moveId] = settings.damage_window_end_ms
+                energy[moveId] = settings.energy_delta
+
+            elif template.HasField('type_effective'):
+                settings = template.type_effective
+                scalars = tuple(settings.attack_scalar)
+
+                # Scalars start at the first real type
+                effective[settings.attack_type] = (1.0,) + scalars[:TYPE_SIZE - 1]
+
+            elif template.HasField('player_level'):
+                settings = template.player_level
+                self.cpMultiplier = tuple(settings.cp_multiplier)
+                self.requiredExperience = tuple(settings.required_experience)
+
+            elif template.HasField('pokemon_upgrades'):
+                settings = template.pokemon_upgrades
+                self.candyCost = tuple(settings.candy_cost)
+                self.stardustCost = tuple(settings.stardust_cost)
+                self.upgradesPerLevel = settings.upgrades_per_level
+                self.levelsAbovePlayer = settings.allowed_levels_above_player
+
+            elif template.HasField('battle_settings'):
+                settings = template.battle_settings
+                self.battle = dict(
+                    (field.name, value) for field, value in settings.ListFields()
+                )
+
+        self.baseAttack = tuple(attack)
+        self.baseDefense = tuple(defense)
+        self.baseStamina = tuple(stamina)
+        self.types = tuple(types)
+        self.quickMoves = tuple(quick)
+        self.chargeMoves = tuple(charge)
+        self.candyToEvolve = tuple(candy)
+        self.family = tuple(family)
+        self.evolutions = tuple(evolutions)
+        self.parent = tuple(parent)
+        self.kmToHatch = tuple(hatch)
+
+        self.movePower = tuple(power)
+        self.moveType = tuple(moveType)
+        self.moveDuration = tuple(duration)
+        self.moveDamageStart = tuple(damageStart)
+        self.moveDamageEnd = tuple(damageEnd)
+        self.moveEnergy = tuple(energy)
+
+        self.typeEffective = tuple(effective)
+        return self
+
+    def getEffectiveness(self, attackType, defenderId):
+        """Damage scalar of a move type against a pokemon's type pair"""
+        first, second = self.types[defenderId]
+        scalar = self.typeEffective[attackType][first]
+        if second:
+            scalar *= self.typeEffective[attackType][second]
+        return scalar
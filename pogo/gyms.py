@@ -0,0 +1,196 @@
+from POGOProtos.Data.Battle import BattleAction_pb2
+from POGOProtos.Data.Battle import BattleActionType_pb2
+from POGOProtos.Data.Battle import BattleState_pb2
+from POGOProtos.Data.Battle import BattlePokemonInfo_pb2
+
+from battle import UNKNOWN_MOVE_MS
+from custom_exceptions import GeneralPogoException
+from util import getMs
+
+import heapq
+import itertools
+import logging
+import time
+
+# Seconds between AttackGym calls, the game master's attack_server_interval
+ATTACK_SERVER_INTERVAL = 5.0
+
+# Failed sends in a row before a battle is given up on
+MAX_SEND_ERRORS = 3
+
+# Results
+START_SUCCESS = 1
+ATTACK_SUCCESS = 1
+
+
+class GymBattle(object):
+    """One battle's state, kept up to date from every AttackGym response"""
+
+    def __init__(self, session, gym, battleId, actions=(), interval=ATTACK_SERVER_INTERVAL):
+        # actions: BattleActions to send, or a function of the battle giving them
+        self.session = session
+        self.gym = gym
+        self.battleId = battleId
+        self.interval = interval
+        self._next = None
+
+        # Incremental copy of the server's view
+        self.state = BattleState_pb2.ACTIVE
+        self.serverMs = 0
+        self.offsetMs = 0
+        self.log = []
+        self.lastRetrieved = None
+        self.attacker = BattlePokemonInfo_pb2.BattlePokemonInfo()
+        self.defender = BattlePokemonInfo_pb2.BattlePokemonInfo()
+
+        self.sent = 0
+        self.rpcs = 0
+        self.errors = 0
+
+        # Streams are lazy, they read the battle as it goes
+        self.actions = iter(actions(self) if callable(actions) else actions)
+
+    @classmethod
+    def start(cls, session, gym, attackers, defenderId, actions=(), interval=ATTACK_SERVER_INTERVAL):
+        res = session.startGymBattle(gym, attackers, defenderId)
+        if res.result != START_SUCCESS:
+            raise GeneralPogoException('Could not start battle: {0}'.format(res.result))
+
+        battle = cls(session, gym, res.battle_id, actions, interval)
+        battle.attacker.pokemon_data.CopyFrom(attackers[0])
+        battle.defender.CopyFrom(res.defender.active_pokemon)
+        battle.update(res.battle_log)
+        return battle
+
+    @property
+    def done(self):
+        return self.state != BattleState_pb2.ACTIVE
+
+    def serverNow(self):
+        return getMs() + self.offsetMs
+
+    def due(self, untilMs):
+        """Actions starting before untilMs, pulled from the stream"""
+        batch = []
+        while True:
+            if self._next is None:
+                self._next = next(self.actions, None)
+                if self._next is None:
+                    return batch
+            if self._next.action_start_ms > untilMs:
+                return batch
+            batch.append(self._next)
+            self._next = None
+
+    def send(self):
+        """Everything due before the next send, in one AttackGym"""
+        batch = self.due(self.serverNow() + self.interval * 1000)
+        res = self.session.attackGym(self.gym, self.battleId, batch, self.lastRetrieved)
+        self.rpcs += 1
+        if res.result != ATTACK_SUCCESS:
+            raise GeneralPogoException('Attack rejected: {0}'.format(res.result))
+
+        self.sent += len(batch)
+        if res.HasField('active_attacker'):
+            self.attacker.CopyFrom(res.active_attacker)
+        if res.HasField('active_defender'):
+            self.defender.CopyFrom(res.active_defender)
+        self.update(res.battle_log)
+        return res
+
+    def update(self, battleLog):
+        self.state = battleLog.state
+        if battleLog.server_ms:
+            self.serverMs = battleLog.server_ms
+            self.offsetMs = battleLog.server_ms - getMs()
+
+        # Responses repeat the last action we told the server we have
+        last = self.lastRetrieved
+        for action in battleLog.battle_actions:
+            if last is not None and (action.action_start_ms < last.action_start_ms or action == last):
+                continue
+            copy = BattleAction_pb2.BattleAction()
+            copy.CopyFrom(action)
+            self.log.append(copy)
+        if self.log:
+            self.lastRetrieved = self.log[-1]
+
+
+class BattleLoop(object):
+    """Sends for many battles from one thread, each at its own cadence"""
+
+    def __init__(self, battles=()):
+        self._heap = []
+        self._order = itertools.count()
+        self.finished = []
+        for battle in battles:
+            self.add(battle)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, battle, at=0):
+        heapq.heappush(self._heap, (at, next(self._order), battle))
+
+    def step(self, now=None):
+        """Send for every battle that's due, returns seconds until the next one"""
+        now = now or time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, battle = heapq.heappop(self._heap)
+            try:
+                battle.send()
+                battle.errors = 0
+            except GeneralPogoException as e:
+                battle.errors += 1
+                logging.warning('(GYM)\t-\tBattle %s: %s', battle.battleId, e)
+
+            if battle.done or battle.errors >= MAX_SEND_ERRORS:
+                self.finished.append(battle)
+            else:
+                self.add(battle, now + battle.interval)
+        return max(0, self._heap[0][0] - time.time()) if self._heap else None
+
+    def run(self):
+        while self._heap:
+            wait = self.step()
+            if wait:
+                time.sleep(wait)
+        return self.finished
+
+
+def attackStream(gameMaster, battle):
+    """Quick attacks back to back, charge attacks whenever the energy is there"""
+    maxEnergy = gameMaster.battle.get('maximum_energy', 100)
+    at = battle.serverMs
+    energy = 0
+    current = None
+    while True:
+        # The server says who's fighting, swaps and faints included
+        pokemon = battle.attacker.pokemon_data
+        if pokemon.id != current:
+            current = pokemon.id
+            energy = battle.attacker.current_energy
+            at = max(at, battle.serverMs)
+
+        charge = pokemon.move_2
+        cost = -gameMaster.moveEnergy[charge] if charge < len(gameMaster.moveEnergy) else 0
+        special = 0 < cost <= energy
+        move = charge if special else pokemon.move_1
+        if move < len(gameMaster.moveDuration) and gameMaster.moveDuration[move]:
+            duration = gameMaster.moveDuration[move]
+            window = (gameMaster.moveDamageStart[move], gameMaster.moveDamageEnd[move])
+            delta = gameMaster.moveEnergy[move]
+        else:
+            duration, window, delta = UNKNOWN_MOVE_MS, (0, UNKNOWN_MOVE_MS), 0
+
+        yield BattleAction_pb2.BattleAction(
+            Type=BattleActionType_pb2.ACTION_SPECIAL_ATTACK if special else BattleActionType_pb2.ACTION_ATTACK,
+            action_start_ms=at,
+            duration_ms=duration,
+            energy_delta=delta,
+            active_pokemon_id=pokemon.id,
+            damage_windows_start_timestamp_mss=at + window[0],
+            damage_windows_end_timestamp_mss=at + window[1]
+        )
+        energy = max(0, min(maxEnergy, energy + delta))
+        at += duration
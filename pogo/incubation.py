@@ -0,0 +1,83 @@
+from inventory import items
+
+import logging
+
+
+def isUnlimited(incubator):
+    return incubator.item_id == items.INCUBATOR_BASIC_UNLIMITED
+
+
+def isFree(incubator):
+    """Empty and still usable"""
+    if incubator.pokemon_id:
+        return False
+    return isUnlimited(incubator) or incubator.uses_remaining > 0
+
+
+def getKmWalked(inventory):
+    # Stats are missing until the first inventory arrives
+    return getattr(inventory.stats, 'km_walked', 0.0)
+
+
+class IncubationScheduler(object):
+    """Keeps incubators full, only calling out when a slot frees up"""
+
+    def __init__(self):
+        # Distance at which the next running egg hatches
+        self.nextHatchKm = None
+
+    def waiting(self, inventory):
+        """Eggs not in an incubator, shortest first"""
+        eggs = [egg for egg in inventory.eggs if not egg.egg_incubator_id]
+        return sorted(eggs, key=lambda egg: egg.egg_km_walked_target)
+
+    def assign(self, inventory):
+        """(incubator, egg) pairs for every free slot we can fill"""
+        free = [i for i in inventory.incubators if isFree(i)]
+        eggs = self.waiting(inventory)
+        if not free or not eggs:
+            return []
+
+        # Shortest eggs hatch the most per km, of those the longest
+        # go to unlimited incubators so limited uses aren't spent on them
+        chosen = eggs[:len(free)]
+        free.sort(key=lambda i: (isUnlimited(i), -i.uses_remaining))
+        return list(zip(free[-len(chosen):], chosen))
+
+    def remaining(self, inventory):
+        """Km until each running incubator hatches"""
+        walked = getKmWalked(inventory)
+        return [
+            max(0.0, i.target_km_walked - walked)
+            for i in inventory.incubators if i.pokemon_id
+        ]
+
+    def due(self, inventory):
+        """True when a hatch or a new egg may have left a slot to fill"""
+        if self.nextHatchKm is None or getKmWalked(inventory) >= self.nextHatchKm:
+            return True
+        running = sum(1 for i in inventory.incubators if i.pokemon_id)
+        return running < len(inventory.incubators) and bool(self.waiting(inventory))
+
+    def update(self, session):
+        """Fill free incubators from the cached inventory, returns the responses"""
+        inventory = session.checkInventory()
+        if not self.due(inventory):
+            return []
+
+        responses = []
+        for incubator, egg in self.assign(inventory):
+            logging.info(
+                "(INCUBATE)\t-\t%.0fkm egg into %s",
+                egg.egg_km_walked_target,
+                incubator.id
+            )
+            responses.append(session.setEgg(incubator, egg))
+
+        # Refresh, so the next check sees the new targets
+        if responses:
+            inventory = session.getInventory()
+        remaining = self.remaining(inventory)
+        walked = getKmWalked(inventory)
+        self.nextHatchKm = walked + min(remaining) if remaining else None
+        return responses
@@ -1,54 +1,49 @@
+from POGOProtos.Inventory import ItemId_pb2
+from POGOProtos.Inventory import InventoryDelta_pb2
+from POGOProtos.Inventory import InventoryItem_pb2
+from POGOProtos.Inventory import InventoryItemData_pb2
+from POGOProtos.Networking.Responses import GetInventoryResponse_pb2
+
+from buffers import iterFields
+
+from compact import PokemonRecord, EggRecord, PokedexRecord
+from enums import createConstants
 from pokedex import pokedex
-import inspect
 
 
 class Items(dict):
-
-    # Static Lookups
-    UNKNOWN = 0
-    POKE_BALL = 1
-    GREAT_BALL = 2
-    ULTRA_BALL = 3
-    MASTER_BALL = 4
-    POTION = 101
-    SUPER_POTION = 102
-    HYPER_POTION = 103
-    MAX_POTION = 104
-    REVIVE = 201
-    MAX_REVIVE = 202
-    LUCKY_EGG = 301
-    INCENSE_ORDINARY = 401
-    INCENSE_SPICY = 402
-    INCENSE_COOL = 403
-    INCENSE_FLORAL = 404
-    TROY_DISK = 501
-    X_ATTACK = 602
-    X_DEFENSE = 603
-    X_MIRACLE = 604
-    RAZZ_BERRY = 701
-    BLUK_BERRY = 702
-    NANAB_BERRY = 703
-    WEPAR_BERRY = 704
-    PINAP_BERRY = 705
-    SPECIAL_CAMERA = 801
-    INCUBATOR_BASIC_UNLIMITED = 901
-    INCUBATOR_BASIC = 902
-    POKEMON_STORAGE_UPGRADE = 1001
-    ITEM_STORAGE_UPGRADE = 1002
+    """Item names by id, constants are generated from the ItemId enum"""
 
     def __init__(self):
-        super(dict, self).__init__(self)
-        attributes = inspect.getmembers(Items, lambda attr :not(inspect.isroutine(attr)))
-        for attr in attributes:
-            if attr[0].isupper():
-                self[attr[1]] = attr[0]
+        super(Items, self).__init__(
+            (value, name) for value, name in enumerate(ITEM_NAMES) if name
+        )
+        self.names = ITEM_NAMES
 
+    def getName(self, itemId):
+        return self.names[itemId]
+
+# POKE_BALL = 1 and so on, from ITEM_POKE_BALL
+ITEM_NAMES = createConstants(Items, ItemId_pb2.ItemId, prefix='ITEM_')
 items = Items()
 
+# Field numbers on the way down to each item
+INVENTORY_DELTA = GetInventoryResponse_pb2.GetInventoryResponse.DESCRIPTOR.fields_by_name['inventory_delta'].number
+INVENTORY_ITEMS = InventoryDelta_pb2.InventoryDelta.DESCRIPTOR.fields_by_name['inventory_items'].number
+ITEM_DATA = InventoryItem_pb2.InventoryItem.DESCRIPTOR.fields_by_name['inventory_item_data'].number
+
+# InventoryItemData field number to name and message class
+ITEM_FIELDS = dict(
+    (field.number, (field.name, type(getattr(InventoryItemData_pb2.InventoryItemData(), field.name))))
+    for field in InventoryItemData_pb2.InventoryItemData.DESCRIPTOR.fields
+)
+
+
 class Inventory(object):
 
     # Split from inventory since everything is bundled
-    def __init__(self, items):
+    # compact keeps slotted records instead of protobuf messages
+    def __init__(self, items, compact=False):
         # Reset inventory
         # Assuming sincetimestamp = 0
         # Otherwise have to associate time state,
@@ -60,40 +55,90 @@ class Inventory(object):
         self.party = []
         self.eggs = []
         self.bag = {}
+        self.applied = {}
+        self.compact = compact
         for item in items:
-            data = item.inventory_item_data
-
-            if data.HasField("player_stats"):
-                self.stats = data.player_stats
-                continue
-
-            pokedexEntry = getattr(data, "pokedex_entry", None)
-            if data.HasField("pokedex_entry"):
-                self.pokedex[pokedexEntry.pokemon_id] = data.pokedex_entry
+            # Only one field is ever set, dispatch on it
+            for field, value in item.inventory_item_data.ListFields():
+                decoder = self.DECODERS.get(field.name)
+                if decoder:
+                    decoder(self, value)
+                break
+
+    @classmethod
+    def fromBytes(cls, data, compact=False):
+        """From a serialized GetInventoryResponse, records keep their own slice of it"""
+        inventory = cls((), compact=compact)
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+
+        for field, start, end in iterFields(data, 0, len(data)):
+            if field != INVENTORY_DELTA:
                 continue
+            for field, start, end in iterFields(data, start, end):
+                if field != INVENTORY_ITEMS:
+                    continue
+                for field, start, end in iterFields(data, start, end):
+                    if field == ITEM_DATA:
+                        inventory.decodeSlice(data, start, end)
+        return inventory
+
+    def decodeSlice(self, data, start, end):
+        # Only one field is ever set, as with ListFields above
+        for field, start, end in iterFields(data, start, end):
+            if field not in ITEM_FIELDS:
+                return
+            name, message = ITEM_FIELDS[field]
+            decoder = self.DECODERS.get(name)
+            if decoder:
+                raw = data[start:end]
+                if name in self.RAW_DECODERS:
+                    decoder(self, message.FromString(raw), raw)
+                else:
+                    decoder(self, message.FromString(raw))
+            return
 
-            pokemonFamily = getattr(data, "pokemon_family", None)
-            if data.HasField("pokemon_family"):
-                self.candies[pokemonFamily.family_id] = pokemonFamily.candy
-                continue
+    # Decoders, one per InventoryItemData field
+    def addStats(self, stats):
+        self.stats = stats
 
-            pokemonData = getattr(data, "pokemon_data", None)
-            if data.HasField("pokemon_data"):
-                if pokemonData.is_egg:
-                    self.eggs.append(pokemonData)
-                else:
-                    self.party.append(pokemonData)
-                continue
+    def addPokedexEntry(self, entry, raw=None):
+        if self.compact:
+            entry = PokedexRecord(entry, raw)
+        self.pokedex[entry.pokemon_id] = entry
 
-            incubators = getattr(data, "egg_incubators", None)
-            if data.HasField("egg_incubators"):
-                self.incubators = incubators.egg_incubator
-                continue
+    def addCandy(self, family):
+        self.candies[family.family_id] = family.candy
 
-            bagItem = getattr(data, "item", None)
-            if data.HasField("item"):
-                self.bag[bagItem.item_id] = bagItem.count
-                continue
+    def addPokemon(self, pokemon, raw=None):
+        if pokemon.is_egg:
+            self.eggs.append(EggRecord(pokemon, raw) if self.compact else pokemon)
+        else:
+            self.party.append(PokemonRecord(pokemon, raw) if self.compact else pokemon)
+
+    def addIncubators(self, incubators):
+        self.incubators = incubators.egg_incubator
+
+    def addItem(self, item):
+        self.bag[item.item_id] = item.count
+
+    # Running lucky eggs, incense, expiry by item
+    def addApplied(self, applied):
+        for item in applied.item:
+            self.applied[item.item_id] = item.expire_ms
+
+    DECODERS = {
+        'player_stats': addStats,
+        'pokedex_entry': addPokedexEntry,
+        'pokemon_family': addCandy,
+        'pokemon_data': addPokemon,
+        'egg_incubators': addIncubators,
+        'item': addItem,
+        'applied_items': addApplied,
+    }
+
+    # Decoders that keep the wire bytes in compact records
+    RAW_DECODERS = frozenset(['pokedex_entry', 'pokemon_data'])
 
     def __getitem__(self, lookup):
         if lookup in self.bag:
@@ -0,0 +1,192 @@
+from POGOProtos.Networking.Envelopes import RequestEnvelope_pb2
+from POGOProtos.Networking.Envelopes import ResponseEnvelope_pb2
+from POGOProtos.Networking.Requests import RequestType_pb2
+from POGOProtos.Networking.Requests.Messages import AttackGymMessage_pb2
+from POGOProtos.Networking.Requests.Messages import StartGymBattleMessage_pb2
+from POGOProtos.Networking.Responses import AttackGymResponse_pb2
+from POGOProtos.Networking.Responses import GetGymDetailsResponse_pb2
+from POGOProtos.Networking.Responses import StartGymBattleResponse_pb2
+from POGOProtos.Data.Battle import BattleActionType_pb2
+from POGOProtos.Data.Battle import BattleState_pb2
+
+import gzip
+import io
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+def echo(req):
+    """Answer every request with its own message"""
+    return ResponseEnvelope_pb2.ResponseEnvelope(
+        status_code=2,
+        request_id=req.request_id,
+        returns=[r.request_message for r in req.requests]
+    )
+
+
+class GymServer(object):
+    """Handler playing gym battles, every attack lands for a fixed amount"""
+
+    def __init__(self, defenders, damage=10, specialDamage=40):
+        # defenders: PokemonData in the gym, each fights with double stamina
+        self.defenders = defenders
+        self.damage = damage
+        self.specialDamage = specialDamage
+        self.battles = {}
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def __call__(self, req):
+        returns = []
+        for r in req.requests:
+            handle = self.HANDLERS.get(r.request_type)
+            returns.append(handle(self, r.request_message).SerializeToString() if handle else b'')
+        return ResponseEnvelope_pb2.ResponseEnvelope(
+            status_code=1,
+            request_id=req.request_id,
+            returns=returns
+        )
+
+    def details(self, message):
+        res = GetGymDetailsResponse_pb2.GetGymDetailsResponse(result=1)
+        for pokemon in self.defenders:
+            res.gym_state.memberships.add().pokemon_data.CopyFrom(pokemon)
+        return res
+
+    def start(self, message):
+        msg = StartGymBattleMessage_pb2.StartGymBattleMessage()
+        msg.ParseFromString(message)
+        now = int(time.time() * 1000)
+        with self._lock:
+            battleId = 'battle-{0}'.format(len(self.battles))
+            defender = self.defenders[0]
+            self.battles[battleId] = {'defender': defender, 'hp': defender.stamina_max * 2, 'actions': []}
+
+        res = StartGymBattleResponse_pb2.StartGymBattleResponse(
+            result=1,
+            battle_id=battleId,
+            battle_start_timestamp_ms=now
+        )
+        res.defender.active_pokemon.pokemon_data.CopyFrom(defender)
+        res.defender.active_pokemon.current_health = defender.stamina_max * 2
+        res.battle_log.state = BattleState_pb2.ACTIVE
+        res.battle_log.server_ms = now
+        joined = res.battle_log.battle_actions.add()
+        joined.Type = BattleActionType_pb2.ACTION_PLAYER_JOIN
+        joined.action_start_ms = now
+        return res
+
+    def attack(self, message):
+        msg = AttackGymMessage_pb2.AttackGymMessage()
+        msg.ParseFromString(message)
+        res = AttackGymResponse_pb2.AttackGymResponse(battle_id=msg.battle_id)
+        with self._lock:
+            battle = self.battles.get(msg.battle_id)
+            if battle is None:
+                res.result = 2
+                return res
+            self.batches.append(len(msg.attack_actions))
+            for action in msg.attack_actions:
+                special = action.Type == BattleActionType_pb2.ACTION_SPECIAL_ATTACK
+                battle['hp'] -= self.specialDamage if special else self.damage
+                battle['actions'].append(action)
+
+            # Everything after what the client last saw
+            seen = msg.last_retrieved_actions.action_start_ms
+            res.result = 1
+            res.battle_log.server_ms = int(time.time() * 1000)
+            res.battle_log.battle_actions.extend(
+                a for a in battle['actions'] if a.action_start_ms >= seen
+            )
+            res.active_defender.pokemon_data.CopyFrom(battle['defender'])
+            res.active_defender.current_health = max(0, battle['hp'])
+            res.battle_log.state = BattleState_pb2.VICTORY if battle['hp'] <= 0 else BattleState_pb2.ACTIVE
+        return res
+
+    HANDLERS = {
+        RequestType_pb2.GET_GYM_DETAILS: details,
+        RequestType_pb2.START_GYM_BATTLE: start,
+        RequestType_pb2.ATTACK_GYM: attack,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.owner.countConnection()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        req = RequestEnvelope_pb2.RequestEnvelope()
+        req.ParseFromString(self.rfile.read(length))
+        body = self.server.owner.respond(req).SerializeToString()
+
+        # Compress when asked and allowed
+        encoding = None
+        accepted = self.headers.get('Accept-Encoding', '')
+        if self.server.owner.compress and 'gzip' in accepted:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            encoding = 'gzip'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-protobuf')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Keep benchmarks quiet
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalServer(object):
+    """Threaded localhost stand-in for the RPC endpoint"""
+
+    def __init__(self, handler=echo, port=0, compress=False):
+        self.handler = handler
+        self.compress = compress
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.owner = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/rpc'.format(self._server.server_address[1])
+
+    def countConnection(self):
+        with self._lock:
+            self.connections += 1
+
+    def respond(self, req):
+        return self.handler(req)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
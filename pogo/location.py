@@ -3,6 +3,9 @@ from s2sphere import CellId, LatLng
 from custom_exceptions import GeneralPogoException
 import gpxpy.geo
 
+# Geocoded searches, shared process wide and with forked children
+GEOCODED = {}
+
 
 # Wrapper for location
 class Location(object):
@@ -42,6 +45,9 @@ class Location(object):
         return Location(None, None, noop=True)
 
     def setLocation(self, search):
+        if search in GEOCODED:
+            return GEOCODED[search]
+
         geo = 1
         while geo == 1:
             try:
@@ -49,7 +55,8 @@ class Location(object):
             except:
                 print ('Error in Geo Request')
 
-        return geo.latitude, geo.longitude, geo.altitude
+        GEOCODED[search] = (geo.latitude, geo.longitude, geo.altitude)
+        return GEOCODED[search]
 
     def setCoordinates(self, latitude, longitude):
         self.latitude = latitude
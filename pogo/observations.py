@@ -0,0 +1,119 @@
+from POGOProtos.Map import MapCell_pb2
+
+from location import Location
+
+import multiprocessing
+import threading
+import time
+
+# Seconds a scanned cell stays good enough for everyone
+REFRESH_WINDOW = 10
+
+# The server picks wild and catchable pokemon by the scanner's position, so
+# a cell only stands in for a scan made from within this many meters
+SHARE_RADIUS = 10
+
+
+def createSharedStore():
+    """Cell store other processes can see, hand it to each process's bus"""
+    return multiprocessing.Manager().dict()
+
+
+class ObservationBus(object):
+    """Latest MapCell per S2 cell id and where it was scanned from, read by sessions close by"""
+
+    def __init__(self, window=REFRESH_WINDOW, shared=None, radius=SHARE_RADIUS):
+        # shared: optional createSharedStore(), cells travel through it serialized
+        self.window = window
+        self.radius = radius
+        self.shared = shared
+        self._cells = {}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.published = 0
+        self.requested = 0
+        self.cellsAvoided = 0
+        self.scansAvoided = 0
+
+    def publish(self, cells, latitude, longitude, now=None):
+        now = now or time.time()
+
+        # Copies, the session parses its next scan into the originals
+        copies = []
+        for cell in cells:
+            copy = MapCell_pb2.MapCell()
+            copy.CopyFrom(cell)
+            copies.append(copy)
+        cells = copies
+
+        with self._lock:
+            for cell in cells:
+                self._cells[cell.s2_cell_id] = (now, latitude, longitude, cell)
+            self.published += len(cells)
+
+        if self.shared is not None:
+            for cell in cells:
+                self.shared[cell.s2_cell_id] = (now, latitude, longitude, cell.SerializeToString())
+
+    def usable(self, entry, now, latitude, longitude):
+        return entry is not None and now - entry[0] <= self.window and \
+            Location.getDistance(latitude, longitude, entry[1], entry[2]) <= self.radius
+
+    def lookup(self, cellId, now, latitude, longitude):
+        with self._lock:
+            entry = self._cells.get(cellId)
+        if self.usable(entry, now, latitude, longitude):
+            return entry[3]
+        if self.shared is None:
+            return None
+
+        # Someone else's scan, keep it locally from now on
+        entry = self.shared.get(cellId)
+        if not self.usable(entry, now, latitude, longitude):
+            return None
+        cell = MapCell_pb2.MapCell()
+        cell.ParseFromString(entry[3])
+        with self._lock:
+            self._cells[cellId] = entry[:3] + (cell,)
+        return cell
+
+    def fresh(self, cellIds, latitude, longitude, now=None):
+        """Cells refreshed within the window from close to here, by id"""
+        now = now or time.time()
+        found = {}
+        for cellId in cellIds:
+            cell = self.lookup(cellId, now, latitude, longitude)
+            if cell is not None:
+                found[cellId] = cell
+
+        with self._lock:
+            self.requested += len(cellIds)
+            self.cellsAvoided += len(found)
+            if len(found) == len(cellIds):
+                self.scansAvoided += 1
+        return found
+
+    def expire(self, now=None):
+        """Drop what's too old to hand out, returns how many went"""
+        now = now or time.time()
+        with self._lock:
+            old = [c for c in self._cells if now - self._cells[c][0] > self.window]
+            for cellId in old:
+                del self._cells[cellId]
+
+        # Any process may do this for the shared store
+        if self.shared is not None:
+            for cellId, entry in self.shared.items():
+                if now - entry[0] > self.window:
+                    self.shared.pop(cellId, None)
+        return len(old)
+
+    def report(self):
+        return {
+            'published': self.published,
+            'requested': self.requested,
+            'cellsAvoided': self.cellsAvoided,
+            'scansAvoided': self.scansAvoided,
+            'cached': len(self._cells),
+        }
@@ -1,173 +1,27 @@
-import inspect
+from POGOProtos.Enums import PokemonFamilyId_pb2
+from POGOProtos.Enums import PokemonId_pb2
 
+from enums import createConstants
 
-class Pokedex(dict):
 
-    # Enum pokemonIds
-    MISSINGNO = 0
-    BULBASAUR = 1
-    IVYSAUR = 2
-    VENUSAUR = 3
-    CHARMANDER = 4
-    CHARMELEON = 5
-    CHARIZARD = 6
-    SQUIRTLE = 7
-    WARTORTLE = 8
-    BLASTOISE = 9
-    CATERPIE = 10
-    METAPOD = 11
-    BUTTERFREE = 12
-    WEEDLE = 13
-    KAKUNA = 14
-    BEEDRILL = 15
-    PIDGEY = 16
-    PIDGEOTTO = 17
-    PIDGEOT = 18
-    RATTATA = 19
-    RATICATE = 20
-    SPEAROW = 21
-    FEAROW = 22
-    EKANS = 23
-    ARBOK = 24
-    PIKACHU = 25
-    RAICHU = 26
-    SANDSHREW = 27
-    SANDSLASH = 28
-    NIDORAN_FEMALE = 29
-    NIDORINA = 30
-    NIDOQUEEN = 31
-    NIDORAN_MALE = 32
-    NIDORINO = 33
-    NIDOKING = 34
-    CLEFAIRY = 35
-    CLEFABLE = 36
-    VULPIX = 37
-    NINETALES = 38
-    JIGGLYPUFF = 39
-    WIGGLYTUFF = 40
-    ZUBAT = 41
-    GOLBAT = 42
-    ODDISH = 43
-    GLOOM = 44
-    VILEPLUME = 45
-    PARAS = 46
-    PARASECT = 47
-    VENONAT = 48
-    VENOMOTH = 49
-    DIGLETT = 50
-    DUGTRIO = 51
-    MEOWTH = 52
-    PERSIAN = 53
-    PSYDUCK = 54
-    GOLDUCK = 55
-    MANKEY = 56
-    PRIMEAPE = 57
-    GROWLITHE = 58
-    ARCANINE = 59
-    POLIWAG = 60
-    POLIWHIRL = 61
-    POLIWRATH = 62
-    ABRA = 63
-    KADABRA = 64
-    ALAKAZAM = 65
-    MACHOP = 66
-    MACHOKE = 67
-    MACHAMP = 68
-    BELLSPROUT = 69
-    WEEPINBELL = 70
-    VICTREEBEL = 71
-    TENTACOOL = 72
-    TENTACRUEL = 73
-    GEODUDE = 74
-    GRAVELER = 75
-    GOLEM = 76
-    PONYTA = 77
-    RAPIDASH = 78
-    SLOWPOKE = 79
-    SLOWBRO = 80
-    MAGNEMITE = 81
-    MAGNETON = 82
-    FARFETCHD = 83
-    DODUO = 84
-    DODRIO = 85
-    SEEL = 86
-    DEWGONG = 87
-    GRIMER = 88
-    MUK = 89
-    SHELLDER = 90
-    CLOYSTER = 91
-    GASTLY = 92
-    HAUNTER = 93
-    GENGAR = 94
-    ONIX = 95
-    DROWZEE = 96
-    HYPNO = 97
-    KRABBY = 98
-    KINGLER = 99
-    VOLTORB = 100
-    ELECTRODE = 101
-    EXEGGCUTE = 102
-    EXEGGUTOR = 103
-    CUBONE = 104
-    MAROWAK = 105
-    HITMONLEE = 106
-    HITMONCHAN = 107
-    LICKITUNG = 108
-    KOFFING = 109
-    WEEZING = 110
-    RHYHORN = 111
-    RHYDON = 112
-    CHANSEY = 113
-    TANGELA = 114
-    KANGASKHAN = 115
-    HORSEA = 116
-    SEADRA = 117
-    GOLDEEN = 118
-    SEAKING = 119
-    STARYU = 120
-    STARMIE = 121
-    MR_MIME = 122
-    SCYTHER = 123
-    JYNX = 124
-    ELECTABUZZ = 125
-    MAGMAR = 126
-    PINSIR = 127
-    TAUROS = 128
-    MAGIKARP = 129
-    GYARADOS = 130
-    LAPRAS = 131
-    DITTO = 132
-    EEVEE = 133
-    VAPOREON = 134
-    JOLTEON = 135
-    FLAREON = 136
-    PORYGON = 137
-    OMANYTE = 138
-    OMASTAR = 139
-    KABUTO = 140
-    KABUTOPS = 141
-    AERODACTYL = 142
-    SNORLAX = 143
-    ARTICUNO = 144
-    ZAPDOS = 145
-    MOLTRES = 146
-    DRATINI = 147
-    DRAGONAIR = 148
-    DRAGONITE = 149
-    MEWTWO = 150
-    MEW = 151
+class Pokedex(dict):
+    """Pokemon names by id, constants are generated from the PokemonId enum"""
 
     rarity = {}
     evolves = {}
 
-    def __init__(self):
-        super(dict, self).__init__(self)
+    # Lookup tables indexed by PokemonId
+    rarityTable = ()
+    candyTable = ()
+    familyTable = ()
+    evolutionTable = ()
+    chainTable = ()
 
-        # Some reflection, based on uppercase consts.
-        attributes = inspect.getmembers(Pokedex, lambda attr :not(inspect.isroutine(attr)))
-        for attr in attributes:
-            if attr[0].isupper():
-                self[attr[1]] = attr[0]
+    def __init__(self):
+        super(Pokedex, self).__init__(
+            (value, name) for value, name in enumerate(POKEMON_NAMES) if name
+        )
+        self.names = POKEMON_NAMES
 
         # Ideally go back and lint for line lengths
         self.rarity[Rarity.MYTHIC] = [self.MEW]
@@ -250,13 +104,112 @@ class Pokedex(dict):
             self.MEWTWO: 0, self.MEW: 0
         }
 
+        self.buildTables()
+
+    # Flatten everything into tuples, so lookups are one index
+    def buildTables(self):
+        size = max(PokemonId_pb2.PokemonId.values()) + 1
+        self.idsByName = dict(PokemonId_pb2.PokemonId.items())
+
+        rarity = [None] * size
+        for bucket in self.rarity:
+            for pokemonId in self.rarity[bucket]:
+                rarity[pokemonId] = bucket
+
+        # Families are contiguous runs starting at the family's base id.
+        # Skip bases that something evolves into (FAMILY_HYPNO)
+        family = [0] * size
+        bases = sorted(
+            v for v in PokemonFamilyId_pb2.PokemonFamilyId.values()
+            if v and not self.evolves.get(v - 1, 0)
+        )
+        for base, end in zip(bases, bases[1:] + [size]):
+            for pokemonId in range(base, end):
+                family[pokemonId] = base
+
+        members = {}
+        for pokemonId in range(1, size):
+            members.setdefault(family[pokemonId], []).append(pokemonId)
+
+        candy = [self.evolves.get(pokemonId, 0) for pokemonId in range(size)]
+
+        # Evolve into the next stage, or branch into every final form (Eevee)
+        evolutions = [()] * size
+        for pokemonId in range(1, size):
+            if not candy[pokemonId]:
+                continue
+            later = [m for m in members[family[pokemonId]] if m > pokemonId]
+            if later and candy[later[0]]:
+                evolutions[pokemonId] = (later[0],)
+            else:
+                evolutions[pokemonId] = tuple(later)
+
+        self.rarityTable = tuple(rarity)
+        self.candyTable = tuple(candy)
+        self.familyTable = tuple(family)
+        self.evolutionTable = tuple(evolutions)
+        self.chainTable = tuple(
+            tuple(members.get(family[pokemonId], ())) for pokemonId in range(size)
+        )
+
+    # Swap in authoritative data from the game master
+    def applyGameMaster(self, gameMaster):
+        candy = list(self.candyTable)
+        family = list(self.familyTable)
+        evolutions = list(self.evolutionTable)
+        for pokemonId in range(1, len(self.candyTable)):
+            if pokemonId >= len(gameMaster.family) or not gameMaster.family[pokemonId]:
+                continue
+            candy[pokemonId] = gameMaster.candyToEvolve[pokemonId]
+            family[pokemonId] = gameMaster.family[pokemonId]
+            evolutions[pokemonId] = gameMaster.evolutions[pokemonId]
+
+        members = {}
+        for pokemonId in range(1, len(family)):
+            members.setdefault(family[pokemonId], []).append(pokemonId)
+
+        self.candyTable = tuple(candy)
+        self.familyTable = tuple(family)
+        self.evolutionTable = tuple(evolutions)
+        self.chainTable = tuple(
+            tuple(members.get(family[pokemonId], ())) for pokemonId in range(len(family))
+        )
+
+    def getName(self, pokemonId):
+        return self.names[pokemonId]
+
+    def getIdByName(self, name):
+        return self.idsByName[name]
+
     def getRarityByName(self, name):
-        return self.RarityById(self[name])
+        return self.rarityTable[self.idsByName[name]]
 
     def getRarityById(self, pokemonId):
-        for rarity in self.rarity:
-            if pokemonId in self.rarity[rarity]:
-                return rarity
+        return self.rarityTable[pokemonId]
+
+    def getRaritiesByIds(self, pokemonIds):
+        table = self.rarityTable
+        return [table[pokemonId] for pokemonId in pokemonIds]
+
+    def getCandyToEvolve(self, pokemonId):
+        return self.candyTable[pokemonId]
+
+    def getCandiesToEvolve(self, pokemonIds):
+        table = self.candyTable
+        return [table[pokemonId] for pokemonId in pokemonIds]
+
+    def getFamily(self, pokemonId):
+        return self.familyTable[pokemonId]
+
+    def getFamilies(self, pokemonIds):
+        table = self.familyTable
+        return [table[pokemonId] for pokemonId in pokemonIds]
+
+    def getEvolutions(self, pokemonId):
+        return self.evolutionTable[pokemonId]
+
+    def getEvolutionChain(self, pokemonId):
+        return self.chainTable[pokemonId]
 
 
 class Rarity(object):
@@ -269,4 +222,7 @@ class Rarity(object):
     LEGENDARY = 6
     MYTHIC = 7
 
+# BULBASAUR = 1 and so on
+POKEMON_NAMES = createConstants(Pokedex, PokemonId_pb2.PokemonId)
+
 pokedex = Pokedex()
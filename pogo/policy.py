@@ -0,0 +1,183 @@
+from evolution import executePlan, planSteps
+from inventory import items
+from pokedex import pokedex
+
+import copy
+import logging
+import time
+from operator import itemgetter
+
+# json gives unicode keys on Python 2
+try:
+    stringTypes = basestring
+except NameError:
+    stringTypes = str
+
+# How to rank pokemon of one species
+RANK_CP = 'cp'
+RANK_IV = 'iv'
+
+
+def getIv(pokemon):
+    return pokemon.individual_attack + pokemon.individual_defense + pokemon.individual_stamina
+
+
+class Policy(object):
+    """Declarative rules for what to keep in the bag and the party"""
+
+    def __init__(self, tossAll=(), caps=None, keepTop=1, rankBy=RANK_CP,
+                 keepSpecies=(), keepAboveCp=None, keepAboveIv=None,
+                 speciesKeepAboveCp=None, keepFavorites=True, planner=None):
+        # Items
+        self.tossAll = tuple(tossAll)
+        self.caps = dict(caps or {})
+
+        # Pokemon, keepAboveIv is a percentage
+        self.keepTop = keepTop
+        self.rankBy = rankBy
+        self.keepSpecies = frozenset(keepSpecies)
+        self.keepAboveCp = keepAboveCp
+        self.keepAboveIv = keepAboveIv
+        self.speciesKeepAboveCp = dict(speciesKeepAboveCp or {})
+        self.keepFavorites = keepFavorites
+
+        # Evolutions, an EvolvePlanner or None
+        self.planner = planner
+
+    @staticmethod
+    def fromDict(rules, planner=None):
+        """Build from config, items may be given by name"""
+        def itemId(key):
+            return getattr(items, key) if isinstance(key, stringTypes) else key
+
+        rules = dict(rules)
+        rules['tossAll'] = [itemId(i) for i in rules.get('tossAll', ())]
+        rules['caps'] = dict((itemId(i), c) for i, c in rules.get('caps', {}).items())
+        rules['speciesKeepAboveCp'] = dict(
+            (int(k), v) for k, v in rules.get('speciesKeepAboveCp', {}).items()
+        )
+        return Policy(planner=planner, **rules)
+
+
+class Operations(object):
+    """Batch of RPCs a policy asks for"""
+
+    def __init__(self):
+        self.recycle = []
+        self.release = []
+        self.evolve = None
+
+    def __len__(self):
+        return len(self.recycle) + len(self.release) + (len(self.evolve) if self.evolve else 0)
+
+    def __str__(self):
+        return 'Operations: {0} recycles, {1} releases, {2}'.format(
+            len(self.recycle),
+            len(self.release),
+            self.evolve or 'no evolutions'
+        )
+
+
+class PolicyEngine(object):
+    """Evaluates a Policy against an inventory in one pass"""
+
+    def __init__(self, policy):
+        self.policy = policy
+
+    def evaluateBag(self, bag, ops):
+        policy = self.policy
+        for itemId in policy.tossAll:
+            if bag.get(itemId, 0) > 0:
+                ops.recycle.append((itemId, bag[itemId]))
+        for itemId in policy.caps:
+            count = bag.get(itemId, 0)
+            if count > policy.caps[itemId] and itemId not in policy.tossAll:
+                ops.recycle.append((itemId, count - policy.caps[itemId]))
+
+    def protected(self, pokemon, species, cp):
+        """Exempt from release, thresholds before the field reads they save"""
+        policy = self.policy
+        if species in policy.keepSpecies:
+            return True
+        if policy.keepAboveCp is not None and cp > policy.keepAboveCp:
+            return True
+        speciesCp = policy.speciesKeepAboveCp.get(species)
+        if speciesCp is not None and cp > speciesCp:
+            return True
+        if policy.keepAboveIv is not None and getIv(pokemon) * 100.0 / 45 > policy.keepAboveIv:
+            return True
+        if policy.keepFavorites and pokemon.favorite:
+            return True
+        return bool(pokemon.deployed_fort_id)
+
+    def evaluateParty(self, party, ops):
+        policy = self.policy
+
+        # Field reads are the expensive part, read each one once
+        bySpecies = {}
+        for pokemon in party:
+            species = pokemon.pokemon_id
+            if species not in policy.keepSpecies:
+                bySpecies.setdefault(species, []).append((pokemon.cp, pokemon))
+
+        for species in bySpecies:
+            ranked = bySpecies[species]
+            if len(ranked) <= policy.keepTop:
+                continue
+            if policy.rankBy == RANK_IV:
+                ranked.sort(key=lambda entry: (getIv(entry[1]), entry[0]), reverse=True)
+            else:
+                ranked.sort(key=itemgetter(0), reverse=True)
+            for cp, pokemon in ranked[policy.keepTop:]:
+                if not self.protected(pokemon, species, cp):
+                    ops.release.append(pokemon)
+
+    def evaluate(self, inventory):
+        ops = Operations()
+        self.evaluateBag(inventory.bag, ops)
+        self.evaluateParty(inventory.party, ops)
+
+        # Plan evolutions on what's left, with the candy releases bring
+        if self.policy.planner:
+            released = set(id(p) for p in ops.release)
+            survivors = copy.copy(inventory)
+            survivors.party = [p for p in inventory.party if id(p) not in released]
+            survivors.candies = dict(inventory.candies)
+            for pokemon in ops.release:
+                family = pokedex.familyTable[pokemon.pokemon_id]
+                survivors.candies[family] = survivors.candies.get(family, 0) + 1
+            ops.evolve = self.policy.planner.plan(survivors)
+        return ops
+
+
+def recycleStep(itemId, count):
+    def call(session):
+        logging.info("(ITEM MANAGE)\t-\tRecycling %d %s", count, items[itemId])
+        return session.recycleItem(itemId, count)
+    return call
+
+
+def releaseStep(pokemon):
+    def call(session):
+        logging.info("(POKEMANAGE)\t-\tReleasing: %s %d CP", pokedex[pokemon.pokemon_id], pokemon.cp)
+        return session.releasePokemon(pokemon)
+    return call
+
+
+def operationSteps(ops, delay=0, evolve=True):
+    """(call, wait) per RPC, in the order executeOperations sends them"""
+    steps = [(recycleStep(itemId, count), 0) for itemId, count in ops.recycle]
+    steps.extend((releaseStep(pokemon), delay) for pokemon in ops.release)
+    if evolve and ops.evolve:
+        steps.extend(planSteps(ops.evolve, delay))
+    return steps
+
+
+def executeOperations(session, ops, delay=0):
+    """Send what a policy asked for"""
+    for call, wait in operationSteps(ops, delay, evolve=False):
+        call(session)
+        if wait:
+            time.sleep(wait)
+    if ops.evolve:
+        executePlan(session, ops.evolve, delay=delay)
@@ -0,0 +1,133 @@
+from POGOProtos.Networking.Envelopes import RequestEnvelope_pb2
+
+from custom_exceptions import TransportPogoException
+from transport import Transport, BufferedResponse
+
+import collections
+import struct
+import threading
+import time
+
+# File layout: MAGIC, then per exchange
+# HEADER (offset, duration, status, request length, response length)
+# followed by the request and response bytes
+MAGIC = b'POGOREC1'
+HEADER = struct.Struct('<ddHII')
+
+
+def createKey(data):
+    """Replay keys, exact payloads and request types only"""
+    req = RequestEnvelope_pb2.RequestEnvelope()
+    req.ParseFromString(data)
+    types = tuple(r.request_type for r in req.requests)
+    messages = tuple(r.request_message for r in req.requests)
+    return (types, messages), types
+
+
+def readRecords(path):
+    """Yield (offset, duration, status, request, response) tuples"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a recording'.format(path))
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            offset, duration, status, reqLength, resLength = HEADER.unpack(header)
+            yield offset, duration, status, f.read(reqLength), f.read(resLength)
+
+
+class RecordingTransport(Transport):
+    """Passes traffic through to another transport and writes it down"""
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def write(self, sent, duration, status, data, content):
+        header = HEADER.pack(sent - self._start, duration, status, len(data), len(content))
+        with self._lock:
+            self._file.write(header)
+            self._file.write(data)
+            self._file.write(content)
+
+    def post(self, url, data):
+        sent = time.time()
+        rawResponse = self.inner.post(url, data)
+        self.write(sent, time.time() - sent, rawResponse.status_code, data, rawResponse.content)
+        return rawResponse
+
+    def postInto(self, url, data, pool):
+        sent = time.time()
+        rawResponse = self.inner.postInto(url, data, pool)
+        self.write(sent, time.time() - sent, rawResponse.status_code, data, rawResponse.content)
+        return rawResponse
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.inner.close()
+
+
+class ReplayTransport(Transport):
+    """Serves recorded responses, safe to share between many sessions"""
+
+    def __init__(self, path, speed=1.0, loop=True):
+        # speed is a multiplier on recorded latency, 0 to skip waiting
+        self.speed = speed
+        self.loop = loop
+        self._exact = collections.defaultdict(list)
+        self._typed = collections.defaultdict(list)
+        self._cursors = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path is None:
+            return
+        for _, duration, status, data, content in readRecords(path):
+            exact, typed = createKey(data)
+            exchange = (duration, status, content)
+            self._exact[exact].append(exchange)
+            self._typed[typed].append(exchange)
+
+    def fork(self):
+        """Same recording, own cursors, so each session replays deterministically"""
+        other = ReplayTransport(None, speed=self.speed, loop=self.loop)
+        other._exact = self._exact
+        other._typed = self._typed
+        return other
+
+    def next(self, key, table):
+        with self._lock:
+            exchanges = table.get(key)
+            if not exchanges:
+                return None
+            cursor = self._cursors[(id(table), key)]
+            if cursor >= len(exchanges):
+                if not self.loop:
+                    return None
+                cursor = 0
+            self._cursors[(id(table), key)] = cursor + 1
+            return exchanges[cursor]
+
+    def post(self, url, data):
+        exact, typed = createKey(data)
+
+        # Payloads drift (coordinates, timestamps), fall back to types
+        exchange = self.next(exact, self._exact) or self.next(typed, self._typed)
+        with self._lock:
+            if exchange is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if exchange is None:
+            raise TransportPogoException('No recorded response for {0}'.format(typed))
+
+        duration, status, content = exchange
+        if self.speed:
+            time.sleep(duration / self.speed)
+        return BufferedResponse(status, content)
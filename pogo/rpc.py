@@ -0,0 +1,215 @@
+from POGOProtos.Networking.Requests import RequestType_pb2
+
+from custom_exceptions import AuthPogoException
+from custom_exceptions import CircuitOpenPogoException
+from custom_exceptions import EmptyResponsePogoException
+from custom_exceptions import RedirectPogoException
+from custom_exceptions import ThrottledPogoException
+from custom_exceptions import TransportPogoException
+
+import itertools
+import os
+import random
+import threading
+import time
+
+# Envelope status codes
+STATUS_OK = 1
+STATUS_OK_RPC = 2
+STATUS_BAD_REQUEST = 3
+STATUS_THROTTLED = 52
+STATUS_REDIRECT = 53
+STATUS_AUTH_EXPIRED = 102
+
+# HTTP codes we treat as back-off signals
+HTTP_THROTTLED = (429, 503)
+
+# Endpoint moves in a row before we stop following them
+MAX_REDIRECTS = 5
+
+# Safe to resend after a transport failure, the server may have run anything else
+READS = frozenset([
+    RequestType_pb2.GET_PLAYER,
+    RequestType_pb2.GET_INVENTORY,
+    RequestType_pb2.GET_HATCHED_EGGS,
+    RequestType_pb2.CHECK_AWARDED_BADGES,
+    RequestType_pb2.DOWNLOAD_SETTINGS,
+    RequestType_pb2.DOWNLOAD_ITEM_TEMPLATES,
+    RequestType_pb2.GET_MAP_OBJECTS,
+    RequestType_pb2.FORT_DETAILS,
+    RequestType_pb2.GET_GYM_DETAILS,
+    RequestType_pb2.GET_INCENSE_POKEMON,
+])
+
+
+def checkHttp(rawResponse):
+    """Raise on an HTTP level failure"""
+    code = rawResponse.status_code
+    if code in HTTP_THROTTLED:
+        raise ThrottledPogoException('HTTP {0}'.format(code))
+    if code != 200:
+        raise TransportPogoException('HTTP {0}'.format(code))
+
+
+def checkResponse(req, res):
+    """Raise on a response envelope we can't use"""
+    status = res.status_code
+    if status == STATUS_REDIRECT and res.api_url:
+        raise RedirectPogoException(
+            'Redirected to {0}'.format(res.api_url),
+            res.api_url,
+            response=res
+        )
+    if status == STATUS_AUTH_EXPIRED:
+        raise AuthPogoException('Auth ticket expired')
+    if status == STATUS_THROTTLED:
+        raise ThrottledPogoException('Throttled by server')
+
+    # Asked for something and got nothing back
+    if len(req.requests) and not len(res.returns):
+        raise EmptyResponsePogoException(
+            'Empty response, status {0} {1}'.format(status, res.error).strip()
+        )
+
+
+def refused(res):
+    """Answered, but the bad request status soft bans come back with"""
+    return res.status_code == STATUS_BAD_REQUEST
+
+
+def isRead(req):
+    """Whether every request in the envelope only reads"""
+    return all(r.request_type in READS for r in req.requests)
+
+
+class RequestIds(object):
+    """Request id allocator, safe across threads and forks"""
+
+    def __init__(self):
+        self.reseed()
+
+    def reseed(self):
+        # Each process gets its own random start
+        start = random.SystemRandom().randint(1, 10 ** 12)
+        self._pid = os.getpid()
+        self._counter = itertools.count(start)
+
+    def next(self):
+        if self._pid != os.getpid():
+            self.reseed()
+
+        # count() steps atomically under the GIL, no lock needed
+        return next(self._counter)
+
+
+class RetryPolicy(object):
+    """Exponential back-off with full jitter"""
+
+    def __init__(self, attempts=5, base=0.5, cap=30.0, throttledBase=2.0):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.throttledBase = throttledBase
+
+    def backoff(self, attempt, throttled=False):
+        """Seconds to wait before retry number `attempt`, None to give up"""
+        if attempt >= self.attempts:
+            return None
+        base = self.throttledBase if throttled else self.base
+        return random.uniform(0, min(self.cap, base * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """Per endpoint breaker, opens after repeated failures"""
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, threshold=10, resetTimeout=60.0):
+        self.threshold = threshold
+        self.resetTimeout = resetTimeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = 0
+
+    def check(self):
+        if self.state == self.OPEN:
+            if time.time() - self.openedAt < self.resetTimeout:
+                raise CircuitOpenPogoException('Circuit open, skipping request')
+
+            # Let a single probe through
+            self.state = self.HALF_OPEN
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.state = self.OPEN
+            self.openedAt = time.time()
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.finished = None
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Concurrent calls with the same key share one call
+
+    Only calls still in flight are joined by default. A window keeps the result
+    for that many seconds after, for callers that can live with stale reads.
+    """
+
+    def __init__(self, window=0):
+        self.window = window
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, call):
+        with self._lock:
+            now = time.time()
+            flight = self._flights.get(key)
+            if flight is not None and flight.finished is not None and now - flight.finished > self.window:
+                flight = None
+            leader = flight is None
+            if leader:
+                self.forget(now)
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = call()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                flight.finished = time.time()
+
+                # Failures are for whoever was waiting, not for later callers
+                if (flight.error is not None or not self.window) and self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def forget(self, now):
+        """Drop results past their window, call with the lock held"""
+        for key in [k for k, f in self._flights.items() if f.finished is not None and now - f.finished > self.window]:
+            del self._flights[key]
@@ -0,0 +1,519 @@
+from POGOProtos.Map.Fort import FortData_pb2
+from POGOProtos.Map.Pokemon import WildPokemon_pb2
+
+from custom_exceptions import AuthPogoException
+from custom_exceptions import GeneralPogoException
+from catching import CatchAttempt, hasBalls
+from encounters import ENCOUNTER_RANGE
+from evolution import planSteps
+from location import Location
+from policy import operationSteps
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# Forts can be spun from this many meters away
+FORT_RANGE = 38
+
+# Walking, meters per second, and how far from the start we go before heading back
+WALK_SPEED = 4.0
+MAX_ROAM = 5000
+
+# Seconds between walking steps, and the most one step makes up for a stall
+WALK_SECONDS = 1.0
+MAX_WALK_SECONDS = 10.0
+
+# Priorities, higher runs first
+CATCH = 40
+SPIN = 30
+WALK = 25
+SCAN = 20
+INCUBATE = 15
+CLEAN = 10
+EVOLVE = 5
+REFRESH = 0
+
+# Step chains of the inventory tasks, only one planned at a time
+CLEAN_STEPS = 'clean-step'
+EVOLVE_STEPS = 'evolve-step'
+
+
+class RequestBudget(object):
+    """Token bucket of RPCs an account may send"""
+
+    def __init__(self, rate=0.5, burst=10):
+        # rate: requests per second, burst: most that can be saved up
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost, now):
+        """Seconds until cost tokens are there"""
+        self.refill(now)
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def spend(self, cost, now):
+        self.refill(now)
+        self.tokens -= cost
+
+
+class Task(object):
+    """One unit of bot work, run(bot) may return new tasks to schedule"""
+
+    def __init__(self, name, run, priority=0, cost=1, deadline=None, interval=None, readyAt=0):
+        # cost: estimated RPCs, a number or a function of the bot
+        # deadline: drop the task if it hasn't run by then
+        # interval: run again this many seconds after each run
+        self.name = name
+        self.run = run
+        self.priority = priority
+        self.cost = cost
+        self.deadline = deadline
+        self.interval = interval
+        self.readyAt = readyAt
+
+    def estimate(self, bot):
+        return self.cost(bot) if callable(self.cost) else self.cost
+
+    def __str__(self):
+        return 'Task({0})'.format(self.name)
+
+
+class Bot(object):
+    """One account: a session, its tasks and its request budget"""
+
+    def __init__(self, session, auth=None, tasks=(), budget=None, cooldown=10):
+        self.session = session
+        self.auth = auth
+        self.budget = budget or RequestBudget()
+        self.cooldown = cooldown
+        self.tasks = list(tasks)
+        self.lastRpc = 0
+        self.stats = {'runs': 0, 'budgeted': 0, 'expired': 0, 'errors': 0}
+
+    def schedule(self, task):
+        self.tasks.append(task)
+
+    def ready(self, now):
+        """Runnable tasks, most urgent first, expired ones are dropped"""
+        live = []
+        for task in self.tasks:
+            if task.deadline is not None and task.deadline < now:
+                self.stats['expired'] += 1
+            else:
+                live.append(task)
+        self.tasks = live
+        ready = [t for t in live if t.readyAt <= now]
+        ready.sort(key=lambda t: (-t.priority, t.deadline or float('inf')))
+        return ready
+
+    def pick(self, now):
+        """Task to run now, or how long to wait for one"""
+        ready = self.ready(now)
+        if not ready:
+            later = [t.readyAt for t in self.tasks]
+            return None, (min(later) - now if later else None)
+
+        # A task that costs more than the bucket holds waits for a full one,
+        # then pays in full, the debt holds back whatever comes after it
+        top = ready[0]
+        topCost = top.estimate(self)
+        topNeed = min(topCost, self.budget.burst)
+        wait = self.budget.delay(topNeed, now)
+        if not wait:
+            return (top, topCost), 0
+
+        # Backfill smaller tasks only if the top one still meets its deadline
+        if top.deadline is not None:
+            for task in ready[1:]:
+                cost = task.estimate(self)
+                if cost > self.budget.burst or self.budget.delay(cost, now):
+                    continue
+                if now + self.budget.delay(topNeed + cost, now) <= top.deadline:
+                    return (task, cost), 0
+        return None, wait
+
+    def step(self, now):
+        """Run at most one task, returns seconds until the bot wants to run again"""
+        picked, wait = self.pick(now)
+        if picked is None:
+            return wait
+
+        task, cost = picked
+        self.tasks.remove(task)
+        self.budget.spend(cost, now)
+        self.stats['runs'] += 1
+        self.stats['budgeted'] += cost
+        if cost:
+            self.lastRpc = now
+
+        # Repeating tasks come back, sooner after a failure
+        again = task.interval
+        try:
+            for follow in task.run(self) or ():
+                self.schedule(follow)
+        except AuthPogoException as e:
+            logging.critical('(RUNTIME)\t-\t%s: %s', task, e)
+            self.stats['errors'] += 1
+            self.reauthenticate()
+        except GeneralPogoException as e:
+            logging.warning('(RUNTIME)\t-\t%s: %s', task, e)
+            self.stats['errors'] += 1
+            if again is not None:
+                again = min(again, self.cooldown)
+        except Exception:
+            logging.exception('(RUNTIME)\t-\t%s failed', task)
+            self.stats['errors'] += 1
+
+        if again is not None:
+            task.readyAt = time.time() + again
+            self.schedule(task)
+        return 0
+
+    def reauthenticate(self):
+        if self.auth is None:
+            logging.critical('(RUNTIME)\t-\tNo way to log back in, stopping tasks')
+            self.tasks = []
+            return
+        self.session = self.auth.reauthenticate(self.session)
+
+
+class Runtime(object):
+    """Runs many bots on a few threads, each bot on one thread at a time"""
+
+    def __init__(self, bots=(), workers=4):
+        self.workers = workers
+        self._heap = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+        self.bots = []
+        for bot in bots:
+            self.add(bot)
+
+    def add(self, bot, at=0):
+        with self._cond:
+            self.bots.append(bot)
+            heapq.heappush(self._heap, (at, next(self._order), bot))
+            self._cond.notify()
+
+    def take(self):
+        with self._cond:
+            while self._running:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+        return None
+
+    def give(self, bot, at):
+        with self._cond:
+            heapq.heappush(self._heap, (at, next(self._order), bot))
+            self._cond.notify()
+
+    def work(self):
+        while True:
+            bot = self.take()
+            if bot is None:
+                return
+            now = time.time()
+            try:
+                wait = bot.step(now)
+            except Exception:
+                # Even a failed login shouldn't lose the bot
+                logging.exception('(RUNTIME)\t-\tBot step failed')
+                wait = bot.cooldown
+
+            # Idle bots with nothing scheduled check back once in a while
+            self.give(bot, now + (wait if wait is not None else 60))
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self.work) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def run(self, seconds=None):
+        self.start()
+        try:
+            end = time.time() + seconds if seconds is not None else None
+            while end is None or time.time() < end:
+                time.sleep(1 if end is None else max(0, min(1, end - time.time())))
+        finally:
+            self.stop()
+
+    def metrics(self):
+        totals = {}
+        for bot in self.bots:
+            for key in bot.stats:
+                totals[key] = totals.get(key, 0) + bot.stats[key]
+        totals['bots'] = len(self.bots)
+        return totals
+
+
+class Travel(object):
+    """Where one bot is headed, picked by its scans and walked by walkTask"""
+
+    def __init__(self, speed=WALK_SPEED, roam=MAX_ROAM):
+        self.speed = speed
+        self.roam = roam
+        self.home = None
+        self.target = None
+        self.homing = False
+        self.updated = None
+        self.walked = 0.0
+
+    def plan(self, latitude, longitude, away):
+        """Head for the nearest of away, (distance, latitude, longitude) tuples"""
+        if self.home is None:
+            self.home = (latitude, longitude)
+        if self.homing:
+            return
+        if Location.getDistance(latitude, longitude, *self.home) > self.roam:
+            logging.info('(TRAVEL)\t-\tWalking back to start to stay in area')
+            self.target = self.home
+            self.homing = True
+            return
+        self.target = min(away)[1:] if away else None
+
+    def arrived(self):
+        self.target = None
+        self.homing = False
+
+
+# Standard tasks. Every RPC brings the inventory back in its default
+# bundle, so tasks read checkInventory() and never refresh it themselves
+def scanTask(strategy, travel, interval=10):
+    """Map scan, fans out into catch and spin tasks in range, and picks where to walk"""
+    # Encounters already handed out, until they despawn
+    seen = {}
+
+    def run(bot):
+        session = bot.session
+        now = time.time()
+        cells = session.getMapObjects()
+        latitude, longitude, _ = session.getCoordinates()
+
+        # No balls, no encounters, just stops to get some
+        balls = hasBalls(session.checkInventory().bag)
+
+        found = []
+        away = []
+        for cell in cells.map_cells:
+            for wild in cell.wild_pokemons if balls else ():
+                distance = Location.getDistance(latitude, longitude, wild.latitude, wild.longitude)
+                if distance <= ENCOUNTER_RANGE:
+                    found.append(catchTask(strategy, wild, now))
+                else:
+                    away.append((distance, wild.latitude, wild.longitude))
+            for fort in cell.forts:
+                if fort.type != 1 or fort.cooldown_complete_timestamp_ms / 1000.0 > now:
+                    continue
+                distance = Location.getDistance(latitude, longitude, fort.latitude, fort.longitude)
+                if distance <= FORT_RANGE:
+                    found.append(spinTask(fort))
+                else:
+                    away.append((distance, fort.latitude, fort.longitude))
+
+        # A rescan finds the same things again
+        for name in [n for n in seen if seen[n] < now]:
+            del seen[name]
+        queued = set(t.name for t in bot.tasks)
+        fresh = [t for t in found if t.name not in queued and t.name not in seen]
+        for task in fresh:
+            if task.deadline is not None:
+                seen[task.name] = task.deadline
+
+        # Whatever's out of reach is only queued once we've walked there and scanned again
+        travel.plan(latitude, longitude, away)
+        return fresh
+    return Task('scan', run, priority=SCAN, cost=1, interval=interval)
+
+
+def walkTask(travel, interval=WALK_SECONDS):
+    """A step towards the travel target, moving doesn't send anything by itself"""
+    def run(bot):
+        now = time.time()
+        elapsed = min(now - (travel.updated or now), MAX_WALK_SECONDS)
+        travel.updated = now
+        if travel.target is None:
+            return None
+
+        location = bot.session.location
+        latitude, longitude, _ = location.getCoordinates()
+        targetLatitude, targetLongitude = travel.target
+        distance = Location.getDistance(latitude, longitude, targetLatitude, targetLongitude)
+        step = travel.speed * elapsed
+        if step < distance:
+            fraction = step / distance
+            location.setCoordinates(
+                latitude + (targetLatitude - latitude) * fraction,
+                longitude + (targetLongitude - longitude) * fraction
+            )
+            travel.walked += step
+            return None
+
+        # There, scan now to see what's in range
+        location.setCoordinates(targetLatitude, targetLongitude)
+        travel.walked += distance
+        travel.arrived()
+        for task in bot.tasks:
+            if task.name == 'scan':
+                task.readyAt = now
+        return None
+
+    return Task('walk', run, priority=WALK, cost=0, interval=interval)
+
+
+def catchTask(strategy, wild, now):
+    # Keep a copy, the next scan reuses the map objects message
+    pokemon = WildPokemon_pb2.WildPokemon()
+    pokemon.CopyFrom(wild)
+
+    # Despawn times outside (0, 1h] are unknown rather than real
+    hidden = pokemon.time_till_hidden_ms
+    deadline = now + hidden / 1000.0 if 0 < hidden <= 3600000 else now + 60
+
+    # The encounter, then a task per throw, each paying for its own RPCs
+    def run(bot):
+        encounter = bot.session.encounterPokemon(pokemon)
+        attempt = CatchAttempt(bot.session, pokemon, pokemon.pokemon_data.pokemon_id, strategy, encounter)
+        if attempt.done:
+            if attempt.outOfBalls():
+                raise GeneralPogoException("(ENCOUNTER)\t-\tOut of usable balls")
+            return None
+        return [throwTask(attempt, deadline)]
+
+    return Task(
+        'catch-{0}'.format(pokemon.encounter_id),
+        run,
+        priority=CATCH,
+        cost=1,
+        deadline=deadline
+    )
+
+
+def throwTask(attempt, deadline):
+    def run(bot):
+        if attempt.throw():
+            return [throwTask(attempt, deadline)]
+
+    return Task(
+        'throw-{0}'.format(attempt.pokemon.encounter_id),
+        run,
+        priority=CATCH,
+        cost=lambda bot: attempt.nextCost(),
+        deadline=deadline
+    )
+
+
+def spinTask(found):
+    fort = FortData_pb2.FortData()
+    fort.CopyFrom(found)
+
+    def run(bot):
+        bot.session.getFortSearch(fort)
+
+    return Task('spin-{0}'.format(fort.id), run, priority=SPIN, cost=1)
+
+
+def stepTask(name, steps, priority, index=0, readyAt=0):
+    """One RPC of a longer job, scheduling the next step once it's sent"""
+    # steps: (call, wait) pairs, call takes the session, wait is seconds before the next
+    call, wait = steps[index]
+
+    def run(bot):
+        call(bot.session)
+        if index + 1 < len(steps):
+            return [stepTask(name, steps, priority, index + 1, time.time() + wait)]
+
+    return Task(name, run, priority=priority, cost=1, readyAt=readyAt)
+
+
+def stepping(bot):
+    """Whether a clean or evolve chain is still going, plans overlap otherwise"""
+    return any(t.name in (CLEAN_STEPS, EVOLVE_STEPS) for t in bot.tasks)
+
+
+# Inventory tasks plan for free and hand out one task per RPC, so every
+# release, recycle and evolve is paid for out of the budget on its own
+def cleanTask(engine, interval=60):
+    """Recycle and release whatever the policy says"""
+    def run(bot):
+        if stepping(bot):
+            return None
+        steps = operationSteps(engine.evaluate(bot.session.checkInventory()))
+        return [stepTask(CLEAN_STEPS, steps, CLEAN)] if steps else None
+
+    return Task('clean', run, priority=CLEAN, cost=0, interval=interval)
+
+
+def incubateTask(scheduler, interval=30):
+    def run(bot):
+        scheduler.update(bot.session)
+
+    def cost(bot):
+        inventory = bot.session.checkInventory()
+        return len(scheduler.assign(inventory)) if scheduler.due(inventory) else 0
+
+    return Task('incubate', run, priority=INCUBATE, cost=cost, interval=interval)
+
+
+def evolveTask(planner, interval=600):
+    def run(bot):
+        if stepping(bot):
+            return None
+        plan = planner.plan(bot.session.checkInventory())
+        if not plan.steps:
+            return None
+        logging.info("(EVOLVE)\t-\t%s", plan)
+        return [stepTask(EVOLVE_STEPS, planSteps(plan, planner.evolveSeconds), EVOLVE)]
+
+    return Task('evolve', run, priority=EVOLVE, cost=0, interval=interval)
+
+
+def refreshTask(interval=300):
+    """Profile fetch, only when no other RPC brought the bundle back lately"""
+    def stale(bot):
+        return time.time() - bot.lastRpc >= interval
+
+    def run(bot):
+        if stale(bot):
+            bot.session.fetchProfile()
+
+    def cost(bot):
+        return 1 if stale(bot) else 0
+
+    return Task('refresh', run, priority=REFRESH, cost=cost, interval=interval)
+
+
+def createTasks(strategy, engine, scheduler, planner, speed=WALK_SPEED, roam=MAX_ROAM):
+    """What camBot used to do, as independent tasks"""
+    travel = Travel(speed, roam)
+    return [
+        scanTask(strategy, travel),
+        walkTask(travel),
+        cleanTask(engine),
+        incubateTask(scheduler),
+        evolveTask(planner),
+        refreshTask(),
+    ]
@@ -1,7 +1,6 @@
 # Load Generated Protobuf
 from POGOProtos.Networking.Requests import Request_pb2
 from POGOProtos.Networking.Requests import RequestType_pb2
-from POGOProtos.Networking.Envelopes import ResponseEnvelope_pb2
 from POGOProtos.Networking.Envelopes import RequestEnvelope_pb2
 from POGOProtos.Networking.Requests.Messages import EncounterMessage_pb2
 from POGOProtos.Networking.Requests.Messages import FortSearchMessage_pb2
@@ -12,17 +11,37 @@ from POGOProtos.Networking.Requests.Messages import GetMapObjectsMessage_pb2
 from POGOProtos.Networking.Requests.Messages import EvolvePokemonMessage_pb2
 from POGOProtos.Networking.Requests.Messages import ReleasePokemonMessage_pb2
 from POGOProtos.Networking.Requests.Messages import UseItemCaptureMessage_pb2
+from POGOProtos.Networking.Requests.Messages import UseItemXpBoostMessage_pb2
 from POGOProtos.Networking.Requests.Messages import DownloadSettingsMessage_pb2
 from POGOProtos.Networking.Requests.Messages import UseItemEggIncubatorMessage_pb2
 from POGOProtos.Networking.Requests.Messages import RecycleInventoryItemMessage_pb2
 from POGOProtos.Networking.Requests.Messages import NicknamePokemonMessage_pb2
+from POGOProtos.Networking.Requests.Messages import GetGymDetailsMessage_pb2
+from POGOProtos.Networking.Requests.Messages import StartGymBattleMessage_pb2
+from POGOProtos.Networking.Requests.Messages import AttackGymMessage_pb2
+from POGOProtos.Networking.Requests.Messages import FortDeployPokemonMessage_pb2
+from POGOProtos.Networking.Requests.Messages import GetIncensePokemonMessage_pb2
+from POGOProtos.Networking.Requests.Messages import IncenseEncounterMessage_pb2
+from POGOProtos.Networking.Requests.Messages import DiskEncounterMessage_pb2
 
 # Load local
-import api
+import buffers
+import rpc
+from custom_exceptions import AuthPogoException
+from custom_exceptions import CircuitOpenPogoException
+from custom_exceptions import EmptyResponsePogoException
 from custom_exceptions import GeneralPogoException
+from custom_exceptions import RedirectPogoException
+from custom_exceptions import ThrottledPogoException
+from custom_exceptions import TransportPogoException
 from inventory import Inventory, items
 from location import Location
-from state import State
+from state import State, StateView
+from store import LOCATION, STATE_FIELDS
+from throttle import RateController
+from catching import CATCH_FLEE
+from transport import RequestsTransport
+from util import getMs
 
 import requests
 import logging
@@ -37,8 +56,9 @@ API_URL = 'https://pgorelease.nianticlabs.com/plfe/rpc'
 
 class PogoSession(object):
 
-    def __init__(self, session, authProvider, accessToken, location):
+    def __init__(self, session, authProvider, accessToken, location, retryPolicy=None, transport=None, endpoint=None, compact=False, bus=None, ttls=None, shareWindow=0, throttle=None, store=None, account=None):
         self.session = session
+        self.transport = transport or RequestsTransport(session)
         self.authProvider = authProvider
         self.accessToken = accessToken
         self.location = location
@@ -47,12 +67,42 @@ class PogoSession(object):
 
         self._state = State()
 
+        # How fresh each part of it is, see state.py
+        self.view = StateView(ttls)
+
+        # Identical reads in flight at once go out as one
+        self._flights = rpc.SingleFlight(shareWindow)
+
+        # Inventory model, see compact.py
+        self.compact = compact
+
+        # Map cells shared with other sessions, see observations.py
+        self.bus = bus
+
+        # Ids are per session, so sessions never share a counter
+        self._requestIds = rpc.RequestIds()
+
+        # Failure handling
+        self.retryPolicy = retryPolicy or rpc.RetryPolicy()
+
+        # Learned pacing, pass the same one to every session of an account
+        self.throttle = throttle or RateController()
+        self._breakers = {}
+
+        # Checkpoints, see store.py
+        self.store = store
+        self.account = account
+
         self.authTicket = None
-        self.endpoint = None
-        self.endpoint = 'https://{0}{1}'.format(
-            self.createApiEndpoint(),
-            '/rpc'
-        )
+        self.endpoint = endpoint
+        if self.store is not None:
+            self.restore(self.store.load(account))
+        if self.endpoint is None:
+            self.endpoint = 'https://{0}{1}'.format(
+                self.createApiEndpoint(),
+                '/rpc'
+            )
+            self.remember('endpoint', self.endpoint.encode('utf-8'))
 
         # Set up Inventory
         self.getInventory()
@@ -79,42 +129,56 @@ class PogoSession(object):
         )
         payload.append(msg)
         req = self.wrapInRequest(payload)
-        res = self.request(req, API_URL)
+        try:
+            res = self.request(req, API_URL)
+        except RedirectPogoException as e:
+            res = e.response
         if res is None:
             logging.critical('Servers seem to be busy. Exiting.')
             raise Exception('Could not connect to servers')
 
         return res.api_url
 
+    def createAuthInfo(self):
+        return RequestEnvelope_pb2.RequestEnvelope.AuthInfo(
+            provider=self.authProvider,
+            token=RequestEnvelope_pb2.RequestEnvelope.AuthInfo.JWT(
+                contents=self.accessToken,
+                unknown2=59
+            )
+        )
+
     def wrapInRequest(self, payload, defaults=True):
 
+        # Work from a snapshot, other threads may swap the ticket
+        ticket = self.authTicket
+
+        # Drop tickets we know are stale
+        if ticket and ticket.expire_timestamp_ms:
+            if ticket.expire_timestamp_ms < getMs():
+                ticket = None
+
         # If we haven't authenticated before
         info = None
-        if not self.authTicket:
-            info = RequestEnvelope_pb2.RequestEnvelope.AuthInfo(
-                provider=self.authProvider,
-                token=RequestEnvelope_pb2.RequestEnvelope.AuthInfo.JWT(
-                    contents=self.accessToken,
-                    unknown2=59
-                )
-            )
+        if not ticket:
+            info = self.createAuthInfo()
 
         # Build Envelope
         latitude, longitude, altitude = self.getCoordinates()
         req = RequestEnvelope_pb2.RequestEnvelope(
             status_code=2,
-            request_id=api.getRPCId(),
+            request_id=self._requestIds.next(),
             longitude=longitude,
             latitude=latitude,
             altitude=altitude,
-            auth_ticket=self.authTicket,
+            auth_ticket=ticket,
             unknown12=989,
             auth_info=info
         )
 
         # Add requests
         if defaults:
-            payload += self.getDefaults()
+            payload = payload + self.getDefaults()
         req.requests.extend(payload)
 
         return req
@@ -124,24 +188,107 @@ class PogoSession(object):
             url = self.endpoint
 
         # Send request
-        rawResponse = self.session.post(url, data=req.SerializeToString())
+        rawResponse = self.transport.postInto(url, req.SerializeToString(), buffers.pool)
+        rpc.checkHttp(rawResponse)
 
-        # Parse it out
-        res = ResponseEnvelope_pb2.ResponseEnvelope()
-        res.ParseFromString(rawResponse.content)
+        # Parse it out, returns stay views into the body where possible
+        try:
+            res = buffers.parseEnvelope(rawResponse.content)
+        except Exception as e:
+            raise TransportPogoException('Malformed envelope: {0}'.format(e))
 
         # Update Auth ticket if it exists
         if res.auth_ticket.start:
             self.authTicket = res.auth_ticket
+            self.remember('ticket', res.auth_ticket.SerializeToString())
 
+        rpc.checkResponse(req, res)
         return res
 
+    def getBreaker(self, url):
+        if url not in self._breakers:
+            self._breakers[url] = rpc.CircuitBreaker()
+        return self._breakers[url]
+
+    # Swap tickets for the access token on a resent envelope
+    def refreshAuth(self, req):
+        self.authTicket = None
+        req.ClearField('auth_ticket')
+        req.auth_info.CopyFrom(self.createAuthInfo())
+
     def request(self, req, url=None):
-        try:
-            return self.requestOrThrow(req, url)
-        except Exception as e:
-            logging.error(e)
-            raise GeneralPogoException('Probably server fires.')
+        attempt = 0
+        redirects = 0
+        refreshed = False
+
+        # A lost write may still have gone through, only reads are resent blind
+        resend = rpc.isRead(req)
+
+        # Paced by the first request, the rest are the default bundle
+        requestType = req.requests[0].request_type if req.requests else 0
+        while True:
+            target = url or self.endpoint
+            breaker = self.getBreaker(target)
+            try:
+                breaker.check()
+                self.throttle.pace(requestType)
+                res = self.requestOrThrow(req, target)
+                breaker.success()
+
+                # Still usable, but the server wants us slower
+                if rpc.refused(res):
+                    self.throttle.throttled(requestType)
+                else:
+                    self.throttle.success(requestType)
+                self.remember('location', LOCATION.pack(req.latitude, req.longitude))
+                return res
+
+            # Only move our own endpoint, explicit urls go to the caller
+            except RedirectPogoException as e:
+                breaker.success()
+                if url is not None or redirects >= rpc.MAX_REDIRECTS:
+                    raise
+                redirects += 1
+                logging.info('Endpoint moved to %s', e.url)
+                self.endpoint = 'https://{0}{1}'.format(e.url, '/rpc')
+                self.remember('endpoint', self.endpoint.encode('utf-8'))
+
+            # One ticket refresh, after that a full login is needed
+            except AuthPogoException:
+                breaker.success()
+                if refreshed:
+                    raise
+                logging.info('Auth ticket expired, refreshing')
+                self.refreshAuth(req)
+                refreshed = True
+
+            except CircuitOpenPogoException:
+                raise
+
+            except (TransportPogoException, ThrottledPogoException, EmptyResponsePogoException) as e:
+                breaker.failure()
+                throttled = not isinstance(e, TransportPogoException)
+                if throttled:
+                    self.throttle.throttled(requestType)
+                delay = self.retryPolicy.backoff(attempt, throttled=throttled)
+                if delay is None or not (throttled or resend):
+                    logging.error(e)
+                    raise
+                logging.warning('%s, retrying in %.2fs', e, delay)
+                attempt += 1
+                time.sleep(delay)
+
+            except GeneralPogoException:
+                raise
+
+            except Exception as e:
+                logging.error(e)
+                raise GeneralPogoException('Probably server fires.')
+
+    # For reads only, callers sending the same payload at the same time share one send
+    def sharedRequest(self, payload, parse, defaults=True):
+        key = (defaults,) + tuple((r.request_type, r.request_message) for r in payload)
+        return self._flights.do(key, lambda: parse(self.wrapAndRequest(payload, defaults=defaults)))
 
     def wrapAndRequest(self, payload, defaults=True):
         res = self.request(self.wrapInRequest(payload, defaults=defaults))
@@ -191,33 +338,68 @@ class PogoSession(object):
     def parseDefault(self, res):
         try:
             self._state.eggs.ParseFromString(res.returns[1])
-            self._state.inventory.ParseFromString(res.returns[2])
             self._state.badges.ParseFromString(res.returns[3])
             self._state.settings.ParseFromString(res.returns[4])
+            self.loadInventory(res.returns[2])
         except Exception as e:
             logging.error(e)
             raise GeneralPogoException("Error parsing response. Malformed response")
 
-        # Finally make inventory usable
-        item = self._state.inventory.inventory_delta.inventory_items
-        self.inventory = Inventory(item)
+        self.view.touch('eggs', 'inventory', 'badges', 'settings')
+
+        # Checkpoint the bytes as they came, no serializing back
+        for field, value in zip(STATE_FIELDS[1:], res.returns[1:5]):
+            self.remember(field, value)
+
+    # Finally make inventory usable
+    def loadInventory(self, raw):
+        # Records keep their own slice of the bytes, no messages in between
+        if self.compact:
+            self.inventory = Inventory.fromBytes(raw, compact=True)
+            return
+
+        self._state.inventory.ParseFromString(raw)
+        self.inventory = Inventory(self._state.inventory.inventory_delta.inventory_items)
+
+    # Queue a field for the next checkpoint, if we keep them
+    def remember(self, field, value):
+        if self.store is not None:
+            self.store.put(self.account, field, value)
+
+    # Back to where the last checkpoint left off, ages and all
+    def restore(self, saved):
+        ticket = self.store.ticket(saved)
+        if ticket is not None:
+            self.authTicket = ticket
+        if self.endpoint is None and 'endpoint' in saved:
+            self.endpoint = saved['endpoint'][1].decode('utf-8')
+
+        for field in STATE_FIELDS:
+            if field not in saved:
+                continue
+            updated, value = saved[field]
+            if field == 'inventory':
+                self.loadInventory(value)
+            else:
+                getattr(self._state, field).ParseFromString(value)
+            self.view.restore(field, updated)
 
     # Hooks for those bundled in default
-    # Getters
+    # Getters, from the server only once the cached copy is stale
     def getEggs(self):
-        self.getProfile()
+        self.view.refresh('eggs', self.fetchProfile)
         return self._state.eggs
 
     def getInventory(self):
-        self.getProfile()
+        self.view.refresh('inventory', self.fetchProfile)
         return self.inventory
 
     def getBadges(self):
-        self.getProfile()
+        self.view.refresh('badges', self.fetchProfile)
         return self._state.badges
 
     def getDownloadSettings(self):
-        self.getProfile()
+        self.view.refresh('settings', self.fetchProfile)
         return self._state.settings
 
     # Check, so we don't have to start another request
@@ -236,18 +418,21 @@ class PogoSession(object):
     # Core api calls
     # Get profile
     def getProfile(self):
+        self.view.refresh('profile', self.fetchProfile)
+        return self._state.profile
+
+    # Skips the TTL view, brings the default bundle back too
+    def fetchProfile(self):
         # Create profile request
         payload = [Request_pb2.Request(
             request_type=RequestType_pb2.GET_PLAYER
         )]
 
-        # Send
+        # Always sent, never joined to a call that went out before this one
         res = self.wrapAndRequest(payload)
-
-        # Parse
         self._state.profile.ParseFromString(res.returns[0])
-
-        # Return everything
+        self.view.touch('profile')
+        self.remember('profile', res.returns[0])
         return self._state.profile
 
     # Get Location
@@ -255,6 +440,17 @@ class PogoSession(object):
         # Work out location details
         cells = self.location.getCells(radius)
         latitude, longitude, _ = self.getCoordinates()
+
+        # Only ask for what nobody else scanned recently
+        fresh = {}
+        if self.bus is not None:
+            fresh = self.bus.fresh(cells, latitude, longitude)
+            cells = [c for c in cells if c not in fresh]
+            if not cells:
+                self._state.mapObjects.Clear()
+                self._state.mapObjects.status = 1
+                self._state.mapObjects.map_cells.extend(fresh.values())
+                return self._state.mapObjects
         timestamps = [0, ] * len(cells)
 
         # Create request
@@ -268,14 +464,17 @@ class PogoSession(object):
             ).SerializeToString()
         )]
 
-        # Send
-        res = self.wrapAndRequest(payload)
+        # Send and parse, once for everyone asking at the same time
+        def parse(res):
+            self._state.mapObjects.ParseFromString(res.returns[0])
 
-        # Parse
-        self._state.mapObjects.ParseFromString(res.returns[0])
+            # Share, then fill in what others saw
+            if self.bus is not None:
+                self.bus.publish(self._state.mapObjects.map_cells, latitude, longitude)
+                self._state.mapObjects.map_cells.extend(fresh.values())
+            return self._state.mapObjects
 
-        # Return everything
-        return self._state.mapObjects
+        return self.sharedRequest(payload, parse)
 
     # Get Location
     def getFortSearch(self, fort):
@@ -314,14 +513,12 @@ class PogoSession(object):
             ).SerializeToString()
         )]
 
-        # Send
-        res = self.wrapAndRequest(payload)
-
-        # Parse
-        self._state.fortDetails.ParseFromString(res.returns[0])
+        # Send and parse, once for everyone asking at the same time
+        def parse(res):
+            self._state.fortDetails.ParseFromString(res.returns[0])
+            return self._state.fortDetails
 
-        # Return everything
-        return self._state.fortDetails
+        return self.sharedRequest(payload, parse)
 
     # Get encounter
     def encounterPokemon(self, pokemon):
@@ -346,6 +543,69 @@ class PogoSession(object):
         # Return everything
         return self._state.encounter
 
+    # Whatever our incense attracted
+    def getIncensePokemon(self):
+
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.GET_INCENSE_POKEMON,
+            request_message=GetIncensePokemonMessage_pb2.GetIncensePokemonMessage(
+                player_latitude=self.location.latitude,
+                player_longitude=self.location.longitude
+            ).SerializeToString()
+        )]
+
+        # Send and parse, once for everyone asking at the same time
+        def parse(res):
+            self._state.incense.ParseFromString(res.returns[0])
+            return self._state.incense
+
+        return self.sharedRequest(payload, parse)
+
+    # Encounter from getIncensePokemon
+    def incenseEncounter(self, pokemon):
+
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.INCENSE_ENCOUNTER,
+            request_message=IncenseEncounterMessage_pb2.IncenseEncounterMessage(
+                encounter_id=pokemon.encounter_id,
+                encounter_location=pokemon.encounter_location
+            ).SerializeToString()
+        )]
+
+        # Send
+        res = self.wrapAndRequest(payload)
+
+        # Parse
+        self._state.incenseEncounter.ParseFromString(res.returns[0])
+
+        # Return everything
+        return self._state.incenseEncounter
+
+    # Encounter at a lured fort, takes its FortLureInfo
+    def diskEncounter(self, lure):
+
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.DISK_ENCOUNTER,
+            request_message=DiskEncounterMessage_pb2.DiskEncounterMessage(
+                encounter_id=lure.encounter_id,
+                fort_id=lure.fort_id,
+                player_latitude=self.location.latitude,
+                player_longitude=self.location.longitude
+            ).SerializeToString()
+        )]
+
+        # Send
+        res = self.wrapAndRequest(payload)
+
+        # Parse
+        self._state.diskEncounter.ParseFromString(res.returns[0])
+
+        # Return everything
+        return self._state.diskEncounter
+
     # Upon Encounter, try and catch
     def catchPokemon(self, pokemon, pokeball=1):
 
@@ -369,6 +629,10 @@ class PogoSession(object):
         # Parse
         self._state.catch.ParseFromString(res.returns[0])
 
+        # Flees are how soft bans show, catch slower
+        if self._state.catch.status == CATCH_FLEE:
+            self.throttle.throttled(RequestType_pb2.CATCH_POKEMON)
+
         # Return everything
         return self._state.catch
 
@@ -393,6 +657,26 @@ class PogoSession(object):
         # Return everything
         return self._state.itemCapture
 
+    # Start a lucky egg
+    def useItemXpBoost(self, item_id):
+
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.USE_ITEM_XP_BOOST,
+            request_message=UseItemXpBoostMessage_pb2.UseItemXpBoostMessage(
+                item_id=item_id
+            ).SerializeToString()
+        )]
+
+        # Send
+        res = self.wrapAndRequest(payload)
+
+        # Parse
+        self._state.xpBoost.ParseFromString(res.returns[0])
+
+        # Return everything
+        return self._state.xpBoost
+
     # Evolve Pokemon
     def evolvePokemon(self, pokemon):
 
@@ -475,6 +759,20 @@ class PogoSession(object):
         # Return everything
         return self._state.incubator
 
+    # Game master data, large, fetch once and cache (see gamemaster.py)
+    def downloadItemTemplates(self):
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.DOWNLOAD_ITEM_TEMPLATES
+        )]
+
+        # Send and parse, once for everyone asking at the same time
+        def parse(res):
+            self._state.itemTemplates.ParseFromString(res.returns[0])
+            return self._state.itemTemplates
+
+        return self.sharedRequest(payload, parse, defaults=False)
+
     def nicknamePokemon(self, pokemon, nickname):
         # Create request
         payload = [Request_pb2.Request(
@@ -494,6 +792,94 @@ class PogoSession(object):
         # Return everything
         return self._state.nickname
 
+    # Gyms
+    def getGymDetails(self, gym):
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.GET_GYM_DETAILS,
+            request_message=GetGymDetailsMessage_pb2.GetGymDetailsMessage(
+                gym_id=gym.id,
+                player_latitude=self.location.latitude,
+                player_longitude=self.location.longitude,
+                gym_latitude=gym.latitude,
+                gym_longitude=gym.longitude
+            ).SerializeToString()
+        )]
+
+        # Send and parse, once for everyone asking at the same time
+        def parse(res):
+            self._state.gymDetails.ParseFromString(res.returns[0])
+            return self._state.gymDetails
+
+        return self.sharedRequest(payload, parse)
+
+    def startGymBattle(self, gym, attackers, defenderId):
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.START_GYM_BATTLE,
+            request_message=StartGymBattleMessage_pb2.StartGymBattleMessage(
+                gym_id=gym.id,
+                attacking_pokemon_ids=[pokemon.id for pokemon in attackers],
+                defending_pokemon_id=defenderId,
+                player_latitude=self.location.latitude,
+                player_longitude=self.location.longitude
+            ).SerializeToString()
+        )]
+
+        # Send
+        res = self.wrapAndRequest(payload)
+
+        # Parse
+        self._state.startBattle.ParseFromString(res.returns[0])
+
+        # Return everything
+        return self._state.startBattle
+
+    # A batch of actions, see gyms.py for keeping a battle going
+    def attackGym(self, gym, battleId, actions, lastRetrieved=None):
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.ATTACK_GYM,
+            request_message=AttackGymMessage_pb2.AttackGymMessage(
+                gym_id=gym.id,
+                battle_id=battleId,
+                attack_actions=actions,
+                last_retrieved_actions=lastRetrieved,
+                player_latitude=self.location.latitude,
+                player_longitude=self.location.longitude
+            ).SerializeToString()
+        )]
+
+        # Send, every few seconds for the whole battle so leave the bundle out
+        res = self.wrapAndRequest(payload, defaults=False)
+
+        # Parse
+        self._state.attackGym.ParseFromString(res.returns[0])
+
+        # Return everything
+        return self._state.attackGym
+
+    def deployPokemon(self, fort, pokemon):
+        # Create request
+        payload = [Request_pb2.Request(
+            request_type=RequestType_pb2.FORT_DEPLOY_POKEMON,
+            request_message=FortDeployPokemonMessage_pb2.FortDeployPokemonMessage(
+                fort_id=fort.id,
+                pokemon_id=pokemon.id,
+                player_latitude=self.location.latitude,
+                player_longitude=self.location.longitude
+            ).SerializeToString()
+        )]
+
+        # Send
+        res = self.wrapAndRequest(payload)
+
+        # Parse
+        self._state.deploy.ParseFromString(res.returns[0])
+
+        # Return everything
+        return self._state.deploy
+
     # These act as more logical functions.
     # Might be better to break out seperately
     # Walk over to position in meters
@@ -1,5 +1,6 @@
 from Networking.Responses import CheckAwardedBadgesResponse_pb2
 from Networking.Responses import DownloadSettingsResponse_pb2
+from Networking.Responses import DownloadItemTemplatesResponse_pb2
 from Networking.Responses import GetInventoryResponse_pb2
 from Networking.Responses import GetHatchedEggsResponse_pb2
 from Networking.Responses import GetMapObjectsResponse_pb2
@@ -13,7 +14,27 @@ from Networking.Responses import ReleasePokemonResponse_pb2
 from Networking.Responses import UseItemEggIncubatorResponse_pb2
 from Networking.Responses import RecycleInventoryItemResponse_pb2
 from Networking.Responses import UseItemCaptureResponse_pb2
+from Networking.Responses import UseItemXpBoostResponse_pb2
 from Networking.Responses import NicknamePokemonResponse_pb2
+from Networking.Responses import GetGymDetailsResponse_pb2
+from Networking.Responses import StartGymBattleResponse_pb2
+from Networking.Responses import AttackGymResponse_pb2
+from Networking.Responses import FortDeployPokemonResponse_pb2
+from Networking.Responses import GetIncensePokemonResponse_pb2
+from Networking.Responses import IncenseEncounterResponse_pb2
+from Networking.Responses import DiskEncounterResponse_pb2
+
+import threading
+import time
+
+# Seconds each part of the state is good for before a get* goes to the server
+DEFAULT_TTLS = {
+    'profile': 60,
+    'eggs': 60,
+    'inventory': 30,
+    'badges': 300,
+    'settings': 600,
+}
 
 
 class State(object):
@@ -24,6 +45,7 @@ class State(object):
         self.inventory = GetInventoryResponse_pb2.GetInventoryResponse()
         self.badges = CheckAwardedBadgesResponse_pb2.CheckAwardedBadgesResponse()
         self.settings = DownloadSettingsResponse_pb2.DownloadSettingsResponse()
+        self.itemTemplates = DownloadItemTemplatesResponse_pb2.DownloadItemTemplatesResponse()
         self.mapObjects =  GetMapObjectsResponse_pb2.GetMapObjectsResponse()
         self.fortSearch = FortSearchResponse_pb2.FortSearchResponse()
         self.fortDetails = FortDetailsResponse_pb2.FortDetailsResponse()
@@ -34,4 +56,82 @@ class State(object):
         self.release = ReleasePokemonResponse_pb2.ReleasePokemonResponse()
         self.recycle = RecycleInventoryItemResponse_pb2.RecycleInventoryItemResponse()
         self.incubator = UseItemEggIncubatorResponse_pb2.UseItemEggIncubatorResponse()
+        self.xpBoost = UseItemXpBoostResponse_pb2.UseItemXpBoostResponse()
         self.nickname = NicknamePokemonResponse_pb2.NicknamePokemonResponse()
+        self.gymDetails = GetGymDetailsResponse_pb2.GetGymDetailsResponse()
+        self.startBattle = StartGymBattleResponse_pb2.StartGymBattleResponse()
+        self.attackGym = AttackGymResponse_pb2.AttackGymResponse()
+        self.deploy = FortDeployPokemonResponse_pb2.FortDeployPokemonResponse()
+        self.incense = GetIncensePokemonResponse_pb2.GetIncensePokemonResponse()
+        self.incenseEncounter = IncenseEncounterResponse_pb2.IncenseEncounterResponse()
+        self.diskEncounter = DiskEncounterResponse_pb2.DiskEncounterResponse()
+
+
+class StateView(object):
+    """When each part of State was last refreshed, serving it while it's fresh"""
+
+    def __init__(self, ttls=None):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.updated = {}
+        self.hits = dict((field, 0) for field in self.ttls)
+        self.misses = dict((field, 0) for field in self.ttls)
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._flight = None
+
+    def touch(self, *fields):
+        now = time.time()
+        for field in fields:
+            self.updated[field] = now
+
+    def restore(self, field, updated):
+        """Carry over when a checkpointed field was last refreshed"""
+        self.updated[field] = updated
+
+    def age(self, field, now=None):
+        """Seconds since field was refreshed, None if it never was"""
+        if field not in self.updated:
+            return None
+        return (now or time.time()) - self.updated[field]
+
+    def fresh(self, field, now=None):
+        age = self.age(field, now)
+        return age is not None and age < self.ttls.get(field, 0)
+
+    def refresh(self, field, fetch):
+        """Fetch unless field is fresh, callers arriving mid-fetch wait for that one"""
+        with self._lock:
+            if self.fresh(field):
+                self.hits[field] = self.hits.get(field, 0) + 1
+                return False
+            self.misses[field] = self.misses.get(field, 0) + 1
+
+            # Every field comes back with the same request, one is enough
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = threading.Event()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.wait()
+            return False
+
+        try:
+            fetch()
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.set()
+        return True
+
+    def report(self):
+        now = time.time()
+        return {
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'coalesced': self.coalesced,
+            'ages': dict((field, self.age(field, now)) for field in self.ttls),
+        }
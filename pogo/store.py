@@ -0,0 +1,346 @@
+from POGOProtos.Networking.Envelopes import AuthTicket_pb2
+
+from util import getMs
+
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+# Seconds between batched writes
+FLUSH_SECONDS = 2.0
+
+# What a checkpoint holds, besides the ticket, endpoint and location
+STATE_FIELDS = ('profile', 'eggs', 'inventory', 'badges', 'settings')
+
+# Latitude, longitude
+LOCATION = struct.Struct('<dd')
+
+# Log layout: MAGIC, then per record
+# RECORD (crc, account length, field length, updated, value length)
+# followed by the account, field and value bytes, crc covering all after itself
+MAGIC = b'POGOSTO1'
+RECORD = struct.Struct('<IHHdI')
+
+# Log files start this big and double, and are rewritten once mostly dead
+INITIAL_SIZE = 16 * 1024 * 1024
+COMPACT_SIZE = 64 * 1024 * 1024
+
+
+class SQLiteBackend(object):
+    """One row per account and field, WAL so a batch is one sequential append"""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints ('
+            'account TEXT, field TEXT, updated REAL, value BLOB, '
+            'PRIMARY KEY (account, field)) WITHOUT ROWID'
+        )
+        self._lock = threading.Lock()
+
+    def write(self, records):
+        """(account, field, updated, value) tuples, in one transaction"""
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)',
+                    ((a, f, t, sqlite3.Binary(v)) for a, f, t, v in records)
+                )
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def read(self, account):
+        """Field to (updated, value) for one account"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT field, updated, value FROM checkpoints WHERE account = ?',
+                (account,)
+            ).fetchall()
+        return dict((field, (updated, bytes(value))) for field, updated, value in rows)
+
+    def accounts(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT DISTINCT account FROM checkpoints')]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class MmapBackend(object):
+    """Append only log in a memory mapped file, with the index in memory
+
+    Like LMDB, reads are copies straight out of the map. Opening scans the log,
+    and a record torn by a crash fails its crc and ends the scan.
+    """
+
+    def __init__(self, path, initialSize=INITIAL_SIZE, compactSize=COMPACT_SIZE):
+        self.path = path
+        self.initialSize = initialSize
+        self.compactSize = compactSize
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as f:
+                f.write(MAGIC)
+                f.truncate(self.initialSize)
+
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            self._file.close()
+            raise ValueError('{0} is not a checkpoint log'.format(self.path))
+        self._scan()
+
+    def _scan(self):
+        # account: {field: (updated, offset, length)}
+        self.index = {}
+        self.live = 0
+        self.dead = 0
+
+        size = len(self._map)
+        offset = len(MAGIC)
+        torn = False
+        while offset + RECORD.size <= size:
+            crc, accountLength, fieldLength, updated, valueLength = RECORD.unpack_from(self._map, offset)
+            if not accountLength:
+                break
+            start = offset + RECORD.size
+            end = start + accountLength + fieldLength + valueLength
+            if end > size or zlib.crc32(self._map[offset + 4:end]) & 0xffffffff != crc:
+                torn = True
+                break
+            account = self._map[start:start + accountLength].decode('utf-8')
+            field = self._map[start + accountLength:start + accountLength + fieldLength].decode('utf-8')
+            self._index(account, field, updated, end - valueLength, valueLength, end - offset)
+            offset = end
+        self._end = offset
+
+        # Whatever the crash left past the last good record must not be read later
+        if torn:
+            self._map[offset:] = b'\0' * (size - offset)
+            self._map.flush()
+
+    def _index(self, account, field, updated, offset, length, recordLength):
+        fields = self.index.setdefault(account, {})
+        old = fields.get(field)
+        if old is not None:
+            dead = RECORD.size + len(account.encode('utf-8')) + len(field.encode('utf-8')) + old[2]
+            self.live -= dead
+            self.dead += dead
+        fields[field] = (updated, offset, length)
+        self.live += recordLength
+
+    @staticmethod
+    def pack(account, field, updated, value):
+        account = account.encode('utf-8')
+        field = field.encode('utf-8')
+        body = RECORD.pack(0, len(account), len(field), updated, len(value))[4:] + account + field + value
+        return struct.pack('<I', zlib.crc32(body) & 0xffffffff) + body
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def write(self, records):
+        """(account, field, updated, value) tuples, appended and synced together"""
+        with self._lock:
+            blob = []
+            offsets = []
+            at = self._end
+            for account, field, updated, value in records:
+                record = self.pack(account, field, updated, value)
+                offsets.append((account, field, updated, at + len(record) - len(value), len(value), len(record)))
+                blob.append(record)
+                at += len(record)
+
+            if at > len(self._map):
+                self._grow(at)
+            self._map[self._end:at] = b''.join(blob)
+            self._map.flush()
+            self._end = at
+
+            for entry in offsets:
+                self._index(*entry)
+            if self._end > self.compactSize and self.dead > self.live:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite only the live records, then swap the file in"""
+        records = [
+            (account, field, updated, self._map[offset:offset + length])
+            for account, fields in self.index.items()
+            for field, (updated, offset, length) in fields.items()
+        ]
+        blob = MAGIC + b''.join(self.pack(*record) for record in records)
+
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(blob)
+            f.truncate(max(self.initialSize, len(blob) * 2))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._map.close()
+        self._file.close()
+        os.rename(temp, self.path)
+        self._open()
+
+    def read(self, account):
+        """Field to (updated, value) for one account"""
+        with self._lock:
+            return dict(
+                (field, (updated, self._map[offset:offset + length]))
+                for field, (updated, offset, length) in self.index.get(account, {}).items()
+            )
+
+    def accounts(self):
+        with self._lock:
+            return list(self.index)
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'mmap': MmapBackend,
+}
+
+
+class CheckpointWriter(object):
+    """Latest value per account and field, written out in one batch every interval"""
+
+    def __init__(self, backend, interval=FLUSH_SECONDS):
+        self.backend = backend
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.puts = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.seconds = 0.0
+
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, account, field, value, updated=None):
+        # Returns may be views into a pooled buffer, keep a copy
+        if isinstance(value, memoryview):
+            value = value.tobytes()
+        with self._lock:
+            self._pending[(account, field)] = (updated or time.time(), value)
+            self.puts += 1
+
+    def flush(self):
+        with self._flushLock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            start = time.time()
+            try:
+                self.backend.write([(a, f, t, v) for (a, f), (t, v) in pending.items()])
+            except:
+                # Keep them for the next batch, unless something newer came in
+                with self._lock:
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+                    self.failures += 1
+                raise
+            self.seconds += time.time() - start
+            self.written += len(pending)
+            self.batches += 1
+            return len(pending)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error('(STORE)\t-\tCheckpoint write failed: %s', e)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def report(self):
+        return {
+            'puts': self.puts,
+            'written': self.written,
+            'batches': self.batches,
+            'failures': self.failures,
+            'writeSeconds': self.seconds,
+        }
+
+
+class SessionStore(object):
+    """Checkpoints sessions as they go, so a restart picks up where they were"""
+
+    def __init__(self, backend, interval=FLUSH_SECONDS):
+        self.backend = backend
+        self.writer = CheckpointWriter(backend, interval)
+
+    def put(self, account, field, value):
+        self.writer.put(account, field, value)
+
+    def load(self, account):
+        """Field to (updated, value), whatever was last written for account"""
+        return self.backend.read(account)
+
+    @staticmethod
+    def ticket(saved):
+        """The saved AuthTicket if it's still good"""
+        if 'ticket' not in saved:
+            return None
+        ticket = AuthTicket_pb2.AuthTicket()
+        ticket.ParseFromString(saved['ticket'][1])
+        if ticket.expire_timestamp_ms and ticket.expire_timestamp_ms < getMs():
+            return None
+        return ticket
+
+    @staticmethod
+    def location(saved):
+        """Saved (latitude, longitude), or None"""
+        if 'location' not in saved:
+            return None
+        return LOCATION.unpack(saved['location'][1])
+
+    def close(self):
+        self.writer.close()
+        self.backend.close()
+
+    def report(self):
+        return self.writer.report()
+
+
+def openStore(path, backend='sqlite', interval=FLUSH_SECONDS):
+    return SessionStore(BACKENDS[backend](path), interval)
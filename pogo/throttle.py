@@ -0,0 +1,68 @@
+from POGOProtos.Networking.Requests import RequestType_pb2
+
+import threading
+import time
+
+# Requests per second, per request type
+START_RATE = 1.0
+MIN_RATE = 0.05
+MAX_RATE = 10.0
+
+# AIMD steps: add after each clean response, multiply after each sign of throttling
+INCREASE = 0.1
+DECREASE = 0.5
+
+
+class RateController(object):
+    """AIMD pacing for one account, a rate per RequestType learned from the server"""
+
+    def __init__(self, start=START_RATE, minimum=MIN_RATE, maximum=MAX_RATE,
+                 increase=INCREASE, decrease=DECREASE):
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.rates = {}
+        self.throttles = {}
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def rate(self, requestType):
+        return self.rates.get(requestType, self.start)
+
+    def reserve(self, requestType, now=None):
+        """Claim the next slot for requestType, returns seconds to wait for it"""
+        now = now or time.time()
+        with self._lock:
+            slot = max(now, self._next.get(requestType, 0))
+            self._next[requestType] = slot + 1.0 / self.rate(requestType)
+        return slot - now
+
+    def pace(self, requestType):
+        delay = self.reserve(requestType)
+        if delay > 0:
+            time.sleep(delay)
+
+    def success(self, requestType):
+        with self._lock:
+            self.rates[requestType] = min(self.maximum, self.rate(requestType) + self.increase)
+
+    def throttled(self, requestType):
+        """The server pushed back, slow down and push the next slot out"""
+        with self._lock:
+            rate = max(self.minimum, self.rate(requestType) * self.decrease)
+            self.rates[requestType] = rate
+            self.throttles[requestType] = self.throttles.get(requestType, 0) + 1
+            self._next[requestType] = max(self._next.get(requestType, 0), time.time() + 1.0 / rate)
+
+    def report(self):
+        """Current rate and throttle count by request type name"""
+        with self._lock:
+            return dict(
+                (RequestType_pb2.RequestType.Name(requestType), {
+                    'rate': rate,
+                    'throttled': self.throttles.get(requestType, 0),
+                })
+                for requestType, rate in self.rates.items()
+            )
@@ -0,0 +1,132 @@
+from custom_exceptions import TransportPogoException
+import buffers
+
+from requests.adapters import HTTPAdapter
+import requests
+import socket
+
+# Pool defaults, sized for many sessions sharing a process
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 64
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+
+def keepAliveOptions():
+    """Socket options for long lived, low latency connections"""
+    options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+
+    # Not every platform lets us tune the probes
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE))
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT))
+    return options
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with bigger pools and keep-alive sockets"""
+
+    def __init__(self, poolConnections=POOL_CONNECTIONS, poolMaxsize=POOL_MAXSIZE, socketOptions=None):
+        # Has to exist before the base class builds its pool
+        self.socketOptions = socketOptions or keepAliveOptions()
+        super(TunedHTTPAdapter, self).__init__(
+            pool_connections=poolConnections,
+            pool_maxsize=poolMaxsize
+        )
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs['socket_options'] = self.socketOptions
+        return super(TunedHTTPAdapter, self).init_poolmanager(
+            connections,
+            maxsize,
+            block=block,
+            **pool_kwargs
+        )
+
+    # Pickled adapters are rebuilt through here
+    def __setstate__(self, state):
+        self.socketOptions = state.get('socketOptions') or keepAliveOptions()
+        super(TunedHTTPAdapter, self).__setstate__(state)
+
+
+def tuneSession(session, compress=True, **kwargs):
+    """Mount tuned adapters on a requests session"""
+    session.headers['Connection'] = 'keep-alive'
+    session.headers['Accept-Encoding'] = 'gzip' if compress else 'identity'
+
+    # Pools as big as the callers sharing them, so connections get reused
+    # instead of opened and dropped once more than ten threads are busy
+    adapter = TunedHTTPAdapter(**kwargs)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class Transport(object):
+    """Moves serialized envelopes to the servers and back"""
+
+    def post(self, url, data):
+        """Send raw bytes, returns an object with status_code and content"""
+        raise NotImplementedError()
+
+    def postInto(self, url, data, pool):
+        """Like post, but content may be a view into a buffer from pool"""
+        return self.post(url, data)
+
+    def close(self):
+        pass
+
+
+class BufferedResponse(object):
+    """Status and a body read into a pooled buffer"""
+    __slots__ = ('status_code', 'content')
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class RequestsTransport(Transport):
+    """Default transport on top of a requests session"""
+
+    def __init__(self, session=None, timeout=15.0):
+        if session is None:
+            session = tuneSession(requests.session())
+        self.session = session
+        self.timeout = timeout
+
+    def post(self, url, data):
+        try:
+            return self.session.post(url, data=data, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise TransportPogoException(str(e))
+
+    def postInto(self, url, data, pool):
+        try:
+            rawResponse = self.session.post(url, data=data, timeout=self.timeout, stream=True)
+        except requests.exceptions.RequestException as e:
+            raise TransportPogoException(str(e))
+
+        # Read the socket straight into a reusable buffer
+        raw = rawResponse.raw
+        raw.decode_content = True
+        buf = pool.acquire()
+        try:
+            length = buffers.readInto(raw, buf)
+        except Exception as e:
+            buf.leased = False
+            raise TransportPogoException(str(e))
+        finally:
+            raw.release_conn()
+
+        return BufferedResponse(rawResponse.status_code, pool.handOff(buf, length))
+
+    def close(self):
+        self.session.close()